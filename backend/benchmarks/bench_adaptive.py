@@ -0,0 +1,69 @@
+''' Compares the time to choose the next adaptive quiz question of
+a query filtering the category and difficulty in the db
+(NOT IN ... ORDER BY random() LIMIT 1) and DifficultyIndex.draw(),
+as the question bank grows. Only the choice of the id is timed,
+loading the chosen question is the same primary key lookup for both.
+
+Run from the backend directory:
+    python -m benchmarks.bench_adaptive [sizes] [previous_length]
+e.g.
+    python -m benchmarks.bench_adaptive 10000,100000,1000000 20
+'''
+import random
+import sys
+from sqlalchemy import func
+
+from models import db, Question
+from flaskr.adaptive import DifficultyIndex
+from benchmarks.common import make_app, seed_questions, time_call
+
+CATEGORY_ID = 1
+DIFFICULTY = 3
+DRAWS = 1000
+
+
+def pick_id_in_db(category_id, difficulty, previous_ids):
+    ''' The same choice made by the db. '''
+
+    return db.session.query(Question.id) \
+        .filter(Question.category == category_id, Question.difficulty == difficulty,
+                ~Question.id.in_(previous_ids)) \
+        .order_by(func.random()).limit(1).scalar()
+
+
+def main():
+    sizes = [int(size) for size in (sys.argv[1] if len(sys.argv) > 1
+                                    else '10000,100000,1000000').split(',')]
+    previous_length = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+    print('{:>10} {:>12} {:>14} {:>14} {:>12}'.format(
+        'questions', 'band size', 'db query ms', 'index us', 'rebuild ms'))
+
+    app = make_app()
+
+    with app.app_context():
+        for size in sizes:
+            # Topped up, so sizes must grow
+            seed_questions(size - Question.query.count())
+
+            index = DifficultyIndex()
+            rebuild_ms = time_call(index.rebuild, repeat=1)
+
+            band = index.ids(CATEGORY_ID, DIFFICULTY)
+            previous_ids = set(random.sample(list(band), min(previous_length, len(band))))
+
+            query_ms = time_call(lambda: pick_id_in_db(
+                CATEGORY_ID, DIFFICULTY, list(previous_ids)), repeat=3)
+
+            def draws():
+                for _ in range(DRAWS):
+                    index.draw(CATEGORY_ID, DIFFICULTY, previous_ids)
+
+            index_us = time_call(draws) * 1000 / DRAWS
+
+            print('{:>10} {:>12} {:>14.3f} {:>14.3f} {:>12.1f}'.format(
+                size, len(band), query_ms, index_us, rebuild_ms))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+''' Compares deleting and updating many questions one id at a time,
+like a client calling DELETE /questions/<id> in a loop (and its ORM
+equivalent for updates), with one DELETE /questions or PATCH /questions
+request running a single statement.
+
+Run from the backend directory:
+    python -m benchmarks.bench_bulk [counts] [database_path]
+e.g.
+    python -m benchmarks.bench_bulk 100,1000,10000
+'''
+import sys
+import time
+
+from models import db, Question
+from flaskr import create_app
+from benchmarks.common import make_app, seed_questions
+
+BASE_SIZE = 10000
+
+
+def elapsed_ms(function):
+    start = time.perf_counter()
+    function()
+    return (time.perf_counter() - start) * 1000
+
+
+def take_ids(count):
+    ''' Helper function: Returns the ids of count questions, from the top. '''
+
+    return [question_id for question_id, in db.session.query(Question.id)
+            .order_by(Question.id.desc()).limit(count)]
+
+
+def update_one_by_one(ids):
+    ''' The ORM loop a per question PATCH would run. '''
+
+    for question_id in ids:
+        question = Question.query.get(question_id)
+        question.difficulty = 5
+        question.update()
+
+
+def main():
+    counts = [int(count) for count in (sys.argv[1] if len(sys.argv) > 1
+                                       else '100,1000,10000').split(',')]
+    database_path = sys.argv[2] if len(sys.argv) > 2 else None
+
+    seed_app = make_app(database_path)
+    client = create_app({'SQLALCHEMY_DATABASE_URI':
+                         seed_app.config['SQLALCHEMY_DATABASE_URI']}).test_client()
+
+    print('{:>8} {:>16} {:>16} {:>16} {:>16}'.format(
+        'rows', 'delete loop ms', 'bulk delete ms', 'update loop ms', 'bulk update ms'))
+
+    for count in counts:
+        with seed_app.app_context():
+            seed_questions(max(BASE_SIZE, count * 2))
+
+            ids = take_ids(count)
+            update_loop_ms = elapsed_ms(lambda: update_one_by_one(ids))
+            bulk_update_ms = elapsed_ms(lambda: client.patch('/questions', json={
+                'ids': ids, 'changes': {'difficulty': 1}}))
+
+            loop_ids = take_ids(count)
+            delete_loop_ms = elapsed_ms(lambda: [
+                client.delete('/questions/{}'.format(question_id)) for question_id in loop_ids])
+
+            bulk_ids = take_ids(count)
+            bulk_delete_ms = elapsed_ms(lambda: client.delete('/questions', json={'ids': bulk_ids}))
+
+            db.session.remove()
+
+        print('{:>8} {:>16.1f} {:>16.1f} {:>16.1f} {:>16.1f}'.format(
+            count, delete_loop_ms, bulk_delete_ms, update_loop_ms, bulk_update_ms))
+
+
+if __name__ == '__main__':
+    main()
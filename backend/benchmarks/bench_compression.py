@@ -0,0 +1,73 @@
+''' Measures the bytes sent and the server CPU time per response of the
+large list endpoints, uncompressed and with each encoding the app offers.
+
+CPU is the process time of a request through the Flask test client, with
+the response cache warm (so cached lists reuse their compressed body), and
+the time to compress the body alone, which is what an uncached response
+pays on top. The last rows show a revalidation (If-None-Match) answered
+with a 304.
+
+Run from the backend directory:
+    python -m benchmarks.bench_compression [question_count] [database_uri]
+'''
+import sys
+import time
+
+from models import Question
+from flaskr import create_app
+from flaskr.compression import Compressor, ENCODINGS
+from benchmarks.common import make_app, seed_questions, time_call
+
+REQUESTS = (
+    ('GET /questions', 'GET', '/questions', None),
+    ('GET /questions per_page=100', 'GET', '/questions?per_page=100', None),
+    ('POST /search', 'POST', '/search?per_page=100', {'searchTerm': 'river'}),
+    ('GET /questions/export', 'GET', '/questions/export?category=1', None),
+)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    database_path = sys.argv[2] if len(sys.argv) > 2 else None
+
+    seed_app = make_app(database_path)
+    with seed_app.app_context():
+        if Question.query.count() < count:
+            seed_questions(count - Question.query.count())
+
+    client = create_app({'SQLALCHEMY_DATABASE_URI':
+                         seed_app.config['SQLALCHEMY_DATABASE_URI']}).test_client()
+    compressor = Compressor()
+
+    print('{:<30} {:>9} {:>12} {:>12} {:>14}'.format(
+        'request', 'encoding', 'bytes', 'cpu ms', 'compress ms'))
+
+    for name, method, path, body in REQUESTS:
+        plain = client.open(path, method=method, json=body).get_data()
+
+        for encoding in ('identity',) + ENCODINGS:
+            headers = {'Accept-Encoding': encoding}
+
+            def request():
+                return client.open(path, method=method, json=body, headers=headers).get_data()
+
+            sent = request()
+            cpu_ms = time_call(request, repeat=10, clock=time.process_time)
+
+            compress_ms = 0.0
+            if encoding != 'identity':
+                compress_ms = time_call(lambda: compressor.compress(plain, encoding),
+                                        repeat=10, clock=time.process_time)
+
+            print('{:<30} {:>9} {:>12} {:>12.3f} {:>14.3f}'.format(
+                name, encoding, len(sent), cpu_ms, compress_ms))
+
+    for name, method, path, body in REQUESTS[:2]:
+        etag = client.get(path).headers['ETag']
+        cpu_ms = time_call(lambda: client.get(path, headers={'If-None-Match': etag}),
+                           repeat=10, clock=time.process_time)
+        print('{:<30} {:>9} {:>12} {:>12.3f} {:>14}'.format(name, '304', 0, cpu_ms, '-'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,277 @@
+''' Benchmarks every API endpoint at growing table sizes.
+
+The database is seeded with generated questions at each scale (topped up,
+so scales must grow), then each endpoint is driven by concurrent clients,
+through the Flask test client or, with --server, a running server using
+the same database. Reports requests/sec, p50/p95/p99 latency, queries per
+request (from X-DB-Query-Count) and the peak RSS of this process as JSON.
+
+With --baseline, the results are compared to a previous --output and the
+script exits with status 1 on a regression beyond --tolerance.
+
+Run from the backend directory:
+    python -m benchmarks.bench_endpoints --scales 1000,10000,100000 --output results.json
+    python -m benchmarks.bench_endpoints --scales 1000,10000,100000 --baseline results.json
+    python -m benchmarks.bench_endpoints --database postgresql://postgres@localhost:5432/trivia_bench \\
+        --server http://127.0.0.1:8000 --scales 1000000
+'''
+import argparse
+import http.client
+import json
+import random
+import resource
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from models import db, Question
+from flaskr import create_app
+from benchmarks.common import make_app, seed_questions, CATEGORIES, WORDS
+
+# A latency must grow by this many ms too to count as a regression
+MIN_LATENCY_MS = 5.0
+
+# p99 is reported but, from a few hundred requests, too noisy to compare
+COMPARED_LATENCIES = ('p50_ms', 'p95_ms')
+
+
+def endpoint_requests(question_count):
+    ''' Helper function: Returns {name: make_request(rng)} for each endpoint.
+    make_request returns (method, path, json body or None). '''
+
+    pages = max(1, question_count // 10)
+
+    def delete_question(rng):
+        # Ids from the top tenth, so the other endpoints keep most of their data
+        return 'DELETE', '/questions/{}'.format(
+            question_count - rng.randrange(max(1, question_count // 10))), None
+
+    return {
+        'GET /categories': lambda rng: ('GET', '/categories', None),
+        'GET /questions': lambda rng: ('GET', '/questions?page={}'.format(
+            rng.randint(1, min(pages, 10))), None),
+        'GET /questions deep page': lambda rng: ('GET', '/questions?page={}'.format(
+            rng.randint(1, pages)), None),
+        'GET /categories/id/questions': lambda rng: ('GET', '/categories/{}/questions'.format(
+            rng.randint(1, len(CATEGORIES))), None),
+        'POST /search': lambda rng: ('POST', '/search', {
+            'searchTerm': ' '.join(rng.sample(WORDS, 2))}),
+        'POST /quizzes': lambda rng: ('POST', '/quizzes', {
+            'quiz_category': {'id': rng.randint(0, len(CATEGORIES))},
+            'previous_questions': [rng.randint(1, question_count) for _ in range(10)]}),
+        'DELETE /questions/id': delete_question,
+    }
+
+
+class TestClientDriver:
+    ''' Sends requests through the Flask test client, one client per thread. '''
+
+    def __init__(self, app):
+        self.app = app
+        self._local = threading.local()
+
+    def request(self, method, path, body):
+        ''' Returns (status, query count) of one request. '''
+
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+
+        response = client.open(path, method=method, json=body)
+        response.get_data()
+
+        return response.status_code, int(response.headers.get('X-DB-Query-Count', 0))
+
+
+class ServerDriver:
+    ''' Sends requests to a running server, one keep-alive connection per thread. '''
+
+    def __init__(self, url):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self._local = threading.local()
+
+    def request(self, method, path, body):
+        ''' Returns (status, query count) of one request. '''
+
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = self._local.connection = http.client.HTTPConnection(self.host, self.port)
+
+        headers = {'Content-Type': 'application/json'}
+        connection.request(method, path, json.dumps(body) if body is not None else None, headers)
+        response = connection.getresponse()
+        response.read()
+
+        return response.status, int(response.getheader('X-DB-Query-Count', 0))
+
+
+def percentile(values, fraction):
+    return values[min(len(values)-1, int(len(values) * fraction))]
+
+
+def run_endpoint(driver, make_request, requests, concurrency, seed=0):
+    ''' Helper function: Sends requests from concurrency threads,
+    returns the measurements. '''
+
+    latencies = []
+    query_counts = []
+    errors = [0]
+    lock = threading.Lock()
+
+    def worker(worker_number):
+        rng = random.Random(seed * 1000 + worker_number)
+        for _ in range(requests // concurrency):
+            method, path, body = make_request(rng)
+            start = time.perf_counter()
+            status, queries = driver.request(method, path, body)
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed * 1000)
+                query_counts.append(queries)
+                # 404 is expected for an already deleted question
+                if status >= 500:
+                    errors[0] += 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        list(executor.map(worker, range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+
+    return {
+        'requests': len(latencies),
+        'errors': errors[0],
+        'requests_per_second': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 0.50), 3),
+        'p95_ms': round(percentile(latencies, 0.95), 3),
+        'p99_ms': round(percentile(latencies, 0.99), 3),
+        'queries_per_request': round(sum(query_counts) / len(query_counts), 2),
+        # Kilobytes on Linux
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def median_result(runs):
+    ''' Helper function: Combines repeated runs of an endpoint,
+    taking the median of every measurement to damp the noise. '''
+
+    result = {key: statistics.median(run[key] for run in runs) for key in runs[0]}
+    result['peak_rss_kb'] = max(run['peak_rss_kb'] for run in runs)
+
+    return result
+
+
+def compare(results, baseline, tolerance):
+    ''' Helper function: Returns a message for every measurement of results
+    that is worse than in baseline by more than tolerance (a fraction). '''
+
+    regressions = []
+
+    for scale, endpoints in results['scales'].items():
+        for name, result in endpoints.items():
+            base = baseline.get('scales', {}).get(scale, {}).get(name)
+            if base is None:
+                continue
+
+            label = '{} at {} questions'.format(name, scale)
+
+            for key in COMPARED_LATENCIES:
+                limit = max(base[key] * (1 + tolerance), base[key] + MIN_LATENCY_MS)
+                if result[key] > limit:
+                    regressions.append('{}: {} {} > {}'.format(label, key, result[key], base[key]))
+
+            if result['requests_per_second'] < base['requests_per_second'] * (1 - tolerance):
+                regressions.append('{}: requests_per_second {} < {}'.format(
+                    label, result['requests_per_second'], base['requests_per_second']))
+
+            # Query counts barely vary between runs, so allow half a query
+            if result['queries_per_request'] > base['queries_per_request'] + 0.5:
+                regressions.append('{}: queries_per_request {} > {}'.format(
+                    label, result['queries_per_request'], base['queries_per_request']))
+
+            if result['errors'] > base['errors']:
+                regressions.append('{}: errors {} > {}'.format(
+                    label, result['errors'], base['errors']))
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scales', default='1000,10000',
+                        help='Comma separated question counts, growing.')
+    parser.add_argument('--database', help='Defaults to a new SQLite file.')
+    parser.add_argument('--server', help='Base URL of a server using --database.')
+    parser.add_argument('--requests', type=int, default=500, help='Per endpoint.')
+    parser.add_argument('--concurrency', type=int,
+                        help='Client threads. Defaults to 8 with --server and to 1 with '
+                             'the test client, whose threads mostly measure the GIL.')
+    parser.add_argument('--output', help='Write the results to this JSON file.')
+    parser.add_argument('--baseline', help='Compare to the results in this JSON file.')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Runs per endpoint, the median is reported.')
+    parser.add_argument('--tolerance', type=float, default=0.5)
+    args = parser.parse_args()
+
+    if args.server and not args.database:
+        parser.error('--server needs the --database it uses, to seed it')
+
+    if args.concurrency is None:
+        args.concurrency = 8 if args.server else 1
+
+    seed_app = make_app(args.database)
+    database_path = seed_app.config['SQLALCHEMY_DATABASE_URI']
+
+    if args.server:
+        driver = ServerDriver(args.server)
+    else:
+        driver = TestClientDriver(create_app({'SQLALCHEMY_DATABASE_URI': database_path}))
+
+    results = {'database': database_path.split('://')[0], 'server': args.server,
+               'requests': args.requests, 'concurrency': args.concurrency,
+               'repeat': args.repeat, 'scales': {}}
+
+    for scale in sorted(int(scale) for scale in args.scales.split(',')):
+        with seed_app.app_context():
+            count = Question.query.count()
+            if count < scale:
+                seed_questions(scale - count)
+            max_id = db.session.query(db.func.max(Question.id)).scalar()
+
+        endpoints = {}
+        for name, make_request in endpoint_requests(max_id).items():
+            # Warm up the caches and the connection pool first
+            run_endpoint(driver, make_request, args.concurrency, args.concurrency, seed=-1)
+            endpoints[name] = median_result([
+                run_endpoint(driver, make_request, args.requests, args.concurrency, seed=repeat)
+                for repeat in range(args.repeat)])
+            print('{:>8} {:<30} {}'.format(scale, name, json.dumps(endpoints[name])),
+                  file=sys.stderr)
+
+        results['scales'][str(scale)] = endpoints
+
+    print(json.dumps(results, indent=2))
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compare(results, json.load(baseline_file), args.tolerance)
+
+        for regression in regressions:
+            print('REGRESSION ' + regression, file=sys.stderr)
+
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+''' Compares the import throughput (rows/sec) of one Question.insert()
+per row, the path behind POST /questions, and BulkImporter batches.
+
+Run from the backend directory:
+    python -m benchmarks.bench_import [row_count] [database_uri]
+'''
+import sys
+import time
+
+from flaskr.bulk import BulkImporter
+from models import Question
+from benchmarks.common import make_app, seed_questions
+
+PER_ROW_LIMIT = 5000
+
+
+def generate_rows(count):
+    for i in range(count):
+        yield i + 1, {'question': 'Imported question {}?'.format(i),
+                      'answer': 'answer {}'.format(i),
+                      'category': i % 6 + 1, 'difficulty': i % 5 + 1}
+
+
+def insert_per_row(count):
+    for _, row in generate_rows(count):
+        Question(**row).insert()
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    database_path = sys.argv[2] if len(sys.argv) > 2 else None
+
+    app = make_app(database_path)
+
+    with app.app_context():
+        # Only the categories are needed
+        seed_questions(0)
+
+        print('{:>24} {:>10} {:>12}'.format('path', 'rows', 'rows/sec'))
+
+        # One commit per row is slow, so it gets fewer rows
+        per_row_count = min(count, PER_ROW_LIMIT)
+        start = time.perf_counter()
+        insert_per_row(per_row_count)
+        elapsed = time.perf_counter() - start
+        print('{:>24} {:>10} {:>12.0f}'.format('Question.insert()', per_row_count,
+                                               per_row_count / elapsed))
+
+        for batch_size in (100, 1000, 10000):
+            start = time.perf_counter()
+            summary = BulkImporter(batch_size=batch_size).run(generate_rows(count))
+            elapsed = time.perf_counter() - start
+            print('{:>24} {:>10} {:>12.0f}'.format(
+                'bulk, batch {}'.format(batch_size), summary['inserted'],
+                summary['inserted'] / elapsed))
+
+
+if __name__ == '__main__':
+    main()
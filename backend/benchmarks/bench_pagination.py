@@ -0,0 +1,45 @@
+''' Compares the time per page of OFFSET and keyset (cursor) pagination
+at increasing depths.
+
+Run from the backend directory:
+    python -m benchmarks.bench_pagination [question_count] [database_uri]
+'''
+import sys
+
+from models import Question
+from flaskr.pagination import Page, CursorPage, QUESTIONS_PER_PAGE
+from benchmarks.common import make_app, seed_questions, time_call
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    database_path = sys.argv[2] if len(sys.argv) > 2 else None
+
+    app = make_app(database_path)
+
+    with app.app_context():
+        if Question.query.count() < count:
+            seed_questions(count - Question.query.count())
+
+        # The first id of every page, to build the equivalent cursor
+        ids = [row.id for row in Question.query.with_entities(
+            Question.id).order_by(Question.id)]
+
+        print('{:>10} {:>12} {:>12}'.format('page', 'offset ms', 'keyset ms'))
+
+        page_number = 1
+        while (page_number-1)*QUESTIONS_PER_PAGE < len(ids):
+            start = (page_number-1)*QUESTIONS_PER_PAGE
+            after = ids[start-1] if start > 0 else None
+
+            offset_ms = time_call(lambda: Page(
+                Question.query, Question.id, page_number, QUESTIONS_PER_PAGE))
+            keyset_ms = time_call(lambda: CursorPage(
+                Question.query, Question.id, after, QUESTIONS_PER_PAGE))
+
+            print('{:>10} {:>12.3f} {:>12.3f}'.format(page_number, offset_ms, keyset_ms))
+            page_number *= 10
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+''' Compares the time per POST /quizzes draw of the old approach
+(load the category, filter previous questions, random.choice)
+and QuestionSampler, with long previous_questions lists.
+
+Run from the backend directory:
+    python -m benchmarks.bench_quizzes [sizes] [previous_lengths]
+e.g.
+    python -m benchmarks.bench_quizzes 10000,100000,1000000 0,100,1000
+'''
+import random
+import sys
+
+from models import Question
+from flaskr.quiz import QuestionSampler
+from benchmarks.common import make_app, seed_questions, time_call
+
+CATEGORY_ID = 1
+
+
+def load_category_and_filter(category_id, previous_ids):
+    ''' The selection POST /quizzes used before QuestionSampler. '''
+
+    questions = Question.query.filter(Question.category == category_id).all()
+    questions_to_play = [question for question in questions
+                         if question.id not in previous_ids]
+
+    return random.choice(questions_to_play) if questions_to_play else None
+
+
+def main():
+    sizes = [int(size) for size in (sys.argv[1] if len(sys.argv) > 1
+                                    else '10000,100000,1000000').split(',')]
+    previous_lengths = [int(length) for length in (sys.argv[2] if len(sys.argv) > 2
+                                                   else '0,100,1000').split(',')]
+
+    print('{:>10} {:>10} {:>14} {:>14}'.format(
+        'questions', 'previous', 'full load ms', 'sampler ms'))
+
+    for size in sizes:
+        app = make_app()
+
+        with app.app_context():
+            seed_questions(size)
+
+            sampler = QuestionSampler()
+            category_ids = list(sampler.category_ids(CATEGORY_ID))
+
+            for previous_length in previous_lengths:
+                previous_ids = random.sample(
+                    category_ids, min(previous_length, len(category_ids)))
+
+                full_ms = time_call(lambda: load_category_and_filter(
+                    CATEGORY_ID, previous_ids), repeat=1 if size >= 1000000 else 3)
+                sampler_ms = time_call(
+                    lambda: sampler.pick(CATEGORY_ID, previous_ids), repeat=20)
+
+                print('{:>10} {:>10} {:>14.3f} {:>14.3f}'.format(
+                    size, previous_length, full_ms, sampler_ms))
+
+
+if __name__ == '__main__':
+    main()
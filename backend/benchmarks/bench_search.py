@@ -0,0 +1,57 @@
+''' Compares the time per POST /search query of the ILIKE '%term%' scan
+and the search engines.
+
+Run from the backend directory:
+    python -m benchmarks.bench_search [question_count] [database_uri]
+The PostgreSQL full text engine is included when database_uri is PostgreSQL.
+'''
+import sys
+import tracemalloc
+
+from models import Question
+from flaskr.search import (LikeSearchEngine, InvertedIndexSearchEngine,
+                           PostgresSearchEngine)
+from benchmarks.common import make_app, seed_questions, time_call
+
+TERMS = ['river', 'largest planet', 'king', 'which composer', 'isl']
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    database_path = sys.argv[2] if len(sys.argv) > 2 else None
+
+    app = make_app(database_path)
+
+    with app.app_context():
+        if Question.query.count() < count:
+            seed_questions(count - Question.query.count())
+
+        engines = [('ilike', LikeSearchEngine()),
+                   ('inverted index', InvertedIndexSearchEngine())]
+
+        if app.config['SQLALCHEMY_DATABASE_URI'].startswith('postgres'):
+            postgres_engine = PostgresSearchEngine()
+            postgres_engine.create_indexes()
+            engines.append(('full text', postgres_engine))
+
+        build_ms = time_call(engines[1][1].rebuild, repeat=1)
+
+        # Built again under tracemalloc, which slows it down, for its size
+        tracemalloc.start()
+        engines[1][1].rebuild()
+        index_mb = tracemalloc.get_traced_memory()[0] / 2**20
+        tracemalloc.stop()
+
+        print('inverted index build: {:.1f} ms, {:.1f} MB'.format(build_ms, index_mb))
+
+        print('{:>16} {:>16} {:>10} {:>12}'.format('term', 'engine', 'matches', 'ms'))
+
+        for term in TERMS:
+            for name, engine in engines:
+                _, total = engine.search(term, 0, 10)
+                elapsed = time_call(lambda: engine.search(term, 0, 10))
+                print('{:>16} {:>16} {:>10} {:>12.3f}'.format(term, name, total, elapsed))
+
+
+if __name__ == '__main__':
+    main()
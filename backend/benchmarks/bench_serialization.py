@@ -0,0 +1,52 @@
+''' Compares the CPU time to build a page of questions as JSON:
+ORM objects + format() + jsonify, against column rows encoded with
+the json module and with orjson (when installed).
+
+Run from the backend directory:
+    python -m benchmarks.bench_serialization [question_count] [database_uri]
+'''
+import sys
+import time
+from flask import jsonify
+
+from models import Question
+from flaskr.serialization import question_query, format_rows, SERIALIZERS
+from benchmarks.common import make_app, seed_questions, time_call
+
+PAGE_SIZES = (10, 100, 1000)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else max(PAGE_SIZES)
+    database_path = sys.argv[2] if len(sys.argv) > 2 else None
+
+    app = make_app(database_path)
+
+    with app.app_context():
+        if Question.query.count() < count:
+            seed_questions(count - Question.query.count())
+
+        def orm_jsonify(size):
+            questions = Question.query.order_by(Question.id).limit(size).all()
+            return jsonify({'questions': [question.format() for question in questions],
+                            'success': True}).get_data()
+
+        def rows_dumps(dumps, size):
+            rows = question_query().order_by(Question.id).limit(size).all()
+            return dumps({'questions': format_rows(rows), 'success': True})
+
+        variants = [('orm+jsonify', orm_jsonify)]
+        for name, dumps in sorted(SERIALIZERS.items()):
+            variants.append(('rows+' + name, lambda size, dumps=dumps: rows_dumps(dumps, size)))
+
+        print('{:>10}'.format('page size') +
+              ''.join('{:>16}'.format(name + ' ms') for name, _ in variants))
+
+        for size in PAGE_SIZES:
+            times = [time_call(lambda: function(size), repeat=20, clock=time.process_time)
+                     for _, function in variants]
+            print('{:>10}'.format(size) + ''.join('{:>16.3f}'.format(ms) for ms in times))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+''' Measures the cold start of a worker: importing the app, create_app()
+and the first requests, each in a new Python process so nothing is
+already imported or connected.
+
+'eager' creates the tables at startup (db.create_all(), what setup_db did
+on every create_app), 'lazy' leaves them to flask db-upgrade. The first
+GET /categories then pays for the first connection in 'lazy' mode.
+Each row is the median of the runs.
+
+Run from the backend directory:
+    python -m benchmarks.bench_startup [runs] [database_uri]
+e.g.
+    python -m benchmarks.bench_startup 10 postgresql://postgres@localhost:5432/trivia_bench
+'''
+import json
+import statistics
+import subprocess
+import sys
+
+from benchmarks.common import make_app, seed_questions
+from models import Question
+
+# Run in the new process, prints the timings (ms) as JSON
+WORKER = '''
+import json, sys, time
+start = time.perf_counter()
+from flaskr import create_app
+from models import db
+imported = time.perf_counter()
+app = create_app({'SQLALCHEMY_DATABASE_URI': sys.argv[1]})
+if sys.argv[2] == 'eager':
+    with app.app_context():
+        db.create_all()
+created = time.perf_counter()
+client = app.test_client()
+client.get('/categories')
+first = time.perf_counter()
+client.post('/search', json={'searchTerm': 'river'})
+search = time.perf_counter()
+print(json.dumps({'import': (imported - start) * 1000, 'create_app': (created - imported) * 1000,
+                  'first_request': (first - created) * 1000,
+                  'first_search': (search - first) * 1000, 'total': (search - start) * 1000}))
+'''
+
+COLUMNS = ('import', 'create_app', 'first_request', 'first_search', 'total')
+
+
+def run_worker(database_path, mode):
+    ''' Returns the timings of one cold start. '''
+
+    output = subprocess.run([sys.executable, '-c', WORKER, database_path, mode],
+                            check=True, stdout=subprocess.PIPE).stdout
+
+    return json.loads(output.decode().splitlines()[-1])
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    database_path = sys.argv[2] if len(sys.argv) > 2 else None
+
+    seed_app = make_app(database_path)
+    with seed_app.app_context():
+        if Question.query.count() < 1000:
+            seed_questions(1000 - Question.query.count())
+
+    database_path = seed_app.config['SQLALCHEMY_DATABASE_URI']
+
+    print('{:<8}'.format('mode') + ''.join('{:>18}'.format(column + ' ms') for column in COLUMNS))
+
+    for mode in ('eager', 'lazy'):
+        timings = [run_worker(database_path, mode) for _ in range(runs)]
+
+        print('{:<8}'.format(mode) + ''.join(
+            '{:>18.1f}'.format(statistics.median(timing[column] for timing in timings))
+            for column in COLUMNS))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+import os
+import random
+import tempfile
+import time
+from flask import Flask
+
+from models import setup_db, db, Question, Category
+
+CATEGORIES = ['Science', 'Art', 'Geography', 'History', 'Entertainment', 'Sports']
+
+WORDS = ['what', 'which', 'who', 'largest', 'river', 'painting', 'king', 'planet',
+         'team', 'city', 'movie', 'element', 'ocean', 'author', 'war', 'invented',
+         'country', 'mountain', 'album', 'composer', 'island', 'battle', 'organ']
+
+
+def make_app(database_path=None):
+    ''' Helper function: Returns a bare app bound to database_path,
+    with its tables created. Defaults to a fresh SQLite file in the temp directory. '''
+
+    if database_path is None:
+        handle, filename = tempfile.mkstemp(suffix='.db', prefix='trivia_bench_')
+        os.close(handle)
+        database_path = 'sqlite:///' + filename
+
+    app = Flask(__name__)
+    setup_db(app, database_path, create_tables=True)
+
+    return app
+
+
+def seed_questions(count, batch_size=10000, seed=0):
+    ''' Helper function: Inserts the categories and count generated questions.
+    Must be called inside an app context. '''
+
+    rng = random.Random(seed)
+
+    if Category.query.count() == 0:
+        db.session.execute(Category.__table__.insert(),
+                           [{'type': category} for category in CATEGORIES])
+
+    for start in range(0, count, batch_size):
+        rows = []
+        for i in range(start, min(start+batch_size, count)):
+            rows.append({
+                'question': '{} {}?'.format(' '.join(rng.choice(WORDS) for _ in range(6)), i),
+                'answer': 'answer {}'.format(i),
+                'category': rng.randint(1, len(CATEGORIES)),
+                'difficulty': rng.randint(1, 5)
+            })
+        db.session.execute(Question.__table__.insert(), rows)
+
+    db.session.commit()
+
+
+def time_call(function, repeat=5, clock=time.perf_counter):
+    ''' Helper function: Returns the best wall time of function() in milliseconds.
+    Pass clock=time.process_time to measure CPU time instead. '''
+
+    best = None
+    for _ in range(repeat):
+        start = clock()
+        function()
+        elapsed = (clock() - start) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best
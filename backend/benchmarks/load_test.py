@@ -0,0 +1,115 @@
+''' Load test of a running server: requests/sec and latency percentiles
+of POST /quizzes (random category, a few previous questions) at a given
+concurrency, over keep-alive connections. Pass several base URLs to
+compare them, e.g. the WSGI and the ASGI app on the same database:
+
+    DATABASE_URL=postgresql://postgres@localhost:5432/trivia_bench \
+        gunicorn -w 1 --threads 16 -b 127.0.0.1:8000 'flaskr:create_app()' &
+    DATABASE_URL=postgresql://postgres@localhost:5432/trivia_bench \
+        uvicorn --factory flaskr.asgi:create_asgi_app --port 8001 &
+
+Run from the backend directory:
+    python -m benchmarks.load_test http://127.0.0.1:8000 http://127.0.0.1:8001 \
+        [--requests 5000] [--concurrency 64] [--path /quizzes]
+'''
+import argparse
+import asyncio
+import json
+import random
+import time
+from urllib.parse import urlsplit
+
+from benchmarks.common import CATEGORIES
+
+
+def quiz_body(rng):
+    return json.dumps({'quiz_category': {'id': rng.randint(1, len(CATEGORIES))},
+                       'previous_questions': [rng.randint(1, 1000) for _ in range(5)]})
+
+
+async def send_request(reader, writer, host, method, path, body):
+    body = body.encode('utf-8')
+    writer.write('{} {} HTTP/1.1\r\nHost: {}\r\nContent-Type: application/json\r\n'
+                 'Content-Length: {}\r\n\r\n'.format(method, path, host, len(body))
+                 .encode('ascii') + body)
+    await writer.drain()
+
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        if name.lower() == 'content-length':
+            length = int(value)
+
+    await reader.readexactly(length)
+
+    return status
+
+
+async def client(url, method, path, count, latencies, errors, seed):
+    parts = urlsplit(url)
+    reader, writer = await asyncio.open_connection(parts.hostname, parts.port or 80)
+    rng = random.Random(seed)
+
+    try:
+        for _ in range(count):
+            body = quiz_body(rng) if method == 'POST' else ''
+            start = time.perf_counter()
+            status = await send_request(reader, writer, parts.netloc, method, path, body)
+            latencies.append(time.perf_counter() - start)
+            if status >= 400:
+                errors.append(status)
+    finally:
+        writer.close()
+
+
+def percentile(values, fraction):
+    return values[min(len(values)-1, int(len(values) * fraction))]
+
+
+async def run(url, method, path, requests, concurrency):
+    latencies = []
+    errors = []
+    per_client = max(1, requests // concurrency)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[client(url, method, path, per_client, latencies, errors, seed)
+                           for seed in range(concurrency)])
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+
+    return {'url': url, 'requests': len(latencies), 'errors': len(errors),
+            'requests_per_second': len(latencies) / elapsed,
+            'p50_ms': percentile(latencies, 0.50) * 1000,
+            'p99_ms': percentile(latencies, 0.99) * 1000}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('urls', nargs='+')
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--path', default='/quizzes')
+    parser.add_argument('--method', default=None,
+                        help='Defaults to POST for /quizzes, GET otherwise.')
+    args = parser.parse_args()
+
+    method = args.method or ('POST' if args.path == '/quizzes' else 'GET')
+
+    print('{:<30} {:>10} {:>8} {:>10} {:>10}'.format('url', 'req/s', 'errors', 'p50 ms', 'p99 ms'))
+
+    for url in args.urls:
+        # A short warm up fills the caches and the connection pools
+        asyncio.run(run(url, method, args.path, args.concurrency, args.concurrency))
+
+        result = asyncio.run(run(url, method, args.path, args.requests, args.concurrency))
+        print('{url:<30} {requests_per_second:>10.1f} {errors:>8} '
+              '{p50_ms:>10.2f} {p99_ms:>10.2f}'.format(**result))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,79 +1,182 @@
 import os
-from flask import Flask, request, abort, jsonify
+import click
+import csv
+import datetime
+from flask import Flask, Response, request, abort, jsonify, stream_with_context, g
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
+from array import array
+import math
 import random
 import sys
 
-from models import setup_db, Question, Category
-
-QUESTIONS_PER_PAGE = 10
+from models import setup_db, db, use_replicas, Question
+from flaskr.lazy import Lazy
+from flaskr.pagination import paginate, get_offset_args, next_offset_cursor
+from flaskr.quiz import QuestionSampler, MAX_QUIZ_BATCH
+from flaskr.sessions import create_session_store, new_session_id, MISSING
+from flaskr.cache import CategoryCache, create_response_cache
+from flaskr.compression import create_compressor
+from flaskr.ratelimit import create_rate_limiter
+from flaskr.stats import QuestionStats
+from flaskr.adaptive import DifficultyIndex, next_difficulty
+from flaskr.packs import create_quiz_packs, start_pack_scheduler, parse_day, today
+from flaskr.search import create_search_engine, PostgresSearchEngine
+from flaskr.bulk import (BulkImporter, read_ndjson, read_csv, decode_lines, IMPORT_BATCH_SIZE,
+                         question_conditions, validate_changes, count_questions,
+                         bulk_delete, bulk_update)
+from flaskr.export import export_chunks, EXPORT_MIMETYPES
+from flaskr.serialization import create_serializer, question_query, format_rows
+from flaskr.instrumentation import (add_db_timing_headers, pool_status, ping, Metrics,
+                                    start_request_timer, request_duration,
+                                    start_profiler, profile_response)
+from migrations import upgrade
+
+
+# POST endpoints that only read, so they can use the read replicas too
+READ_ONLY_ENDPOINTS = ('search_questions', 'play_trivia_game', 'create_quiz_session',
+                       'next_quiz_session_question')
 
 
 def create_app(test_config=None):
 
     # Create and configure the app
     app = Flask(__name__)
+    app.config.from_mapping(
+        QUIZ_SESSION_REDIS_URL=os.environ.get('QUIZ_SESSION_REDIS_URL'),
+        RESPONSE_CACHE_REDIS_URL=os.environ.get('RESPONSE_CACHE_REDIS_URL'),
+        RESPONSE_CACHE_MAX_BYTES=os.environ.get('RESPONSE_CACHE_MAX_BYTES'),
+        SEARCH_BACKEND=os.environ.get('SEARCH_BACKEND', 'auto'),
+        JSON_SERIALIZER=os.environ.get('JSON_SERIALIZER', 'auto'),
+        SLOW_QUERY_MS=os.environ.get('SLOW_QUERY_MS', 500),
+        PROFILING_ENABLED=os.environ.get('PROFILING_ENABLED', '').lower() in ('1', 'true', 'yes'),
+        COMPRESS_RESPONSES=os.environ.get('COMPRESS_RESPONSES', 'true'),
+        COMPRESS_MIN_SIZE=os.environ.get('COMPRESS_MIN_SIZE'),
+        RATE_LIMIT_PER_SECOND=os.environ.get('RATE_LIMIT_PER_SECOND'),
+        RATE_LIMIT_BURST=os.environ.get('RATE_LIMIT_BURST'),
+        RATE_LIMIT_REDIS_URL=os.environ.get('RATE_LIMIT_REDIS_URL'),
+        QUIZ_PACK_DIR=os.environ.get('QUIZ_PACK_DIR'),
+        QUIZ_PACK_SIZE=os.environ.get('QUIZ_PACK_SIZE'),
+        QUIZ_PACK_INTERVAL=os.environ.get('QUIZ_PACK_INTERVAL'))
+
+    if test_config is not None:
+        app.config.update(test_config)
+
     setup_db(app)
     CORS(app)
 
-    # -----------------------------------------------------------------------------------------------------------
+    # Cached question ids per category for the quiz
+    question_sampler = QuestionSampler()
+
+    # Server side quiz sessions (in-process by default, or Redis)
+    session_store = create_session_store(app.config)
+
+    # The {id: type} map of categories, shared by all endpoints
+    category_cache = CategoryCache()
+
+    # gzip/brotli compression of the responses the client accepts it for
+    compressor = create_compressor(app.config)
+
+    # Serialized GET responses, until the tables they were built from change
+    response_cache = create_response_cache(app.config, compressor)
+
+    # JSON encoding of the responses (orjson when installed)
+    serializer = create_serializer(app.config)
 
-    def pagination(items):
-        ''' Helper function: Returns the first 10 elements in a list. '''
+    # Request latency and db counters for /metrics
+    metrics = Metrics()
 
-        # Pagination
-        # Get the value of key 'page' from the request.args object
-        # The second argument 1 is default if 'page' does not exist
-        page = request.args.get('page', 1, type=int)
-        start = (page-1)*QUESTIONS_PER_PAGE
-        end = start+QUESTIONS_PER_PAGE
+    # Requests per second per client and route (off unless RATE_LIMIT_PER_SECOND is set)
+    rate_limiter = create_rate_limiter(app.config)
 
-        return items[start:end]
+    # Shared with the async quiz routes of the ASGI app (see flaskr/asgi.py)
+    app.extensions['trivia'] = {'question_sampler': question_sampler,
+                                'session_store': session_store,
+                                'rate_limiter': rate_limiter}
+
+    # Question counts per category and difficulty, kept up to date on writes
+    question_stats = QuestionStats()
+
+    # Question ids per category and difficulty for the adaptive quiz, built on first use
+    difficulty_index = Lazy(DifficultyIndex)
+
+    # Full text search on PostgreSQL, an in-process index otherwise. Chosen on
+    # first use, once the database URI is final.
+    search_engine = Lazy(lambda: create_search_engine(app.config))
+
+    # Daily quiz packs, generated ahead of time (see flaskr/packs.py)
+    quiz_packs = create_quiz_packs(app.config)
+    app.extensions['trivia'].update(quiz_packs=quiz_packs,
+                                    pack_scheduler=start_pack_scheduler(app, quiz_packs))
 
     # -----------------------------------------------------------------------------------------------------------
 
+    @app.before_request
+    def before_request():
+
+        start_request_timer()
+
+        if rate_limiter is not None and request.url_rule is not None:
+            g.retry_after = rate_limiter.check(request.remote_addr, request.url_rule.rule)
+            if g.retry_after is not None:
+                abort(429)
+
+        # Reads go to the replicas, if any, unless the request writes
+        if request.method == 'GET' or request.endpoint in READ_ONLY_ENDPOINTS:
+            use_replicas()
+
+        # Only with ?profile=1 and PROFILING_ENABLED
+        start_profiler()
+
     # After a request is received, run this after_request method
     @app.after_request
     def after_request(response):
 
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        metrics.observe_request(request.method, route, response.status_code, request_duration())
+
+        response = profile_response(response)
+
         response.headers.add('Access-Control-Allow-Headers',
                              'Content-Type, Authorization')
         response.headers.add('Access-Control-Allow-Methods',
                              'GET, POST, PATCH, DELETE, OPTIONS')
 
+        # Number of queries and time spent in the db for this request
+        add_db_timing_headers(response)
+
+        if compressor is not None:
+            response = compressor.response(response)
+
         return response
 
     # -----------------------------------------------------------------------------------------------------------
 
     @app.route('/categories')
+    @response_cache.cached('categories')
     def get_request_all_categories():
         ''' Endpoint to handle GET requests for all available categories. '''
 
         if request.method != 'GET':
             abort(405)
 
-        all_categories_from_db = Category.query.all()
-        all_categories = {}
+        all_categories = category_cache.get()
 
         # Throw an error if there are no categories in the db
-        if len(all_categories_from_db) == 0:
+        if len(all_categories) == 0:
             abort(404)
 
-        # Extract categories from backend db and put in format for front end
-        for category_from_db in all_categories_from_db:
-            all_categories[category_from_db.id] = category_from_db.type
-
         # Send API data the format the front end requires in frontend\src\components\FormView.js
         result = {}
         result['categories'] = all_categories
         result['success'] = True
 
-        return jsonify(result)
+        return serializer.response(result)
 
     # -----------------------------------------------------------------------------------------------------------
 
     @app.route('/questions')
+    @response_cache.cached('questions', 'categories')
     def get_request_pagination_questions():
         ''' Endpoint to handle GET requests for questions,
         including pagination (every 10 questions).
@@ -85,39 +188,32 @@ def create_app(test_config=None):
 
         result = {}
 
-        # Get the questions from the db
-        all_questions_from_db = Question.query.all()
-        all_questions = []
+        # Get only the requested page of questions from the db, as plain rows
+        page = paginate(question_query(), Question.id)
 
         # Throw an error if there are no questions in the db
-        if len(all_questions_from_db) == 0:
+        total_questions = question_stats.total(at_least=len(page.items))
+        if total_questions == 0:
             abort(404)
 
-        # Format the question objects for frontend\src\components\QuestionView.js
-        for question_from_db in all_questions_from_db:
-            all_questions.append(question_from_db.format())
-
-        result['questions'] = pagination(all_questions)
-        result['total_questions'] = len(all_questions)
+        # Format the question rows for frontend\src\components\QuestionView.js
+        result['questions'] = format_rows(page.items)
+        result['total_questions'] = total_questions
+        result['next_cursor'] = page.next_cursor
 
-        # Get the categories from the db
-        all_categories_from_db = Category.query.all()
-        all_categories = {}
+        # Get the categories from the cache
+        all_categories = category_cache.get()
 
         # Throw an error if there are no categories in the db
-        if len(all_categories_from_db) == 0:
+        if len(all_categories) == 0:
             abort(404)
 
-        # Extract categories from backend db and put in format for front end
-        for category_from_db in all_categories_from_db:
-            all_categories[category_from_db.id] = category_from_db.type
-
         # Send API data the format the front end requires in frontend\src\components\QuestionView.js
         result['current_category'] = None
         result['categories'] = all_categories
         result['success'] = True
 
-        return jsonify(result)
+        return serializer.response(result)
 
     # -----------------------------------------------------------------------------------------------------------
 
@@ -153,6 +249,82 @@ def create_app(test_config=None):
 
     # -----------------------------------------------------------------------------------------------------------
 
+    def bulk_selection():
+        ''' Helper function: Returns the request body, the WHERE condition of
+        the questions it selects and whether it is a dry run. '''
+
+        data = request.get_json()
+
+        if not data or not isinstance(data, dict):
+            abort(400)
+
+        try:
+            condition = question_conditions(data)
+        except (TypeError, ValueError):
+            abort(400)
+
+        dry_run = data.get('dry_run', request.args.get('dry_run', False))
+        if isinstance(dry_run, str):
+            dry_run = dry_run.lower() in ('1', 'true', 'yes')
+
+        return data, condition, bool(dry_run)
+
+    @app.route('/questions', methods=['DELETE'])
+    def bulk_delete_questions():
+        ''' Endpoint to DELETE many questions at once, selected by ids,
+        category, difficulty and/or search term, with a single statement.
+        With dry_run, only the number of questions it would delete is returned. '''
+
+        if request.method != 'DELETE':
+            abort(405)
+
+        _, condition, dry_run = bulk_selection()
+
+        if dry_run:
+            return jsonify({'success': True, 'dry_run': True,
+                            'matched': count_questions(condition)})
+
+        try:
+            deleted = bulk_delete(condition)
+        except Exception:
+            print(sys.exc_info())
+            abort(422)
+
+        return jsonify({'success': True, 'deleted': deleted})
+
+    # -----------------------------------------------------------------------------------------------------------
+
+    @app.route('/questions', methods=['PATCH'])
+    def bulk_update_questions():
+        ''' Endpoint to PATCH many questions at once: the fields in changes
+        are set on the questions selected like in DELETE /questions,
+        with a single statement. With dry_run, only the number of questions
+        it would update is returned. '''
+
+        if request.method != 'PATCH':
+            abort(405)
+
+        data, condition, dry_run = bulk_selection()
+
+        try:
+            values = validate_changes(data.get('changes'))
+        except (TypeError, ValueError):
+            abort(400)
+
+        if dry_run:
+            return jsonify({'success': True, 'dry_run': True,
+                            'matched': count_questions(condition)})
+
+        try:
+            updated = bulk_update(condition, values)
+        except Exception:
+            print(sys.exc_info())
+            abort(422)
+
+        return jsonify({'success': True, 'updated': updated})
+
+    # -----------------------------------------------------------------------------------------------------------
+
     @app.route('/questions', methods=['POST'])
     def add_question_to_db():
         ''' Endpoint to POST a new question,
@@ -168,23 +340,33 @@ def create_app(test_config=None):
         if not form_data:
             abort(400)
 
+        try:
+            category = int(form_data['category'])
+            difficulty = int(form_data['difficulty'])
+        except (KeyError, TypeError, ValueError):
+            abort(400)
+
+        question = None
+
         try:
             question = Question(
                 question=form_data['question'],
                 answer=form_data['answer'],
-                category=form_data['category'],
-                difficulty=int(form_data['difficulty'])
+                category=category,
+                difficulty=difficulty
             )
 
             question.insert()
 
         except:
             error = True
-            question.cancel()
+            if question is not None:
+                question.cancel()
             print(sys.exc_info())
 
         finally:
-            question.close()
+            if question is not None:
+                question.close()
 
         if error:
             abort(422)
@@ -194,11 +376,75 @@ def create_app(test_config=None):
 
     # -----------------------------------------------------------------------------------------------------------
 
+    @app.route('/questions/bulk', methods=['POST'])
+    def bulk_import_questions():
+        ''' Endpoint to POST many questions at once.
+        The body is newline delimited JSON (one question object per line)
+        or CSV with a question,answer,category,difficulty header, streamed
+        and inserted in batches. Bad rows are reported and skipped. '''
+
+        if request.method != 'POST':
+            abort(405)
+
+        data_format = request.args.get('format')
+        if data_format is None:
+            data_format = 'csv' if request.mimetype == 'text/csv' else 'ndjson'
+
+        if data_format not in ('ndjson', 'csv'):
+            abort(400)
+
+        batch_size = request.args.get('batch_size', IMPORT_BATCH_SIZE, type=int)
+        if batch_size < 1:
+            abort(400)
+
+        # Read the body line by line instead of loading it all
+        lines = decode_lines(request.stream)
+        rows = read_csv(lines) if data_format == 'csv' else read_ndjson(lines)
+
+        try:
+            summary = BulkImporter(batch_size=batch_size).run(rows)
+        except csv.Error:
+            # Only raised for the header, before any row was imported
+            abort(400)
+
+        summary['success'] = True
+
+        return jsonify(summary)
+
+    # -----------------------------------------------------------------------------------------------------------
+
+    @app.route('/questions/export')
+    def export_questions():
+        ''' Endpoint to download every question (optionally of one category)
+        as newline delimited JSON or CSV. The response is streamed while the
+        questions are read from the db in batches. '''
+
+        if request.method != 'GET':
+            abort(405)
+
+        data_format = request.args.get('format', 'ndjson')
+        if data_format not in EXPORT_MIMETYPES:
+            abort(400)
+
+        category_id = request.args.get('category', type=int)
+        if 'category' in request.args and category_id is None:
+            abort(400)
+
+        response = Response(stream_with_context(export_chunks(data_format, category_id)),
+                            mimetype=EXPORT_MIMETYPES[data_format])
+        response.headers['Content-Disposition'] = \
+            'attachment; filename=questions.{}'.format(data_format)
+
+        return response
+
+    # -----------------------------------------------------------------------------------------------------------
+
     @app.route('/search', methods=['POST'])
     def search_questions():
         ''' Endpoint to get questions based on a search term.
-        It returns any questions for whom the search term
-        is a substring of the question. '''
+        It returns the questions containing every word of the search term
+        (the last one as a prefix), best matches first.
+        With searchAnswers the answers are searched too. '''
 
         if not request.method == 'POST':
             abort(405)
@@ -209,54 +455,53 @@ def create_app(test_config=None):
         if not search_term:
             abort(400)
 
-        # Case insensitive search in the db using ilike
-        question_results = Question.query.filter(
-            Question.question.ilike('%{}%'.format(search_term))).all()
-
-        returned_results = []
-        returned_categories = []
-
-        for question in question_results:
-            returned_results.append(question.format())
-            returned_categories.append(question.format()['category'])
+        # Ranking and pagination happen inside the search engine
+        offset, limit = get_offset_args()
+        questions, total = search_engine().search(
+            search_term, offset, limit, include_answers=bool(data.get('searchAnswers')))
 
         # Send API data the format the front end requires in frontend\src\components\QuestionView.js
         response = {}
-        response['total_questions'] = len(returned_results)
-        response['questions'] = pagination(returned_results)
-        response['current_category'] = returned_categories
+        response['total_questions'] = total
+        response['questions'] = format_rows(questions)
+        response['next_cursor'] = next_offset_cursor(offset, limit, total)
+        response['current_category'] = [question.category for question in questions]
         response['success'] = True
 
-        return jsonify(response)
+        return serializer.response(response)
 
     # -----------------------------------------------------------------------------------------------------------
 
     @app.route('/categories/<category_id>/questions')
+    @response_cache.cached('questions')
     def get_questions_category(category_id):
         ''' Endpoint to get questions based on category. '''
 
         if request.method != 'GET':
             abort(405)
 
-        questions_by_category = Question.query.filter(
-            Question.category == category_id).all()
+        if not category_id.isdigit():
+            abort(400)
+
+        page = paginate(question_query().filter(
+            Question.category == int(category_id)), Question.id)
 
-        if not questions_by_category:
+        # The category total comes from the counters, a COUNT(*) only when they look stale
+        total_questions = question_stats.category_total(int(category_id),
+                                                        at_least=len(page.items))
+        if total_questions == 0:
             abort(400)
 
         response = {}
-        response['questions'] = []
-
-        for question in questions_by_category:
-            response['questions'].append(question.format())
+        response['questions'] = format_rows(page.items)
+        response['next_cursor'] = page.next_cursor
 
         # Send API data the format the front end requires in frontend\src\components\QuestionView.js
-        response['questions'] = pagination(response['questions'])
         response['success'] = True
-        response['total_questions'] = len(response['questions'])
+        response['total_questions'] = total_questions
         response['current_category'] = category_id
 
-        return jsonify(response)
+        return serializer.response(response)
 
     # -----------------------------------------------------------------------------------------------------------
 
@@ -265,7 +510,11 @@ def create_app(test_config=None):
         ''' Endpoint to get questions to play the quiz.
         This endpoint takes a category and previous question parameters
         (from the front end) and return a random questions within the given category,
-        if provided, and that is not one of the previous questions. '''
+        if provided, and that is not one of the previous questions.
+        With count, up to count distinct questions are returned at once,
+        and seed makes the draw reproducible.
+        With adaptive ({difficulty, answers}), the question is drawn near the
+        difficulty that follows the player's recent answers (see flaskr/adaptive.py). '''
 
         if request.method != 'POST':
             abort(405)
@@ -275,32 +524,258 @@ def create_app(test_config=None):
         if not data:
             abort(400)
 
-        previous_questions_id = data['previous_questions']
-        category_id = data['quiz_category']['id']
+        try:
+            previous_questions_id = data['previous_questions']
+            category_id = int(data['quiz_category']['id'])
+            count = data.get('count', request.args.get('count'))
+            count = int(count) if count is not None else None
+        except (KeyError, TypeError, ValueError):
+            abort(400)
+
+        seed = data.get('seed', request.args.get('seed'))
+
+        if (count is not None and count < 1) or not isinstance(seed, (int, str, type(None))):
+            abort(400)
+
+        if 'adaptive' in data:
+            # One question at a time, chosen from the previous answers
+            if count is not None or seed is not None:
+                abort(400)
 
-        if category_id == 0:
-            questions_by_category = Question.query.all()
+            return play_adaptive_game(category_id, previous_questions_id, data['adaptive'])
+
+        if count is None and seed is None:
+            # Draw a random question that is not one of the previous questions
+            question = question_sampler.pick(category_id, previous_questions_id)
+
+            if question is not None:
+                random_question = question.format()
+            else:
+                random_question = None
+
+            # Send API data the format the front end requires in frontend\src\components\QuizView.js
+            return jsonify({'success': True, 'question': random_question})
+
+        # Draw the whole batch with one query
+        questions = format_rows(question_sampler.pick_many(
+            category_id, previous_questions_id, min(count or 1, MAX_QUIZ_BATCH), seed))
+
+        result = {'success': True, 'question': questions[0] if questions else None}
+        if count is not None:
+            result['questions'] = questions
+
+        return serializer.response(result)
+
+    def play_adaptive_game(category_id, previous_questions_id, adaptive):
+        ''' Helper function: Returns the next question of an adaptive quiz and
+        the difficulty it was aimed at, for the client to send back next time. '''
+
+        try:
+            difficulty = adaptive.get('difficulty')
+            difficulty = int(difficulty) if difficulty is not None else None
+            answers = adaptive.get('answers', [])
+        except (AttributeError, TypeError, ValueError):
+            abort(400)
+
+        if not isinstance(answers, list):
+            abort(400)
+
+        difficulty = next_difficulty(difficulty, answers)
+        question = difficulty_index().pick(category_id, difficulty, previous_questions_id)
+
+        if question is not None:
+            next_question = question.format()
         else:
-            questions_by_category = Question.query.filter(
-                Question.category == category_id).all()
+            next_question = None
 
-        questions_to_play = []
+        return jsonify({'success': True, 'question': next_question, 'difficulty': difficulty})
 
-        for question in questions_by_category:
+    # -----------------------------------------------------------------------------------------------------------
 
-            # Don't add previous questions to the list to play
-            if question.id in previous_questions_id:
-                continue
+    @app.route('/quizzes/packs')
+    def get_quiz_packs():
+        ''' Endpoint to list the ids of the daily quiz packs of a day
+        (?day=YYYY-MM-DD, today in UTC by default). '''
 
-            questions_to_play.append(question)
+        if request.method != 'GET':
+            abort(405)
+
+        day = parse_day(request.args['day']) if 'day' in request.args else today()
+        if day is None:
+            abort(400)
+
+        return jsonify({'success': True, 'day': day.isoformat(), 'packs': quiz_packs.ids(day)})
+
+    @app.route('/quizzes/packs/<pack_id>')
+    def get_quiz_pack(pack_id):
+        ''' Endpoint to get a daily quiz pack: the questions every player
+        of a category and difficulty gets that day. '''
+
+        if request.method != 'GET':
+            abort(405)
+
+        blob = quiz_packs.get(pack_id)
+
+        if blob is None:
+            abort(404)
+
+        return quiz_packs.response(blob)
+
+    # -----------------------------------------------------------------------------------------------------------
 
-        if len(questions_to_play) > 0:
-            random_question = random.choice(questions_to_play).format()
+    @app.route('/quizzes/sessions', methods=['POST'])
+    def create_quiz_session():
+        ''' Endpoint to start a quiz session for a category.
+        The questions of the category are shuffled once and kept on the server,
+        so the client does not need to send the previous questions. '''
+
+        if request.method != 'POST':
+            abort(405)
+
+        data = request.get_json()
+
+        if not data:
+            abort(400)
+
+        try:
+            category_id = int(data['quiz_category']['id'])
+        except (KeyError, TypeError, ValueError):
+            abort(400)
+
+        question_ids = array('i', question_sampler.category_ids(category_id))
+        random.shuffle(question_ids)
+
+        session_id = new_session_id()
+        session_store.create(session_id, question_ids)
+
+        return jsonify({'success': True, 'session_id': session_id,
+                        'total_questions': len(question_ids)})
+
+    # -----------------------------------------------------------------------------------------------------------
+
+    @app.route('/quizzes/sessions/<session_id>/next', methods=['POST'])
+    def next_quiz_session_question(session_id):
+        ''' Endpoint to get the next question of a quiz session.
+        Returns a null question once every question was played. '''
+
+        if request.method != 'POST':
+            abort(405)
+
+        question = None
+
+        while True:
+            question_id = session_store.pop(session_id)
+
+            if question_id is MISSING:
+                abort(404)
+
+            if question_id is None:
+                break
+
+            # Skip questions deleted after the session started
+            question = Question.query.get(question_id)
+            if question is not None:
+                break
+
+        if question is not None:
+            next_question = question.format()
         else:
-            random_question = None
+            next_question = None
 
         # Send API data the format the front end requires in frontend\src\components\QuizView.js
-        return jsonify({'success': True, 'question': random_question})
+        return jsonify({'success': True, 'question': next_question})
+
+    # -----------------------------------------------------------------------------------------------------------
+
+    @app.route('/quizzes/sessions/<session_id>', methods=['DELETE'])
+    def end_quiz_session(session_id):
+        ''' Endpoint to end a quiz session before all questions were played. '''
+
+        if request.method != 'DELETE':
+            abort(405)
+
+        if not session_store.delete(session_id):
+            abort(404)
+
+        return jsonify({'success': True, 'deleted_session': session_id})
+
+    # -----------------------------------------------------------------------------------------------------------
+
+    @app.route('/health')
+    def get_health():
+        ''' Endpoint to check the db connection.
+        Returns the ping latency and the connection pool counts,
+        with a 503 if the db cannot be reached. '''
+
+        if request.method != 'GET':
+            abort(405)
+
+        engine = db.get_engine(app)
+        result = {'pool': pool_status(engine)}
+
+        if 'db_replicas' in app.extensions:
+            result['replicas'] = app.extensions['db_replicas'].status()
+
+        try:
+            result['db_ping_ms'] = round(ping(engine), 3)
+        except Exception:
+            print(sys.exc_info())
+            result['success'] = False
+            result['db_ping_ms'] = None
+            return jsonify(result), 503
+
+        result['success'] = True
+
+        return jsonify(result)
+
+    # -----------------------------------------------------------------------------------------------------------
+
+    @app.route('/stats')
+    def get_stats():
+        ''' Endpoint to get the number of questions overall,
+        per category (with their difficulties) and per difficulty. '''
+
+        if request.method != 'GET':
+            abort(405)
+
+        all_categories = category_cache.get()
+        summary = question_stats.summary()
+
+        # Every category is listed, even without questions
+        categories = {}
+        for category_id, category_type in all_categories.items():
+            category = summary['categories'].get(
+                category_id, {'total_questions': 0, 'difficulties': {}})
+            category['type'] = category_type
+            categories[category_id] = category
+
+        return serializer.response({'success': True,
+                                    'total_questions': summary['total_questions'],
+                                    'categories': categories,
+                                    'difficulties': summary['difficulties']})
+
+    # -----------------------------------------------------------------------------------------------------------
+
+    @app.route('/cache/stats')
+    def get_cache_stats():
+        ''' Endpoint to get the hit/miss counters of the caches. '''
+
+        if request.method != 'GET':
+            abort(405)
+
+        return jsonify({'success': True, 'categories': category_cache.stats(),
+                        'responses': response_cache.stats()})
+
+    # -----------------------------------------------------------------------------------------------------------
+
+    @app.route('/metrics')
+    def get_metrics():
+        ''' Endpoint to scrape the request and db metrics, in the Prometheus format. '''
+
+        if request.method != 'GET':
+            abort(405)
+
+        return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
     # -----------------------------------------------------------------------------------------------------------
 
@@ -320,6 +795,88 @@ def create_app(test_config=None):
     def unprocessable(error):
         return jsonify({'success': False, 'error': 422, 'message': 'Not processable'}), 422
 
+    @app.errorhandler(429)
+    def too_many_requests(error):
+        response = jsonify({'success': False, 'error': 429, 'message': 'Too many requests'})
+        response.headers['Retry-After'] = str(max(1, math.ceil(g.get('retry_after') or 1)))
+        return response, 429
+
+    # -----------------------------------------------------------------------------------------------------------
+
+    @app.cli.command('db-upgrade')
+    def db_upgrade():
+        ''' Applies the pending schema migrations (see migrations.py). '''
+
+        applied = upgrade()
+
+        for version, description in applied:
+            print('Applied migration {}: {}'.format(version, description))
+
+        if not applied:
+            print('The database is up to date')
+
+    @app.cli.command('create-search-index')
+    def create_search_index():
+        ''' Creates the full text search indexes (PostgreSQL only). '''
+
+        if isinstance(search_engine(), PostgresSearchEngine):
+            search_engine().create_indexes()
+            print('Search indexes created')
+        else:
+            print('The search backend does not use db indexes')
+
+    @app.cli.command('import-questions')
+    @click.argument('source', type=click.File('r', encoding='utf-8', errors='surrogateescape'))
+    @click.option('--format', 'data_format', type=click.Choice(['ndjson', 'csv']),
+                  help='Defaults to csv for .csv files, ndjson otherwise.')
+    @click.option('--batch-size', default=IMPORT_BATCH_SIZE, show_default=True)
+    def import_questions(source, data_format, batch_size):
+        ''' Imports questions from an NDJSON or CSV file ('-' for stdin). '''
+
+        if data_format is None:
+            data_format = 'csv' if source.name.endswith('.csv') else 'ndjson'
+
+        rows = read_csv(source) if data_format == 'csv' else read_ndjson(source)
+        summary = BulkImporter(batch_size=batch_size).run(rows)
+
+        for error in summary['errors']:
+            print('line {}: {}'.format(error['line'], error['error']))
+
+        print('{} of {} rows imported, {} errors'.format(
+            summary['inserted'], summary['total_rows'], summary['error_count']))
+
+    @app.cli.command('generate-quiz-packs')
+    @click.option('--day', type=click.DateTime(formats=['%Y-%m-%d']),
+                  help='First day to generate, today (UTC) by default.')
+    @click.option('--days', default=1, show_default=True, help='Number of days to generate.')
+    @click.option('--replace', is_flag=True, help='Draw the existing packs again.')
+    def generate_quiz_packs(day, days, replace):
+        ''' Generates the daily quiz packs, into QUIZ_PACK_DIR. '''
+
+        first_day = day.date() if day is not None else today()
+
+        for offset in range(days):
+            pack_day = first_day + datetime.timedelta(days=offset)
+            print('{}: {} packs generated'.format(pack_day.isoformat(),
+                                                  quiz_packs.generate(pack_day, replace)))
+
+        if not app.config.get('QUIZ_PACK_DIR'):
+            print('QUIZ_PACK_DIR is not set, the packs are not kept')
+
+    @app.cli.command('export-questions')
+    @click.argument('output', type=click.File('w', encoding='utf-8'), default='-')
+    @click.option('--format', 'data_format', type=click.Choice(sorted(EXPORT_MIMETYPES)),
+                  help='Defaults to csv for .csv files, ndjson otherwise.')
+    @click.option('--category', 'category_id', type=int, help='Only export this category.')
+    def export_questions_command(output, data_format, category_id):
+        ''' Exports the questions as NDJSON or CSV to a file (stdout by default). '''
+
+        if data_format is None:
+            data_format = 'csv' if output.name.endswith('.csv') else 'ndjson'
+
+        for chunk in export_chunks(data_format, category_id):
+            output.write(chunk)
+
     # -----------------------------------------------------------------------------------------------------------
 
     return app
@@ -0,0 +1,177 @@
+import bisect
+import random
+import threading
+from array import array
+
+from models import db, Question, table_generations, change_listeners
+from flaskr.quiz import ALL_CATEGORIES, MAX_SAMPLE_ATTEMPTS, EXHAUSTED_RATIO
+from flaskr.bulk import MIN_DIFFICULTY, MAX_DIFFICULTY
+
+START_DIFFICULTY = 3
+RECENT_ANSWERS = 3
+REBUILD_BATCH = 10000
+
+
+def next_difficulty(difficulty, answers):
+    ''' Helper function: Returns the difficulty of the next question.
+    One step up when most of the recent answers (the last RECENT_ANSWERS,
+    True for correct) were right, one step down when most were wrong. '''
+
+    if difficulty is None:
+        difficulty = START_DIFFICULTY
+
+    recent = answers[-RECENT_ANSWERS:]
+
+    if recent:
+        correct = sum(1 for answer in recent if answer)
+        if correct * 3 >= len(recent) * 2:
+            difficulty += 1
+        elif correct * 3 <= len(recent):
+            difficulty -= 1
+
+    return min(MAX_DIFFICULTY, max(MIN_DIFFICULTY, difficulty))
+
+
+def difficulty_band(difficulty):
+    ''' Helper function: Yields the difficulty, then the ones further and
+    further away from it (lower first), to widen the band when it runs out. '''
+
+    yield difficulty
+
+    for distance in range(1, MAX_DIFFICULTY - MIN_DIFFICULTY + 1):
+        for candidate in (difficulty - distance, difficulty + distance):
+            if MIN_DIFFICULTY <= candidate <= MAX_DIFFICULTY:
+                yield candidate
+
+
+class DifficultyIndex:
+    ''' The question ids of every (category, difficulty), in memory, for the
+    adaptive quiz. Category ALL_CATEGORIES holds every question of a difficulty.
+
+    Ids are sorted array('I') per key, so picking a question of a difficulty
+    draws a random position instead of querying or filtering the category:
+    the cost does not grow with the number of questions. The index is kept
+    up to date with the questions committed through the ORM (see
+    models.change_listeners) and rebuilt, streaming rows in batches, when
+    the table changed some other way. '''
+
+    def __init__(self, rng=None):
+        self.rng = rng or random.Random()
+        self._lock = threading.RLock()
+        self._generation = None
+        self._ids = {}
+        change_listeners.add(self)
+
+    def rebuild(self):
+        ''' Rebuilds the index from the db, streaming the rows in batches. '''
+
+        with self._lock:
+            generation = table_generations['questions']
+            self._ids = {}
+
+            rows = db.session.query(Question.id, Question.category, Question.difficulty) \
+                .order_by(Question.id).yield_per(REBUILD_BATCH)
+
+            # Rows come in id order, so appending keeps every array sorted
+            for question_id, category_id, difficulty in rows:
+                for key in self._keys(category_id, difficulty):
+                    self._ids.setdefault(key, array('I')).append(question_id)
+
+            self._generation = generation
+
+    def _ensure_fresh(self):
+        if self._generation != table_generations['questions']:
+            with self._lock:
+                if self._generation != table_generations['questions']:
+                    self.rebuild()
+
+    def _keys(self, category_id, difficulty):
+        if difficulty is None:
+            return ()
+
+        if category_id is None:
+            return ((ALL_CATEGORIES, difficulty),)
+
+        return ((category_id, difficulty), (ALL_CATEGORIES, difficulty))
+
+    def _add(self, question_id, category_id, difficulty):
+        for key in self._keys(category_id, difficulty):
+            ids = self._ids.setdefault(key, array('I'))
+            position = bisect.bisect_left(ids, question_id)
+            if position == len(ids) or ids[position] != question_id:
+                ids.insert(position, question_id)
+
+    def _remove(self, question_id):
+        # The old category and difficulty of an updated question are unknown,
+        # so look in every array, a binary search each
+        for ids in self._ids.values():
+            position = bisect.bisect_left(ids, question_id)
+            if position < len(ids) and ids[position] == question_id:
+                del ids[position]
+
+    def apply_changes(self, changes, generations):
+        ''' Updates the index with questions committed through the ORM. '''
+
+        with self._lock:
+            # Not built yet, the first pick will load everything anyway
+            if self._generation is None:
+                return
+
+            for tablename, operation, row in changes:
+                if tablename != Question.__tablename__:
+                    continue
+
+                if operation != 'inserted':
+                    self._remove(row['id'])
+                if operation != 'deleted':
+                    self._add(row['id'], row['category'], row['difficulty'])
+
+            self._generation = table_generations['questions']
+
+    def ids(self, category_id, difficulty):
+        ''' Returns the sorted array of question ids of a category
+        (ALL_CATEGORIES for all) and difficulty. '''
+
+        self._ensure_fresh()
+        return self._ids.get((category_id, difficulty), array('I'))
+
+    def draw(self, category_id, difficulty, previous_ids):
+        ''' Returns a random id of the category and difficulty not in
+        previous_ids, or None if all have been played. '''
+
+        ids = self.ids(category_id, difficulty)
+
+        if not ids:
+            return None
+
+        if len(previous_ids) < len(ids) * EXHAUSTED_RATIO:
+            for _ in range(MAX_SAMPLE_ATTEMPTS):
+                question_id = ids[self.rng.randrange(len(ids))]
+                if question_id not in previous_ids:
+                    return question_id
+
+        # Mostly played: only previous_ids can make this slow, not the bank
+        unplayed = [question_id for question_id in ids if question_id not in previous_ids]
+
+        return self.rng.choice(unplayed) if unplayed else None
+
+    def pick(self, category_id, difficulty, previous_ids):
+        ''' Returns a random unplayed question of the category as close to
+        difficulty as possible, or None if all have been played. '''
+
+        excluded = set(previous_ids)
+
+        for candidate in difficulty_band(difficulty):
+            while True:
+                question_id = self.draw(category_id, candidate, excluded)
+                if question_id is None:
+                    break
+
+                # The id can be stale if the question was deleted meanwhile
+                question = Question.query.get(question_id)
+                if question is not None:
+                    return question
+
+                excluded.add(question_id)
+
+        return None
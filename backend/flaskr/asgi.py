@@ -0,0 +1,381 @@
+''' ASGI entry point.
+
+The quiz routes, which are hit the most and only wait on the db, run on the
+event loop with asyncpg and an async connection pool. Every other request
+goes to the regular Flask app, run in a thread pool by asgiref. Both halves
+share the Flask app's question sampler and quiz session store.
+
+Needs the optional asgiref and asyncpg packages and PostgreSQL. Run with:
+    uvicorn --factory flaskr.asgi:create_asgi_app
+'''
+import asyncio
+import importlib.util
+import json
+import math
+import os
+import random
+import re
+from urllib.parse import parse_qsl
+
+from models import table_generations, engine_options
+from flaskr import create_app
+from flaskr.quiz import ALL_CATEGORIES, MAX_QUIZ_BATCH, MAX_SAMPLE_ATTEMPTS
+from flaskr.serialization import QUESTION_FIELDS, dumps
+from flaskr.sessions import MemorySessionStore, MISSING
+from flaskr.ratelimit import MemoryRateLimitBackend
+
+QUESTION_COLUMNS = ', '.join(QUESTION_FIELDS)
+
+SESSION_NEXT_PATH = re.compile(r'^/quizzes/sessions/([^/]+)/next$')
+
+RESPONSE_HEADERS = [
+    (b'content-type', b'application/json'),
+    (b'access-control-allow-origin', b'*'),
+    (b'access-control-allow-headers', b'Content-Type, Authorization'),
+    (b'access-control-allow-methods', b'GET, POST, PATCH, DELETE, OPTIONS'),
+]
+
+ERROR_MESSAGES = {400: 'Bad request', 404: 'Not found', 429: 'Too many requests'}
+
+# The Flask rules of the routes served here, the rate limits are per rule
+QUIZ_RULE = '/quizzes'
+SESSION_NEXT_RULE = '/quizzes/sessions/<session_id>/next'
+
+
+def asyncpg_dsn(database_path):
+    ''' Helper function: Returns the asyncpg DSN of a SQLAlchemy database URI,
+    or None if it is not a PostgreSQL database. '''
+
+    scheme, separator, rest = database_path.partition('://')
+
+    if not separator or scheme.split('+')[0] not in ('postgres', 'postgresql'):
+        return None
+
+    return 'postgresql://' + rest
+
+
+def async_pool_options(config, database_path):
+    ''' Helper function: Returns the asyncpg create_pool options matching
+    the connection pool settings of the sync engine (see models.py). '''
+
+    options = engine_options(config, database_path)
+
+    # Same ceiling as the sync pool: pool_size plus the overflow
+    max_size = options.get('pool_size', 5) + options.get('max_overflow', 10)
+    pool_options = {'min_size': 1, 'max_size': max(1, max_size)}
+
+    if 'pool_recycle' in options:
+        pool_options['max_inactive_connection_lifetime'] = options['pool_recycle']
+
+    statement_timeout = config.get('DB_STATEMENT_TIMEOUT') or \
+        os.environ.get('DB_STATEMENT_TIMEOUT')
+    if statement_timeout is not None:
+        pool_options['server_settings'] = {'statement_timeout': str(int(statement_timeout))}
+
+    return pool_options
+
+
+class AsyncQuestions:
+    ''' The few question queries of the async quiz routes, on an asyncpg pool. '''
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    def _format(self, record):
+        return dict(zip(QUESTION_FIELDS, record)) if record is not None else None
+
+    async def category_ids(self, category_id):
+        ''' Returns the ids of the questions in a category (0 for all). '''
+
+        # Ordered like QuestionSampler.category_ids(), for seeded draws
+        if category_id == ALL_CATEGORIES:
+            rows = await self.pool.fetch('SELECT id FROM questions ORDER BY id')
+        else:
+            rows = await self.pool.fetch(
+                'SELECT id FROM questions WHERE category = $1 ORDER BY id', category_id)
+
+        return [row[0] for row in rows]
+
+    async def get(self, question_id):
+        ''' Returns a formatted question, or None if there is no such id. '''
+
+        return self._format(await self.pool.fetchrow(
+            'SELECT {} FROM questions WHERE id = $1'.format(QUESTION_COLUMNS), question_id))
+
+    async def get_many(self, question_ids):
+        ''' Returns the formatted questions with the given ids, in that order. '''
+
+        rows = await self.pool.fetch('SELECT {} FROM questions WHERE id = ANY($1::int[])'.format(
+            QUESTION_COLUMNS), list(question_ids))
+        by_id = {row['id']: self._format(row) for row in rows}
+
+        return [by_id[question_id] for question_id in question_ids if question_id in by_id]
+
+    async def pick(self, category_id, previous_ids):
+        ''' Returns a random formatted question of the category whose id
+        is not in previous_ids, or None if all have been played. '''
+
+        conditions = ['NOT (id = ANY($1::int[]))']
+        args = [list(previous_ids)]
+
+        if category_id != ALL_CATEGORIES:
+            conditions.append('category = $2')
+            args.append(category_id)
+
+        return self._format(await self.pool.fetchrow(
+            'SELECT {} FROM questions WHERE {} ORDER BY random() LIMIT 1'.format(
+                QUESTION_COLUMNS, ' AND '.join(conditions)), *args))
+
+
+class AsyncTriviaApp:
+    ''' ASGI app serving POST /quizzes and POST /quizzes/sessions/<id>/next
+    asynchronously, and the rest of the API (and adaptive quizzes)
+    through the WSGI app. '''
+
+    def __init__(self, flask_app, wsgi_app):
+        self.flask_app = flask_app
+        self.wsgi_app = wsgi_app
+        self.question_sampler = flask_app.extensions['trivia']['question_sampler']
+        self.session_store = flask_app.extensions['trivia']['session_store']
+        self.rate_limiter = flask_app.extensions['trivia']['rate_limiter']
+
+        database_path = flask_app.config['SQLALCHEMY_DATABASE_URI']
+        self.dsn = asyncpg_dsn(database_path)
+        self.pool_options = async_pool_options(flask_app.config, database_path)
+
+        self._questions = None
+        self._pool_lock = None
+
+    async def questions(self):
+        ''' Returns the AsyncQuestions, creating the pool on first use. '''
+
+        if self._questions is None:
+            if self._pool_lock is None:
+                self._pool_lock = asyncio.Lock()
+
+            async with self._pool_lock:
+                if self._questions is None:
+                    import asyncpg
+                    pool = await asyncpg.create_pool(self.dsn, **self.pool_options)
+                    self._questions = AsyncQuestions(pool)
+
+        return self._questions
+
+    async def close(self):
+        ''' Closes the connection pool. '''
+
+        if self._questions is not None:
+            await self._questions.pool.close()
+            self._questions = None
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self._lifespan(receive, send)
+
+        if scope['type'] == 'http' and self.dsn is not None and scope['method'] == 'POST':
+            if scope['path'] == '/quizzes':
+                retry_after = await self._check_rate_limit(scope, QUIZ_RULE)
+                if retry_after is not None:
+                    return await self._respond(send, *self._error(429), retry_after=retry_after)
+
+                body = await self._read_body(receive)
+
+                # The difficulty index of the adaptive quiz lives in the Flask app
+                if self._is_adaptive(body):
+                    return await self.wsgi_app(scope, self._replay(body), send)
+
+                return await self._respond(send, *await self.play_trivia_game(
+                    body, dict(parse_qsl(scope.get('query_string', b'').decode('latin-1')))))
+
+            match = SESSION_NEXT_PATH.match(scope['path'])
+            if match:
+                retry_after = await self._check_rate_limit(scope, SESSION_NEXT_RULE)
+                if retry_after is not None:
+                    return await self._respond(send, *self._error(429), retry_after=retry_after)
+
+                return await self._respond(send, *await self.next_quiz_session_question(
+                    match.group(1)))
+
+        return await self.wsgi_app(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+
+            elif message['type'] == 'lifespan.shutdown':
+                await self.close()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _read_body(self, receive):
+        body = b''
+        more_body = True
+
+        while more_body:
+            message = await receive()
+            body += message.get('body', b'')
+            more_body = message.get('more_body', False)
+
+        return body
+
+    def _is_adaptive(self, body):
+        try:
+            data = json.loads(body)
+        except ValueError:
+            return False
+
+        return isinstance(data, dict) and 'adaptive' in data
+
+    def _replay(self, body):
+        async def receive():
+            return {'type': 'http.request', 'body': body, 'more_body': False}
+
+        return receive
+
+    async def _check_rate_limit(self, scope, rule):
+        ''' Same as the rate limit of the Flask app: None, or the seconds to wait. '''
+
+        if self.rate_limiter is None:
+            return None
+
+        client = (scope.get('client') or ('unknown',))[0]
+
+        # The in-process buckets are fast, others (Redis) may block
+        if isinstance(self.rate_limiter.backend, MemoryRateLimitBackend):
+            return self.rate_limiter.check(client, rule)
+
+        return await asyncio.get_running_loop().run_in_executor(
+            None, self.rate_limiter.check, client, rule)
+
+    async def _respond(self, send, status, result, retry_after=None):
+        body = dumps(result)
+        headers = RESPONSE_HEADERS + [(b'content-length', str(len(body)).encode('ascii'))]
+
+        if retry_after is not None:
+            headers.append((b'retry-after', str(max(1, math.ceil(retry_after))).encode('ascii')))
+
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': body})
+
+    def _error(self, status):
+        return status, {'success': False, 'error': status, 'message': ERROR_MESSAGES[status]}
+
+    async def play_trivia_game(self, body, args=None):
+        ''' Same as POST /quizzes in the Flask app. '''
+
+        args = args or {}
+
+        try:
+            data = json.loads(body)
+            previous_ids = set(int(question_id) for question_id in data['previous_questions'])
+            category_id = int(data['quiz_category']['id'])
+            count = data.get('count', args.get('count'))
+            count = int(count) if count is not None else None
+        except (KeyError, TypeError, ValueError):
+            return self._error(400)
+
+        seed = data.get('seed', args.get('seed'))
+
+        if (count is not None and count < 1) or not isinstance(seed, (int, str, type(None))):
+            return self._error(400)
+
+        questions = await self.questions()
+
+        ids = self.question_sampler.cached_ids(category_id)
+        if ids is None:
+            generation = table_generations['questions']
+            ids = self.question_sampler.store_ids(
+                category_id, generation, await questions.category_ids(category_id))
+
+        if count is not None or seed is not None:
+            batch = await self.pick_many(questions, ids, previous_ids,
+                                         min(count or 1, MAX_QUIZ_BATCH), seed)
+
+            result = {'success': True, 'question': batch[0] if batch else None}
+            if count is not None:
+                result['questions'] = batch
+
+            return 200, result
+
+        question = None
+
+        if ids:
+            if self.question_sampler.should_sample(ids, previous_ids):
+                for question_id in self.question_sampler.draws(ids, previous_ids):
+                    # The id can be stale if the question was deleted meanwhile
+                    question = await questions.get(question_id)
+                    if question is not None:
+                        break
+
+            if question is None:
+                question = await questions.pick(category_id, previous_ids)
+
+        return 200, {'success': True, 'question': question}
+
+    async def pick_many(self, questions, ids, previous_ids, count, seed):
+        ''' Same as QuestionSampler.pick_many(), with one async query per draw. '''
+
+        rng = random.Random(seed) if seed is not None else self.question_sampler.rng
+        excluded = set(previous_ids)
+        batch = []
+
+        for _ in range(MAX_SAMPLE_ATTEMPTS):
+            chosen = self.question_sampler.sample_ids(ids, excluded, count - len(batch), rng)
+            if not chosen:
+                break
+
+            batch.extend(await questions.get_many(chosen))
+
+            # Ids can be stale if questions were deleted meanwhile, draw again
+            excluded.update(chosen)
+            if len(batch) == count:
+                break
+
+        return batch
+
+    async def next_quiz_session_question(self, session_id):
+        ''' Same as POST /quizzes/sessions/<id>/next in the Flask app. '''
+
+        questions = await self.questions()
+        question = None
+
+        while True:
+            # The in-process store is fast, others (Redis) may block
+            if isinstance(self.session_store, MemorySessionStore):
+                question_id = self.session_store.pop(session_id)
+            else:
+                question_id = await asyncio.get_running_loop().run_in_executor(
+                    None, self.session_store.pop, session_id)
+
+            if question_id is MISSING:
+                return self._error(404)
+
+            if question_id is None:
+                break
+
+            # Skip questions deleted after the session started
+            question = await questions.get(question_id)
+            if question is not None:
+                break
+
+        return 200, {'success': True, 'question': question}
+
+
+def create_asgi_app(test_config=None):
+    ''' Returns the ASGI app, built around create_app(test_config). '''
+
+    try:
+        from asgiref.wsgi import WsgiToAsgi
+    except ImportError:
+        WsgiToAsgi = None
+
+    # asyncpg is only imported by the pool, on the first quiz request
+    if WsgiToAsgi is None or importlib.util.find_spec('asyncpg') is None:
+        raise RuntimeError('The asgiref and asyncpg packages are required for the ASGI app')
+
+    flask_app = create_app(test_config)
+
+    return AsyncTriviaApp(flask_app, WsgiToAsgi(flask_app))
@@ -0,0 +1,296 @@
+import csv
+import io
+import json
+from sqlalchemy import and_, func, or_, select
+
+from models import db, Question, Category, bump_generation
+
+IMPORT_BATCH_SIZE = 1000
+MAX_IMPORT_BATCH_SIZE = 10000
+MAX_REPORTED_ERRORS = 1000
+MIN_DIFFICULTY = 1
+MAX_DIFFICULTY = 5
+MAX_BULK_IDS = 10000
+
+IMPORT_FIELDS = ('question', 'answer', 'category', 'difficulty')
+
+
+def read_ndjson(lines):
+    ''' Helper function: Yields (line_number, row) for newline delimited JSON.
+    row is None for a line that is not a JSON object. Blank lines are skipped. '''
+
+    for line_number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+
+        yield line_number, row if isinstance(row, dict) else None
+
+
+def read_csv(lines):
+    ''' Helper function: Yields (line_number, row) for CSV with a header line.
+    row is a ValueError for a line the csv module cannot read. A bad header
+    raises csv.Error, before any row is yielded. '''
+
+    reader = csv.DictReader(lines)
+    # Reads the header now, its errors are not a row's
+    reader.fieldnames
+
+    while True:
+        try:
+            row = next(reader)
+        except StopIteration:
+            return
+        except csv.Error as error:
+            row = ValueError(str(error))
+
+        yield reader.line_num, row
+
+
+def decode_lines(stream, encoding='utf-8'):
+    ''' Helper function: Decodes a binary stream line by line, without reading it all.
+    Bytes that do not decode are kept as surrogates (surrogateescape), so the
+    rows holding them are reported by BulkImporter.validate() instead of
+    stopping the import half way. '''
+
+    for line in stream:
+        yield line.decode(encoding, 'surrogateescape')
+
+
+class BulkImporter:
+    ''' Inserts questions from an iterator of (line_number, row) in batches.
+
+    Rows are validated first. Each batch is one executemany INSERT, or a COPY
+    on PostgreSQL. If a batch still fails in the db, its rows are retried one
+    by one so only the bad rows are reported and the rest are kept. '''
+
+    def __init__(self, batch_size=IMPORT_BATCH_SIZE, use_copy=None):
+        self.batch_size = max(1, min(batch_size, MAX_IMPORT_BATCH_SIZE))
+        self.use_copy = use_copy
+        self.inserted = 0
+        self.error_count = 0
+        self.errors = []
+        self._category_ids = None
+
+    def _error(self, line_number, message):
+        self.error_count += 1
+
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line_number, 'error': message})
+
+    def validate(self, row):
+        ''' Returns the row ready to insert, or raises ValueError. '''
+
+        if row is None:
+            raise ValueError('not a JSON object')
+
+        if isinstance(row, ValueError):
+            raise row
+
+        missing = [field for field in IMPORT_FIELDS if row.get(field) in (None, '')]
+        if missing:
+            raise ValueError('missing {}'.format(', '.join(missing)))
+
+        try:
+            category = int(row['category'])
+            difficulty = int(row['difficulty'])
+        except (TypeError, ValueError):
+            raise ValueError('category and difficulty must be integers')
+
+        if category not in self._category_ids:
+            raise ValueError('unknown category {}'.format(category))
+
+        if not MIN_DIFFICULTY <= difficulty <= MAX_DIFFICULTY:
+            raise ValueError('difficulty must be between {} and {}'.format(
+                MIN_DIFFICULTY, MAX_DIFFICULTY))
+
+        text = {'question': str(row['question']), 'answer': str(row['answer'])}
+
+        for field, value in text.items():
+            try:
+                value.encode('utf-8')
+            except UnicodeEncodeError:
+                raise ValueError('{} is not valid UTF-8'.format(field))
+
+        return dict(text, category=category, difficulty=difficulty)
+
+    def _copy(self, rows):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in rows:
+            writer.writerow([row[field] for field in IMPORT_FIELDS])
+        buffer.seek(0)
+
+        cursor = db.session.connection().connection.cursor()
+        cursor.copy_expert('COPY questions (question, answer, category, difficulty) '
+                           'FROM STDIN WITH (FORMAT csv)', buffer)
+
+    def _insert_batch(self, batch):
+        inserted = self.inserted
+        self._insert_rows(batch)
+
+        # The rows bypassed the ORM, so tell the caches
+        if self.inserted > inserted:
+            bump_generation(Question.__tablename__)
+
+    def _insert_rows(self, batch):
+        rows = [row for _, row in batch]
+
+        try:
+            if self.use_copy:
+                self._copy(rows)
+            else:
+                db.session.execute(Question.__table__.insert(), rows)
+            db.session.commit()
+            self.inserted += len(rows)
+            return
+
+        except Exception:
+            db.session.rollback()
+
+        # Find the rows the db rejected, keep the others
+        for line_number, row in batch:
+            try:
+                db.session.execute(Question.__table__.insert(), [row])
+                db.session.commit()
+                self.inserted += 1
+            except Exception as error:
+                db.session.rollback()
+                self._error(line_number, str(getattr(error, 'orig', error)).strip())
+
+    def run(self, rows):
+        ''' Imports the rows and returns a summary with the per row errors. '''
+
+        if self.use_copy is None:
+            self.use_copy = db.session.get_bind().dialect.name == 'postgresql'
+
+        self._category_ids = set(
+            category_id for category_id, in db.session.query(Category.id))
+
+        total_rows = 0
+        batch = []
+
+        for line_number, row in rows:
+            total_rows += 1
+
+            try:
+                batch.append((line_number, self.validate(row)))
+            except ValueError as error:
+                self._error(line_number, str(error))
+
+            if len(batch) >= self.batch_size:
+                self._insert_batch(batch)
+                batch = []
+
+        if batch:
+            self._insert_batch(batch)
+
+        return {'total_rows': total_rows, 'inserted': self.inserted,
+                'error_count': self.error_count, 'errors': self.errors}
+
+
+def question_conditions(selection):
+    ''' Helper function: Returns the WHERE conditions selecting the questions
+    of a bulk change: ids (a list), category, difficulty and searchTerm
+    (a substring of the question or the answer), all of which must match.
+    Raises ValueError if none is given, so a bad request never changes
+    the whole table. '''
+
+    conditions = []
+
+    if selection.get('ids') is not None:
+        ids = selection['ids']
+        if not isinstance(ids, list) or len(ids) > MAX_BULK_IDS:
+            raise ValueError('ids must be a list of at most {} ids'.format(MAX_BULK_IDS))
+        conditions.append(Question.id.in_([int(question_id) for question_id in ids]))
+
+    if selection.get('category') is not None:
+        conditions.append(Question.category == int(selection['category']))
+
+    if selection.get('difficulty') is not None:
+        conditions.append(Question.difficulty == int(selection['difficulty']))
+
+    if selection.get('searchTerm'):
+        pattern = '%{}%'.format(selection['searchTerm'])
+        conditions.append(or_(Question.question.ilike(pattern), Question.answer.ilike(pattern)))
+
+    if not conditions:
+        raise ValueError('no questions selected')
+
+    return and_(*conditions)
+
+
+def validate_changes(changes):
+    ''' Helper function: Returns the column values of a bulk update,
+    or raises ValueError. '''
+
+    if not isinstance(changes, dict) or not changes:
+        raise ValueError('changes must be an object')
+
+    unknown = set(changes) - set(IMPORT_FIELDS)
+    if unknown:
+        raise ValueError('unknown fields {}'.format(', '.join(sorted(unknown))))
+
+    values = {}
+
+    for field in ('question', 'answer'):
+        if field in changes:
+            if not changes[field]:
+                raise ValueError('{} cannot be empty'.format(field))
+            values[field] = str(changes[field])
+
+    if 'category' in changes:
+        values['category'] = int(changes['category'])
+        if Category.query.get(values['category']) is None:
+            raise ValueError('unknown category {}'.format(values['category']))
+
+    if 'difficulty' in changes:
+        values['difficulty'] = int(changes['difficulty'])
+        if not MIN_DIFFICULTY <= values['difficulty'] <= MAX_DIFFICULTY:
+            raise ValueError('difficulty must be between {} and {}'.format(
+                MIN_DIFFICULTY, MAX_DIFFICULTY))
+
+    return values
+
+
+def count_questions(condition):
+    ''' Helper function: Returns the number of questions a bulk change would touch. '''
+
+    return db.session.execute(
+        select([func.count()]).select_from(Question.__table__).where(condition)).scalar()
+
+
+def execute_bulk_change(statement):
+    ''' Helper function: Runs one DELETE or UPDATE of questions in its own
+    transaction and returns the number of rows it changed. The statement
+    bypasses the ORM, so the caches are told the table changed. '''
+
+    try:
+        rowcount = db.session.execute(statement).rowcount
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    if rowcount:
+        bump_generation(Question.__tablename__)
+
+    return rowcount
+
+
+def bulk_delete(condition):
+    ''' Deletes the questions matching condition with a single statement.
+    Returns how many were deleted. '''
+
+    return execute_bulk_change(Question.__table__.delete().where(condition))
+
+
+def bulk_update(condition, values):
+    ''' Sets values on the questions matching condition with a single statement.
+    Returns how many were updated. '''
+
+    return execute_bulk_change(Question.__table__.update().where(condition).values(**values))
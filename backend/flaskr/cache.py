@@ -0,0 +1,491 @@
+import calendar
+import functools
+import hashlib
+import math
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlencode
+from flask import current_app, request, make_response
+
+from models import Category, table_generations, table_modified, generation_listeners
+
+CATEGORY_CACHE_TTL = 5*60
+
+RESPONSE_CACHE_TTL = 60
+RESPONSE_CACHE_MAX_BYTES = 32*1024*1024
+MAX_CACHED_RESPONSE_SIZE = 1024*1024
+
+# Rough per entry overhead (key, tuple, LRU links) counted with the body size
+ENTRY_OVERHEAD = 200
+
+
+class CategoryCache:
+    ''' The {id: type} map of all categories, kept in this process.
+    It is reloaded when the categories table was written (see
+    models.table_generations) or, as a safety net for writes from other
+    processes, after ttl seconds. '''
+
+    def __init__(self, ttl=CATEGORY_CACHE_TTL):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entry = None
+
+    def invalidate(self):
+        ''' Forces a reload on the next get(). '''
+
+        self._entry = None
+
+    def _fresh(self, entry):
+        return (entry is not None
+                and entry['generation'] == table_generations['categories']
+                and time.monotonic() - entry['loaded_at'] < self.ttl)
+
+    def get(self):
+        ''' Returns the categories, as a map of id to type. '''
+
+        entry = self._entry
+
+        if self._fresh(entry):
+            self.hits += 1
+            return entry['categories']
+
+        with self._lock:
+            # Loaded by another thread while this one waited for the lock
+            if self._fresh(self._entry):
+                self.hits += 1
+                return self._entry['categories']
+
+            self.misses += 1
+            generation = table_generations['categories']
+
+            categories = {}
+            for category in Category.query.order_by(Category.id):
+                categories[category.id] = category.type
+
+            self._entry = {'generation': generation, 'loaded_at': time.monotonic(),
+                           'categories': categories}
+
+        return categories
+
+    def stats(self):
+        ''' Returns the hit/miss counters. '''
+
+        return {'hits': self.hits, 'misses': self.misses}
+
+
+class MemoryResponseStore:
+    ''' Cached responses kept in this process, as (etag, body) per key.
+    Least recently used entries are evicted once the keys and bodies
+    take more than max_bytes, and entries expire after ttl seconds.
+    The generations are those of this process, which does not see the
+    writes of other workers. '''
+
+    # The generations only cover the writes of this process
+    shared_generations = False
+
+    def __init__(self, ttl=RESPONSE_CACHE_TTL, max_bytes=RESPONSE_CACHE_MAX_BYTES):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def generation(self, tablename):
+        ''' Returns the generation of a table, as seen by this store. '''
+
+        return table_generations[tablename]
+
+    def modified(self, tablename):
+        ''' Returns the time of the last write to a table, as seen by this store. '''
+
+        return table_modified[tablename]
+
+    def _entry_size(self, key, body):
+        return len(key) + len(body) + ENTRY_OVERHEAD
+
+    def _remove(self, key):
+        expires, etag, body = self._entries.pop(key)
+        self.size -= self._entry_size(key, body)
+
+    def get(self, key):
+        ''' Returns (etag, body), or None if the key is not cached. '''
+
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None:
+                return None
+
+            if entry[0] < time.monotonic():
+                self._remove(key)
+                return None
+
+            self._entries.move_to_end(key)
+
+            return entry[1], entry[2]
+
+    def set(self, key, etag, body):
+        ''' Stores a response, evicting the least recently used ones to make room. '''
+
+        size = self._entry_size(key, body)
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+            self._entries[key] = (time.monotonic() + self.ttl, etag, body)
+            self.size += size
+
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def stats(self):
+        return {'entries': len(self._entries), 'bytes': self.size,
+                'max_bytes': self.max_bytes, 'evictions': self.evictions}
+
+
+class RedisResponseStore:
+    ''' Cached responses kept in Redis, so they are shared between workers.
+    The table generations are kept there as well: a write in one worker
+    bumps them for all (see models.generation_listeners), so no worker
+    serves a response older than the last write. Redis does the eviction,
+    given a maxmemory policy such as allkeys-lru. '''
+
+    # Every worker bumps them, so they cover all the writes
+    shared_generations = True
+
+    def __init__(self, client, ttl=RESPONSE_CACHE_TTL, prefix='trivia:response:'):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+        generation_listeners.add(self)
+
+    def _generation_key(self, tablename):
+        return self.prefix + 'generation:' + tablename
+
+    def _modified_key(self, tablename):
+        return self.prefix + 'modified:' + tablename
+
+    def generation(self, tablename):
+        ''' Returns the generation of a table, shared by all workers. '''
+
+        return int(self.client.get(self._generation_key(tablename)) or 0)
+
+    def modified(self, tablename):
+        ''' Returns the time of the last write to a table by any worker. '''
+
+        modified = self.client.get(self._modified_key(tablename))
+
+        return float(modified) if modified is not None else table_modified[tablename]
+
+    def generation_bumped(self, tablename):
+        self.client.incr(self._generation_key(tablename))
+        self.client.set(self._modified_key(tablename), repr(time.time()))
+
+    def get(self, key):
+        ''' Returns (etag, body), or None if the key is not cached. '''
+
+        value = self.client.get(self.prefix + key)
+
+        if value is None:
+            return None
+
+        etag, body = value.split(b'\n', 1)
+
+        return etag.decode('ascii'), body
+
+    def set(self, key, etag, body):
+        ''' Stores a response for ttl seconds. '''
+
+        self.client.set(self.prefix + key, etag.encode('ascii') + b'\n' + body, ex=self.ttl)
+
+    def clear(self):
+        pass
+
+    def stats(self):
+        return {}
+
+
+class SingleFlight:
+    ''' Runs one call per key at a time: callers arriving while a call for
+    their key is in flight wait for it and share its result instead of
+    running their own. A failed call is not shared, its waiters get None. '''
+
+    def __init__(self):
+        self.shared = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, function):
+        ''' Returns function(), or the result of the call in flight for key. '''
+
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = {'done': threading.Event(), 'result': None}
+            else:
+                self.shared += 1
+
+        if not leader:
+            call['done'].wait()
+            return call['result']
+
+        try:
+            call['result'] = function()
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call['done'].set()
+
+        return call['result']
+
+
+class ResponseCache:
+    ''' Whole GET responses, kept serialized so a hit skips the db and json.
+
+    Responses are keyed by path and sorted query args, plus the generations
+    of the tables they were built from, so a write (e.g. Question.insert()
+    or delete()) makes the old entries unreachable and LRU eviction
+    reclaims them.
+
+    Last-Modified is the time of the last write to the tables. When the
+    store shares the generations between workers (Redis), the ETag is a hash
+    of that key, so a client revalidating an unchanged response gets a 304
+    before the store or the db are even looked at. Otherwise the generations
+    miss the writes of other workers: the ETag is a hash of the body, and a
+    304 is only sent while the response is cached, i.e. for at most the ttl
+    of the store. With a compressor, the compressed bodies are cached too,
+    one entry per encoding. ETags are strong, one per representation: the
+    ETag of a compressed body ends with its encoding.
+
+    Concurrent misses on the same key are coalesced (see SingleFlight):
+    one request runs the view while the others wait and share its body,
+    so a burst of identical requests costs one set of queries. '''
+
+    def __init__(self, store, compressor=None):
+        self.store = store
+        self.compressor = compressor
+        self.single_flight = SingleFlight()
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    def key(self, tablenames):
+        ''' Returns the cache key of the current request. '''
+
+        args = urlencode(sorted(request.args.items(multi=True)))
+        generations = '.'.join(str(self.store.generation(tablename))
+                               for tablename in tablenames)
+
+        return '{}?{}#{}'.format(request.path, args, generations)
+
+    def modified(self, tablenames):
+        ''' Returns the time the tables were last written. '''
+
+        return max(self.store.modified(tablename) for tablename in tablenames)
+
+    def key_etag(self, key):
+        ''' Returns the ETag of a key, for stores sharing the generations. '''
+
+        return hashlib.sha1('{}|{}'.format(self.store.prefix, key).encode('utf-8')).hexdigest()[:32]
+
+    def body_etag(self, body):
+        ''' Returns the ETag of a body, the same in every worker. '''
+
+        return hashlib.sha1(body).hexdigest()[:32]
+
+    def representation_etag(self, etag, encoding):
+        ''' Returns the ETag of the body sent with an encoding (None for none). '''
+
+        return etag if encoding is None else '{}-{}'.format(etag, encoding)
+
+    def not_modified_etag(self, etag, encoding, modified):
+        ''' Returns the ETag of the current representation the client
+        already has, or None. Small bodies are never compressed, so the
+        client may hold the plain one. If-None-Match wins over
+        If-Modified-Since, as in RFC 7232. '''
+
+        etags = (self.representation_etag(etag, encoding), etag)
+
+        if request.if_none_match:
+            return next((candidate for candidate in etags
+                         if request.if_none_match.contains_weak(candidate)), None)
+
+        if request.if_modified_since is not None and \
+                modified < calendar.timegm(request.if_modified_since.utctimetuple()):
+            return etags[0]
+
+        return None
+
+    def _respond(self, etag, modified, body=None, encoding=None):
+        if body is None:
+            response = current_app.response_class(status=304)
+        else:
+            response = current_app.response_class(body, mimetype='application/json')
+            if encoding is not None:
+                response.headers['Content-Encoding'] = encoding
+
+        response.set_etag(etag)
+
+        # HTTP dates have no fractions, so only send it once its second is over:
+        # a write later in the same second would go unnoticed otherwise
+        last_modified = math.floor(modified) + 1
+        if time.time() >= last_modified:
+            response.last_modified = last_modified
+
+        # Let browsers and proxies keep it, but revalidate every time
+        response.cache_control.public = True
+        response.cache_control.no_cache = True
+
+        if self.compressor is not None:
+            response.vary.add('Accept-Encoding')
+
+        return response
+
+    def _compressed(self, key, etag, body, encoding):
+        compressed = self.compressor.compress(body, encoding)
+
+        if len(compressed) <= MAX_CACHED_RESPONSE_SIZE:
+            self.store.set('{}~{}'.format(key, encoding), etag, compressed)
+
+        return compressed
+
+    def cached(self, *tablenames):
+        ''' Decorator for a view whose GET response only depends on
+        the path, the query args and the given tables. Only 200 responses
+        are cached; errors go through the view every time. '''
+
+        def decorator(view):
+
+            @functools.wraps(view)
+            def wrapper(*args, **kwargs):
+                if request.method != 'GET':
+                    return view(*args, **kwargs)
+
+                key = self.key(tablenames)
+                modified = self.modified(tablenames)
+                etag = None
+
+                encoding = None
+                if self.compressor is not None:
+                    encoding = self.compressor.choose_encoding()
+
+                if self.store.shared_generations:
+                    etag = self.key_etag(key)
+                    current = self.not_modified_etag(etag, encoding, modified)
+
+                    if current is not None:
+                        self.not_modified += 1
+                        return self._respond(current, modified)
+
+                entry = None
+                if encoding is not None:
+                    entry = self.store.get('{}~{}'.format(key, encoding))
+
+                if entry is None:
+                    entry = self.store.get(key)
+                    encoded = False
+                else:
+                    encoded = True
+
+                if entry is not None:
+                    current = self.not_modified_etag(entry[0], encoding, modified)
+
+                    if current is not None:
+                        self.not_modified += 1
+                        return self._respond(current, modified)
+
+                    self.hits += 1
+                    etag, body = entry
+
+                    if encoded:
+                        return self._respond(self.representation_etag(etag, encoding),
+                                             modified, body, encoding)
+                else:
+                    self.misses += 1
+                    responses = []
+
+                    def load():
+                        responses.append(make_response(view(*args, **kwargs)))
+
+                        if responses[0].status_code != 200 or responses[0].is_streamed:
+                            return None
+
+                        body = responses[0].get_data()
+                        body_etag = etag or self.body_etag(body)
+
+                        if len(body) <= MAX_CACHED_RESPONSE_SIZE:
+                            self.store.set(key, body_etag, body)
+
+                        return body_etag, body
+
+                    loaded = self.single_flight.do(key, load)
+
+                    if loaded is None:
+                        # Only a 200 body is shared, anything else is run again
+                        return responses[0] if responses else view(*args, **kwargs)
+
+                    etag, body = loaded
+
+                if encoding is not None and len(body) >= self.compressor.min_size:
+                    return self._respond(self.representation_etag(etag, encoding), modified,
+                                         self._compressed(key, etag, body, encoding), encoding)
+
+                return self._respond(etag, modified, body)
+
+            return wrapper
+
+        return decorator
+
+    def clear(self):
+        ''' Drops every cached response of this process. '''
+
+        self.store.clear()
+
+    def stats(self):
+        ''' Returns the hit/miss counters and the size of the store. '''
+
+        stats = {'hits': self.hits, 'misses': self.misses,
+                 'not_modified': self.not_modified, 'coalesced': self.single_flight.shared}
+        stats.update(self.store.stats())
+
+        return stats
+
+
+def create_response_cache(config, compressor=None):
+    ''' Helper function: Returns the response cache for the app config.
+    RESPONSE_CACHE_STORE can hold a ready made store (e.g. for tests),
+    otherwise RESPONSE_CACHE_REDIS_URL selects Redis (needs the optional
+    redis package) and the in-process store is the default, bounded by
+    RESPONSE_CACHE_MAX_BYTES. The compressor, if any, compresses the
+    cached responses. '''
+
+    if config.get('RESPONSE_CACHE_STORE') is not None:
+        return ResponseCache(config['RESPONSE_CACHE_STORE'], compressor)
+
+    ttl = config.get('RESPONSE_CACHE_TTL', RESPONSE_CACHE_TTL)
+    redis_url = config.get('RESPONSE_CACHE_REDIS_URL')
+
+    if not redis_url:
+        max_bytes = int(config.get('RESPONSE_CACHE_MAX_BYTES') or RESPONSE_CACHE_MAX_BYTES)
+        return ResponseCache(MemoryResponseStore(ttl=ttl, max_bytes=max_bytes), compressor)
+
+    try:
+        import redis
+    except ImportError:
+        raise RuntimeError('The redis package is required for RESPONSE_CACHE_REDIS_URL')
+
+    return ResponseCache(RedisResponseStore(redis.Redis.from_url(redis_url), ttl=ttl), compressor)
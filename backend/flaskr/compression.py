@@ -0,0 +1,109 @@
+import zlib
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESS_MIN_SIZE = 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 4
+
+COMPRESSIBLE_MIMETYPES = ('application/json', 'application/x-ndjson', 'text/csv',
+                          'text/plain', 'text/html')
+
+# Preferred first, when the client accepts several equally
+ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def gzip_compressor(level=GZIP_LEVEL):
+    ''' Helper function: Returns a zlib compressor writing the gzip format. '''
+
+    return zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+
+class Compressor:
+    ''' Negotiated gzip (and brotli, when the optional package is installed)
+    compression of the responses, applied in after_request.
+
+    Bodies under min_size are sent as they are, the headers would eat most
+    of the gain. Streamed responses (e.g. the exports) are compressed chunk
+    by chunk as they are sent, so they are never held in memory. '''
+
+    def __init__(self, min_size=COMPRESS_MIN_SIZE, gzip_level=GZIP_LEVEL,
+                 brotli_quality=BROTLI_QUALITY):
+        self.min_size = min_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    def choose_encoding(self):
+        ''' Returns the encoding to use for the current request, or None. '''
+
+        return request.accept_encodings.best_match(ENCODINGS)
+
+    def compress(self, body, encoding):
+        ''' Returns body compressed with encoding. '''
+
+        if encoding == 'br':
+            return brotli.compress(body, quality=self.brotli_quality)
+
+        compressor = gzip_compressor(self.gzip_level)
+        return compressor.compress(body) + compressor.flush()
+
+    def compress_chunks(self, chunks, encoding):
+        ''' Yields the compressed chunks, flushing after each one so clients
+        get data as soon as it is produced. '''
+
+        if encoding == 'br':
+            compressor = brotli.Compressor(quality=self.brotli_quality)
+            for chunk in chunks:
+                yield compressor.process(chunk) + compressor.flush()
+            yield compressor.finish()
+        else:
+            compressor = gzip_compressor(self.gzip_level)
+            for chunk in chunks:
+                yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            yield compressor.flush()
+
+    def should_compress(self, response):
+        return (200 <= response.status_code < 300 and response.status_code != 204
+                and response.mimetype in COMPRESSIBLE_MIMETYPES
+                and 'Content-Encoding' not in response.headers
+                and not response.direct_passthrough)
+
+    def response(self, response):
+        ''' Compresses the response if the client accepts it and it is worth it. '''
+
+        if not self.should_compress(response):
+            return response
+
+        response.vary.add('Accept-Encoding')
+
+        encoding = self.choose_encoding()
+        if encoding is None:
+            return response
+
+        if response.is_streamed:
+            response.response = self.compress_chunks(response.iter_encoded(), encoding)
+            response.headers.pop('Content-Length', None)
+        else:
+            body = response.get_data()
+            if len(body) < self.min_size:
+                return response
+            response.set_data(self.compress(body, encoding))
+
+        response.headers['Content-Encoding'] = encoding
+
+        return response
+
+
+def create_compressor(config):
+    ''' Helper function: Returns the response compressor for the app config,
+    or None when COMPRESS_RESPONSES is off. COMPRESS_MIN_SIZE is the smallest
+    body (in bytes) worth compressing. '''
+
+    if str(config.get('COMPRESS_RESPONSES', True)).lower() in ('0', 'false', 'no'):
+        return None
+
+    return Compressor(min_size=int(config.get('COMPRESS_MIN_SIZE') or COMPRESS_MIN_SIZE))
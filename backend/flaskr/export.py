@@ -0,0 +1,70 @@
+import csv
+import io
+
+from models import Question
+from flaskr.serialization import QUESTION_FIELDS, question_query, dumps
+
+EXPORT_BATCH = 1000
+EXPORT_FIELDS = QUESTION_FIELDS
+EXPORT_MIMETYPES = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+
+
+def export_rows(category_id=None):
+    ''' Helper function: Yields every question as a tuple of EXPORT_FIELDS, by id.
+    Rows are fetched EXPORT_BATCH at a time (a server side cursor on
+    PostgreSQL), so memory stays flat whatever the size of the table. '''
+
+    query = question_query()
+
+    if category_id is not None:
+        query = query.filter(Question.category == category_id)
+
+    return query.order_by(Question.id).yield_per(EXPORT_BATCH)
+
+
+def _batches(rows):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == EXPORT_BATCH:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def ndjson_chunks(rows):
+    ''' Helper function: Yields the rows as newline delimited JSON,
+    one chunk of lines per batch. '''
+
+    for batch in _batches(rows):
+        yield b''.join(dumps(dict(zip(EXPORT_FIELDS, row))) + b'\n'
+                       for row in batch).decode('utf-8')
+
+
+def csv_chunks(rows):
+    ''' Helper function: Yields the rows as CSV with a header line,
+    one chunk of lines per batch. '''
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    writer.writerow(EXPORT_FIELDS)
+    yield buffer.getvalue()
+
+    for batch in _batches(rows):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(batch)
+        yield buffer.getvalue()
+
+
+def export_chunks(data_format, category_id=None):
+    ''' Helper function: Yields the export of the questions in data_format. '''
+
+    rows = export_rows(category_id)
+
+    if data_format == 'csv':
+        return csv_chunks(rows)
+
+    return ndjson_chunks(rows)
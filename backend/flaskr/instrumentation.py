@@ -0,0 +1,266 @@
+import io
+import logging
+import threading
+import time
+from collections import defaultdict
+from flask import g, has_app_context, current_app, request
+from sqlalchemy import event, text
+from sqlalchemy.engine import Engine
+
+SLOW_QUERY_MS = 500
+PROFILE_STATS_LINES = 50
+
+# Prometheus' default buckets, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+slow_query_logger = logging.getLogger('flaskr.sql')
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _stop_query_timer(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_started'].pop()
+
+    # Add it up for the current request, see request_db_stats()
+    if has_app_context():
+        g.db_query_count = g.get('db_query_count', 0) + 1
+        g.db_time = g.get('db_time', 0.0) + elapsed
+
+        slow_query_ms = current_app.config.get('SLOW_QUERY_MS', SLOW_QUERY_MS)
+        if slow_query_ms is not None and elapsed * 1000 >= float(slow_query_ms):
+            g.db_slow_query_count = g.get('db_slow_query_count', 0) + 1
+            _log_slow_query(conn, statement, parameters, executemany, elapsed)
+
+
+def explain(conn, statement, parameters):
+    ''' Helper function: Returns the query plan of a SELECT, or None.
+    Runs on the raw connection so it is not counted, inside a savepoint
+    on PostgreSQL so a failure does not abort the transaction. '''
+
+    if not statement.lstrip().upper().startswith(('SELECT', 'WITH')):
+        return None
+
+    postgres = conn.dialect.name == 'postgresql'
+    prefix = 'EXPLAIN ' if postgres else 'EXPLAIN QUERY PLAN '
+    cursor = conn.connection.cursor()
+
+    try:
+        if postgres:
+            cursor.execute('SAVEPOINT explain_slow_query')
+        try:
+            cursor.execute(prefix + statement, parameters)
+            plan = '\n'.join(' '.join(str(column) for column in row)
+                             for row in cursor.fetchall())
+        except Exception as error:
+            plan = 'EXPLAIN failed: {}'.format(error)
+            if postgres:
+                cursor.execute('ROLLBACK TO SAVEPOINT explain_slow_query')
+        if postgres:
+            cursor.execute('RELEASE SAVEPOINT explain_slow_query')
+    finally:
+        cursor.close()
+
+    return plan
+
+
+def _log_slow_query(conn, statement, parameters, executemany, elapsed):
+    plan = None
+    if current_app.config.get('SLOW_QUERY_EXPLAIN', True) and not executemany:
+        plan = explain(conn, statement, parameters)
+
+    slow_query_logger.warning('Slow query (%.1f ms): %s\nParameters: %r%s',
+                              elapsed * 1000, statement, parameters,
+                              '\nPlan:\n' + plan if plan else '')
+
+
+def request_db_stats():
+    ''' Helper function: Returns (query count, seconds in the db) so far
+    for the current request. '''
+
+    return g.get('db_query_count', 0), g.get('db_time', 0.0)
+
+
+def start_request_timer():
+    ''' Helper function: Marks the start of the current request. '''
+
+    g.request_started = time.perf_counter()
+
+
+def request_duration():
+    ''' Helper function: Returns the seconds since start_request_timer(). '''
+
+    return time.perf_counter() - g.get('request_started', time.perf_counter())
+
+
+def add_db_timing_headers(response):
+    ''' Helper function: Reports the request's query count, db time and
+    total time in Server-Timing and X-DB-Query-Count headers. '''
+
+    query_count, db_time = request_db_stats()
+
+    response.headers.add(
+        'Server-Timing', 'db;dur={:.2f};desc="{} queries", app;dur={:.2f}'.format(
+            db_time * 1000, query_count, request_duration() * 1000))
+    response.headers['X-DB-Query-Count'] = str(query_count)
+
+    return response
+
+
+def start_profiler():
+    ''' Helper function: Profiles the current request if it asks for it
+    with ?profile=1 (cProfile) or ?profile=pyinstrument, and PROFILING_ENABLED
+    is set. Profiling exposes the code, so keep it off in production. '''
+
+    mode = request.args.get('profile')
+
+    if not mode or not current_app.config.get('PROFILING_ENABLED'):
+        return
+
+    if mode == 'pyinstrument':
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            Profiler = None
+
+        if Profiler is not None:
+            g.profiler = Profiler()
+            g.profiler.start()
+            return
+
+    # Imported here, most workers never profile
+    import cProfile
+
+    g.profiler = cProfile.Profile()
+    g.profiler.enable()
+
+
+def profile_response(response):
+    ''' Helper function: Replaces the response with the profile of the
+    request, as text, when start_profiler() profiled it. '''
+
+    profiler = g.pop('profiler', None)
+    if profiler is None:
+        return response
+
+    import cProfile
+    import pstats
+
+    if isinstance(profiler, cProfile.Profile):
+        profiler.disable()
+        output = io.StringIO()
+        pstats.Stats(profiler, stream=output).sort_stats('cumulative') \
+            .print_stats(PROFILE_STATS_LINES)
+        report = output.getvalue()
+    else:
+        profiler.stop()
+        report = profiler.output_text()
+
+    return current_app.response_class(report, mimetype='text/plain')
+
+
+class Metrics:
+    ''' Request and db counters of this process, in the Prometheus
+    text format: a latency histogram per route, request counts per status,
+    and the queries, db time and slow queries per route. '''
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._latency = {}
+        self._requests = defaultdict(int)
+        self._db_queries = defaultdict(int)
+        self._db_seconds = defaultdict(float)
+        self._slow_queries = defaultdict(int)
+
+    def observe_request(self, method, route, status, seconds):
+        ''' Records one request, with the db stats of the current request. '''
+
+        query_count, db_time = request_db_stats()
+
+        with self._lock:
+            histogram = self._latency.get((method, route))
+            if histogram is None:
+                # A count per bucket, then the sum and the count of all
+                histogram = self._latency[(method, route)] = [0] * len(self.buckets) + [0.0, 0]
+
+            for position, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    histogram[position] += 1
+            histogram[-2] += seconds
+            histogram[-1] += 1
+
+            self._requests[(method, route, status)] += 1
+            self._db_queries[(method, route)] += query_count
+            self._db_seconds[(method, route)] += db_time
+            self._slow_queries[(method, route)] += g.get('db_slow_query_count', 0)
+
+    def render(self):
+        ''' Returns the metrics in the Prometheus text exposition format. '''
+
+        def labels(**values):
+            return ','.join('{}="{}"'.format(name, str(value).replace('\\', '\\\\')
+                                             .replace('"', '\\"').replace('\n', '\\n'))
+                            for name, value in values.items())
+
+        lines = []
+
+        with self._lock:
+            lines.append('# HELP trivia_http_request_duration_seconds Request latency.')
+            lines.append('# TYPE trivia_http_request_duration_seconds histogram')
+            for (method, route), histogram in sorted(self._latency.items()):
+                for bound, count in zip(self.buckets, histogram):
+                    lines.append('trivia_http_request_duration_seconds_bucket{{{}}} {}'.format(
+                        labels(method=method, route=route, le=bound), count))
+                lines.append('trivia_http_request_duration_seconds_bucket{{{}}} {}'.format(
+                    labels(method=method, route=route, le='+Inf'), histogram[-1]))
+                lines.append('trivia_http_request_duration_seconds_sum{{{}}} {}'.format(
+                    labels(method=method, route=route), histogram[-2]))
+                lines.append('trivia_http_request_duration_seconds_count{{{}}} {}'.format(
+                    labels(method=method, route=route), histogram[-1]))
+
+            for name, kind, description, values in (
+                    ('trivia_http_requests_total', 'counter', 'Requests by status.',
+                     self._requests),
+                    ('trivia_db_queries_total', 'counter', 'SQL statements run.',
+                     self._db_queries),
+                    ('trivia_db_query_seconds_total', 'counter', 'Time spent in SQL statements.',
+                     self._db_seconds),
+                    ('trivia_db_slow_queries_total', 'counter', 'Statements over SLOW_QUERY_MS.',
+                     self._slow_queries)):
+                lines.append('# HELP {} {}'.format(name, description))
+                lines.append('# TYPE {} {}'.format(name, kind))
+                for key, value in sorted(values.items()):
+                    names = ('method', 'route', 'status')[:len(key)]
+                    lines.append('{}{{{}}} {}'.format(name, labels(**dict(zip(names, key))), value))
+
+        return '\n'.join(lines) + '\n'
+
+
+def pool_status(engine):
+    ''' Helper function: Returns the connection counts of the engine's pool.
+    Pools without a fixed size (e.g. SQLite's) only report their class. '''
+
+    pool = engine.pool
+    status = {'class': type(pool).__name__}
+
+    for name in ('size', 'checkedin', 'checkedout', 'overflow'):
+        if hasattr(pool, name):
+            status[name] = getattr(pool, name)()
+
+    return status
+
+
+def ping(engine):
+    ''' Helper function: Runs SELECT 1 on a pooled connection.
+    Returns the round trip in milliseconds. Raises if the db is unreachable. '''
+
+    start = time.perf_counter()
+
+    with engine.connect() as connection:
+        connection.execute(text('SELECT 1'))
+
+    return (time.perf_counter() - start) * 1000
@@ -0,0 +1,24 @@
+import threading
+
+
+class Lazy:
+    ''' An optional subsystem built by factory() the first time it is used,
+    so workers that never use it do not build it at startup. Call the Lazy
+    to get it. '''
+
+    def __init__(self, factory):
+        self.factory = factory
+        self._value = None
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        if self._value is None:
+            with self._lock:
+                if self._value is None:
+                    self._value = self.factory()
+
+        return self._value
+
+    @property
+    def created(self):
+        return self._value is not None
@@ -0,0 +1,427 @@
+import datetime
+import gzip
+import hashlib
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from flask import request, current_app
+
+from models import db, Question, table_generations, generation_listeners
+from flaskr.quiz import ALL_CATEGORIES
+from flaskr.bulk import MIN_DIFFICULTY, MAX_DIFFICULTY
+from flaskr.serialization import question_query, format_rows, dumps
+
+PACK_SIZE = 10
+PACK_DAYS_AHEAD = 1
+PACK_DAYS_KEPT = 7
+PACK_CHECK_MAX_AGE = 60
+PACK_FILE_SUFFIX = '.json.gz'
+
+# <day>-<category>-<difficulty>, e.g. 2026-10-18-3-2 (category 0 for all categories)
+PACK_ID_PATTERN = re.compile(r'^(\d{4}-\d{2}-\d{2})-(\d+)-(\d+)$')
+
+
+def pack_id(day, category_id, difficulty):
+    ''' Helper function: Returns the id of the pack of a day, category and difficulty. '''
+
+    return '{}-{}-{}'.format(day.isoformat(), category_id, difficulty)
+
+
+def parse_day(value):
+    ''' Helper function: Returns the date of a YYYY-MM-DD string, or None. '''
+
+    try:
+        return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        return None
+
+
+def parse_pack_id(pack_id):
+    ''' Helper function: Returns the (day, category, difficulty) of a pack id,
+    or None if it is not one. '''
+
+    match = PACK_ID_PATTERN.match(pack_id)
+    day = parse_day(match.group(1)) if match is not None else None
+
+    if day is None:
+        return None
+
+    return day, int(match.group(2)), int(match.group(3))
+
+
+def today():
+    ''' Helper function: Returns the current day, in UTC like the pack ids. '''
+
+    return datetime.datetime.utcnow().date()
+
+
+def encode_pack(pack_id, questions):
+    ''' Helper function: Returns the blob of a pack, its response body gzipped.
+    It is sent as it is to clients accepting gzip. '''
+
+    day, category_id, difficulty = parse_pack_id(pack_id)
+    body = dumps({'success': True, 'id': pack_id, 'day': day.isoformat(),
+                  'category': category_id, 'difficulty': difficulty,
+                  'questions': questions})
+
+    # mtime=0 so the same pack always gives the same blob (and ETag)
+    return gzip.compress(body, mtime=0)
+
+
+def decode_pack(blob):
+    ''' Helper function: Returns the pack of a blob as a dict. '''
+
+    return json.loads(gzip.decompress(blob))
+
+
+class MemoryPackStore:
+    ''' Pack blobs kept in this process. '''
+
+    def __init__(self):
+        self._blobs = {}
+
+    def get(self, pack_id):
+        return self._blobs.get(pack_id)
+
+    def put(self, pack_id, blob):
+        self._blobs[pack_id] = blob
+
+    def delete(self, pack_id):
+        self._blobs.pop(pack_id, None)
+
+    def ids(self):
+        return list(self._blobs)
+
+
+class FilePackStore:
+    ''' Pack blobs kept as files in a directory, so they survive restarts and
+    packs generated by the CLI are served by every worker. Files are replaced
+    atomically, readers never see half a pack. '''
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, pack_id):
+        return os.path.join(self.directory, pack_id + PACK_FILE_SUFFIX)
+
+    def get(self, pack_id):
+        try:
+            with open(self._path(pack_id), 'rb') as pack_file:
+                return pack_file.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, pack_id, blob):
+        handle, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+
+        try:
+            with os.fdopen(handle, 'wb') as temp_file:
+                temp_file.write(blob)
+            os.replace(temp_path, self._path(pack_id))
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+    def delete(self, pack_id):
+        try:
+            os.remove(self._path(pack_id))
+        except FileNotFoundError:
+            pass
+
+    def ids(self):
+        return [name[:-len(PACK_FILE_SUFFIX)] for name in os.listdir(self.directory)
+                if name.endswith(PACK_FILE_SUFFIX)]
+
+
+class QuizPacks:
+    ''' Daily quiz packs: the same size questions for every player of a day,
+    per category (and for all categories) and difficulty, drawn ahead of time
+    so serving one is a lookup of its blob.
+
+    The draw is seeded with the pack id, so workers generating the same day
+    get the same packs. Today's and the next days_ahead days' packs are
+    generated on demand the first time this process serves such a day, so
+    packs work without the CLI or the scheduler.
+
+    A pack is checked against the db (one primary key query) the first time
+    it is served after the questions table changed, and at least every
+    max_age seconds for the writes of other processes: deleted questions, or
+    questions moved to another category or difficulty, are replaced by new
+    draws and the rest of the pack is kept. '''
+
+    def __init__(self, store, size=PACK_SIZE, max_age=PACK_CHECK_MAX_AGE,
+                 days_ahead=PACK_DAYS_AHEAD, days_kept=PACK_DAYS_KEPT):
+        self.store = store
+        self.size = size
+        self.max_age = max_age
+        self.days_ahead = days_ahead
+        self.days_kept = days_kept
+        self._checked = {}
+        self._generated_days = set()
+        self._lock = threading.RLock()
+
+    def _draw(self, pack_id, candidates, excluded, count):
+        rng = random.Random(pack_id)
+        candidates = [question_id for question_id in candidates if question_id not in excluded]
+
+        return rng.sample(candidates, min(count, len(candidates)))
+
+    def _candidates(self, category_id, difficulty):
+        query = db.session.query(Question.id).filter(Question.difficulty == difficulty)
+
+        if category_id != ALL_CATEGORIES:
+            query = query.filter(Question.category == category_id)
+
+        return [row[0] for row in query.order_by(Question.id)]
+
+    def _load(self, question_ids):
+        rows = question_query().filter(Question.id.in_(question_ids)) if question_ids else []
+
+        return {row.id: row for row in rows}
+
+    def generate(self, day, replace=False):
+        ''' Generates the packs of a day, with one query for the question ids
+        and one for the chosen questions. Existing packs are kept unless
+        replace. Returns the number of packs written. '''
+
+        generation = table_generations[Question.__tablename__]
+        candidates = defaultdict(list)
+
+        rows = db.session.query(Question.id, Question.category, Question.difficulty) \
+            .filter(Question.difficulty.between(MIN_DIFFICULTY, MAX_DIFFICULTY)) \
+            .order_by(Question.id)
+
+        for question_id, category_id, difficulty in rows:
+            if category_id is not None:
+                candidates[(category_id, difficulty)].append(question_id)
+            candidates[(ALL_CATEGORIES, difficulty)].append(question_id)
+
+        existing = set(self.store.ids())
+        chosen = {}
+
+        for (category_id, difficulty), question_ids in candidates.items():
+            new_id = pack_id(day, category_id, difficulty)
+            if replace or new_id not in existing:
+                chosen[new_id] = self._draw(new_id, question_ids, (), self.size)
+
+        questions = self._load([question_id for ids in chosen.values() for question_id in ids])
+
+        for new_id, question_ids in chosen.items():
+            self.store.put(new_id, encode_pack(
+                new_id, format_rows(questions[question_id] for question_id in question_ids
+                                    if question_id in questions)))
+            self._checked[new_id] = (generation, time.monotonic())
+
+        return len(chosen)
+
+    def ensure_generated(self, day):
+        ''' Generates the missing packs of a day the first time this process
+        serves it, if it is today or one of the next days_ahead days, and
+        deletes the packs older than days_kept days. '''
+
+        first_day = today()
+
+        if day in self._generated_days or \
+                not first_day <= day <= first_day + datetime.timedelta(days=self.days_ahead):
+            return
+
+        with self._lock:
+            if day not in self._generated_days:
+                self.generate(day)
+                self.prune(first_day - datetime.timedelta(days=self.days_kept))
+                self._generated_days.add(day)
+
+    def prune(self, before):
+        ''' Deletes the packs of the days before a day. Returns how many. '''
+
+        pruned = 0
+
+        for old_id in self.store.ids():
+            parsed = parse_pack_id(old_id)
+            if parsed is not None and parsed[0] < before:
+                self.store.delete(old_id)
+                self._checked.pop(old_id, None)
+                pruned += 1
+
+        return pruned
+
+    def ids(self, day):
+        ''' Returns the ids of the packs of a day, sorted. '''
+
+        self.ensure_generated(day)
+        prefix = day.isoformat() + '-'
+
+        return sorted((existing for existing in self.store.ids() if existing.startswith(prefix)),
+                      key=parse_pack_id)
+
+    def refresh(self, pack_id, blob):
+        ''' Checks a pack against the db, replacing its questions that were
+        deleted or no longer match it. Returns its blob, or None if no question
+        is left for it. '''
+
+        _, category_id, difficulty = parse_pack_id(pack_id)
+        pack = decode_pack(blob)
+        question_ids = [question['id'] for question in pack['questions']]
+        current = self._load(question_ids)
+
+        kept = [question_id for question_id in question_ids if question_id in current
+                and current[question_id].difficulty == difficulty
+                and category_id in (ALL_CATEGORIES, current[question_id].category)]
+
+        missing = len(question_ids) - len(kept)
+        if missing:
+            replacements = self._draw(pack_id, self._candidates(category_id, difficulty),
+                                      set(kept), missing)
+            current.update(self._load(replacements))
+            kept.extend(replacements)
+
+        if not kept:
+            self.store.delete(pack_id)
+            return None
+
+        questions = format_rows(current[question_id] for question_id in kept)
+        if questions != pack['questions']:
+            blob = encode_pack(pack_id, questions)
+            self.store.put(pack_id, blob)
+
+        return blob
+
+    def _stale(self, pack_id, generation):
+        checked = self._checked.get(pack_id)
+
+        return (checked is None or checked[0] != generation
+                or time.monotonic() - checked[1] > self.max_age)
+
+    def get(self, pack_id):
+        ''' Returns the blob of a pack, checked against the db if the
+        questions changed since, or None if there is no such pack. '''
+
+        parsed = parse_pack_id(pack_id)
+        if parsed is None:
+            return None
+
+        self.ensure_generated(parsed[0])
+        blob = self.store.get(pack_id)
+        generation = table_generations[Question.__tablename__]
+
+        if blob is not None and self._stale(pack_id, generation):
+            with self._lock:
+                blob = self.refresh(pack_id, blob)
+                self._checked[pack_id] = (generation, time.monotonic())
+
+        return blob
+
+    def refresh_all(self, day):
+        ''' Checks every pack of a day against the db. '''
+
+        for existing in self.ids(day):
+            self.get(existing)
+
+    def response(self, blob):
+        ''' Returns the response for a pack blob: the blob itself when the
+        client accepts gzip, the decompressed body otherwise. '''
+
+        if request.accept_encodings['gzip']:
+            response = current_app.response_class(blob, mimetype='application/json')
+            response.headers['Content-Encoding'] = 'gzip'
+        else:
+            response = current_app.response_class(gzip.decompress(blob),
+                                                  mimetype='application/json')
+
+        response.vary.add('Accept-Encoding')
+        response.set_etag(hashlib.sha1(blob).hexdigest()[:32], weak=True)
+        response.headers['Cache-Control'] = 'public, no-cache'
+
+        return response.make_conditional(request)
+
+
+class PackScheduler:
+    ''' Generates the packs of today and the next days_ahead days every
+    interval seconds in a background thread, and deletes the packs older than
+    days_kept days. Writes to the questions table wake it up early to check
+    today's packs, so players seldom wait for a pack to be repaired. '''
+
+    def __init__(self, app, packs, interval, days_ahead=PACK_DAYS_AHEAD,
+                 days_kept=PACK_DAYS_KEPT):
+        self.app = app
+        self.packs = packs
+        self.interval = interval
+        self.days_ahead = days_ahead
+        self.days_kept = days_kept
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def generation_bumped(self, tablename):
+        if tablename == Question.__tablename__:
+            self._wake.set()
+
+    def run_once(self):
+        ''' Generates the missing packs, checks today's and prunes the old ones. '''
+
+        day = today()
+
+        with self.app.app_context():
+            try:
+                for offset in range(self.days_ahead + 1):
+                    self.packs.generate(day + datetime.timedelta(days=offset))
+
+                self.packs.refresh_all(day)
+                self.packs.prune(day - datetime.timedelta(days=self.days_kept))
+            finally:
+                db.session.remove()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                self.run_once()
+            except Exception:
+                print(sys.exc_info())
+
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    def start(self):
+        generation_listeners.add(self)
+        self._thread = threading.Thread(target=self._run, name='quiz-packs', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._wake.set()
+        generation_listeners.discard(self)
+
+        if self._thread is not None:
+            self._thread.join()
+
+
+def create_quiz_packs(config):
+    ''' Helper function: Returns the quiz packs for the app config.
+    They are kept in QUIZ_PACK_DIR when it is set, in this process otherwise.
+    QUIZ_PACK_SIZE is the number of questions per pack. '''
+
+    directory = config.get('QUIZ_PACK_DIR')
+    store = FilePackStore(directory) if directory else MemoryPackStore()
+
+    return QuizPacks(store, size=int(config.get('QUIZ_PACK_SIZE') or PACK_SIZE))
+
+
+def start_pack_scheduler(app, packs):
+    ''' Helper function: Starts the pack scheduler when QUIZ_PACK_INTERVAL
+    (seconds between runs) is set. Returns it, or None. '''
+
+    interval = app.config.get('QUIZ_PACK_INTERVAL')
+    if not interval:
+        return None
+
+    scheduler = PackScheduler(app, packs, float(interval))
+    scheduler.start()
+
+    return scheduler
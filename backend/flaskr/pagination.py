@@ -0,0 +1,148 @@
+import base64
+import binascii
+import json
+from flask import request, abort
+
+QUESTIONS_PER_PAGE = 10
+MAX_QUESTIONS_PER_PAGE = 100
+
+
+def encode_cursor(key):
+    ''' Helper function: Turns the key of the last row on a page
+    into an opaque 'after' token. '''
+
+    payload = json.dumps({'k': key}).encode('utf-8')
+
+    return base64.urlsafe_b64encode(payload).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token):
+    ''' Helper function: Turns an 'after' token back into a key.
+    Returns None for an empty token (start from the beginning). '''
+
+    if not token:
+        return None
+
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        key = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))['k']
+    except (ValueError, KeyError, TypeError, binascii.Error):
+        abort(400)
+
+    if not isinstance(key, int):
+        abort(400)
+
+    return key
+
+
+class Page:
+    ''' One page of a query, fetched with LIMIT/OFFSET.
+    The total row count is only queried if it is actually used. '''
+
+    def __init__(self, query, key, number, per_page):
+        self.query = query
+        self.number = number
+        self.per_page = per_page
+        self.items = query.order_by(key).limit(
+            per_page).offset((number-1)*per_page).all()
+        self._key_name = key.key
+        self._is_first = number == 1
+        self._total = None
+
+    @property
+    def total(self):
+        ''' Total number of rows matched by the query (a separate COUNT). '''
+
+        if self._total is None:
+
+            # A short first page already tells us the total, no need to count
+            if self._is_first and len(self.items) < self.per_page:
+                self._total = len(self.items)
+            else:
+                self._total = self.query.order_by(None).count()
+
+        return self._total
+
+    @property
+    def next_cursor(self):
+        ''' Token for the page after this one, or None on the last page. '''
+
+        if len(self.items) < self.per_page:
+            return None
+
+        return encode_cursor(getattr(self.items[-1], self._key_name))
+
+
+class CursorPage(Page):
+    ''' One page of a query, fetched with keyset pagination:
+    WHERE key > after ORDER BY key LIMIT per_page.
+    The cost does not depend on how deep the page is. '''
+
+    def __init__(self, query, key, after, per_page):
+        self.query = query
+        self.number = None
+        self.per_page = per_page
+        self.after = after
+
+        page_query = query
+        if after is not None:
+            page_query = page_query.filter(key > after)
+
+        self.items = page_query.order_by(key).limit(per_page).all()
+        self._key_name = key.key
+        self._is_first = after is None
+        self._total = None
+
+
+def get_page_args():
+    ''' Helper function: Reads 'page' and 'per_page' from the request args.
+    per_page is capped at MAX_QUESTIONS_PER_PAGE. '''
+
+    # The second argument is the default if the key does not exist
+    page = request.args.get('page', 1, type=int)
+    per_page = request.args.get('per_page', QUESTIONS_PER_PAGE, type=int)
+
+    if page < 1 or per_page < 1:
+        abort(400)
+
+    return page, min(per_page, MAX_QUESTIONS_PER_PAGE)
+
+
+def paginate(query, key):
+    ''' Helper function: Returns the requested page of a query ordered by key.
+    Passing 'after' (even empty) switches to keyset pagination,
+    otherwise 'page' is used. Only the rows of that page are loaded from the db. '''
+
+    page, per_page = get_page_args()
+
+    if 'after' in request.args:
+        return CursorPage(query, key, decode_cursor(request.args['after']), per_page)
+
+    return Page(query, key, page, per_page)
+
+
+def get_offset_args():
+    ''' Helper function: Like get_page_args, but returns (offset, limit)
+    for results that are not ordered by a key (e.g. ranked search).
+    In cursor mode the 'after' token holds the offset. '''
+
+    page, per_page = get_page_args()
+
+    if 'after' in request.args:
+        offset = decode_cursor(request.args['after']) or 0
+        if offset < 0:
+            abort(400)
+    else:
+        offset = (page-1)*per_page
+
+    return offset, per_page
+
+
+def next_offset_cursor(offset, limit, total):
+    ''' Helper function: Token for the results after offset+limit,
+    or None if there are none. '''
+
+    if offset + limit >= total:
+        return None
+
+    return encode_cursor(offset + limit)
@@ -0,0 +1,165 @@
+import random
+import time
+from array import array
+from sqlalchemy import func
+
+from models import db, Question, table_generations
+from flaskr.serialization import QuestionRecord, question_query
+
+ALL_CATEGORIES = 0
+MAX_SAMPLE_ATTEMPTS = 8
+EXHAUSTED_RATIO = 0.9
+ID_CACHE_MAX_AGE = 300
+MAX_QUIZ_BATCH = 100
+
+
+class QuestionSampler:
+    ''' Draws a random unplayed question without loading the category.
+
+    The question ids of each category are cached in a compact array,
+    until the questions table changes or max_age seconds pass.
+    A random id is drawn from it and retried while it was already played.
+    When most of the pool has been played the db picks one instead
+    (NOT IN ... ORDER BY random() LIMIT 1).
+
+    pick_many() draws several distinct questions from the cached ids and
+    loads them with one query; with a seed the draw is reproducible. '''
+
+    def __init__(self, max_age=ID_CACHE_MAX_AGE, rng=None):
+        self.max_age = max_age
+        self.rng = rng or random.Random()
+        self._ids = {}
+
+    def invalidate(self):
+        ''' Drops the cached ids, e.g. after a question was added or deleted. '''
+
+        self._ids = {}
+
+    def _category_query(self, query, category_id):
+        if category_id == ALL_CATEGORIES:
+            return query
+
+        return query.filter(Question.category == category_id)
+
+    def cached_ids(self, category_id):
+        ''' Returns the cached array of question ids in a category,
+        or None if it has to be (re)loaded. '''
+
+        cached = self._ids.get(category_id)
+
+        if (cached is None or cached[0] != table_generations[Question.__tablename__]
+                or time.monotonic() - cached[1] > self.max_age):
+            return None
+
+        return cached[2]
+
+    def store_ids(self, category_id, generation, ids):
+        ''' Caches the question ids of a category, loaded at generation.
+        Returns them as an array. '''
+
+        ids = array('i', ids)
+        self._ids[category_id] = (generation, time.monotonic(), ids)
+
+        return ids
+
+    def category_ids(self, category_id):
+        ''' Returns the cached array of question ids in a category. '''
+
+        ids = self.cached_ids(category_id)
+
+        if ids is None:
+            generation = table_generations[Question.__tablename__]
+            # Ordered, so a seeded draw picks the same questions every time
+            rows = self._category_query(db.session.query(Question.id), category_id) \
+                .order_by(Question.id)
+            ids = self.store_ids(category_id, generation, (row[0] for row in rows))
+
+        return ids
+
+    def should_sample(self, ids, previous_ids):
+        ''' Whether enough of ids is unplayed for random draws to find one quickly. '''
+
+        return len(previous_ids) < len(ids) * EXHAUSTED_RATIO
+
+    def draws(self, ids, previous_ids):
+        ''' Yields up to MAX_SAMPLE_ATTEMPTS random unplayed ids. '''
+
+        for _ in range(MAX_SAMPLE_ATTEMPTS):
+            question_id = ids[self.rng.randrange(len(ids))]
+
+            if question_id not in previous_ids:
+                yield question_id
+
+    def _pick_from_db(self, category_id, previous_ids):
+        query = self._category_query(Question.query, category_id)
+
+        if previous_ids:
+            query = query.filter(~Question.id.in_(list(previous_ids)))
+
+        return query.order_by(func.random()).first()
+
+    def pick(self, category_id, previous_ids):
+        ''' Returns a random question of the category (0 for all categories)
+        whose id is not in previous_ids, or None if all have been played. '''
+
+        previous_ids = set(previous_ids)
+        ids = self.category_ids(category_id)
+
+        if not ids:
+            return None
+
+        if self.should_sample(ids, previous_ids):
+            for question_id in self.draws(ids, previous_ids):
+                question = Question.query.get(question_id)
+
+                # The id can be stale if the question was deleted meanwhile
+                if question is not None:
+                    return question
+
+        return self._pick_from_db(category_id, previous_ids)
+
+    def sample_ids(self, ids, previous_ids, count, rng):
+        ''' Returns up to count distinct random ids of ids not in previous_ids. '''
+
+        if len(previous_ids) + count < len(ids) * EXHAUSTED_RATIO:
+            chosen = []
+            seen = set(previous_ids)
+
+            # Few draws are wasted while most of the pool is unplayed
+            while len(chosen) < count:
+                question_id = ids[rng.randrange(len(ids))]
+                if question_id not in seen:
+                    seen.add(question_id)
+                    chosen.append(question_id)
+
+            return chosen
+
+        unplayed = [question_id for question_id in ids if question_id not in previous_ids]
+
+        return rng.sample(unplayed, min(count, len(unplayed)))
+
+    def pick_many(self, category_id, previous_ids, count, seed=None):
+        ''' Returns up to count distinct random questions (QuestionRecords)
+        of the category whose ids are not in previous_ids, in one query.
+        The same seed gives the same questions while the category is unchanged. '''
+
+        rng = random.Random(seed) if seed is not None else self.rng
+        excluded = set(previous_ids)
+        ids = self.category_ids(category_id)
+        questions = []
+
+        for _ in range(MAX_SAMPLE_ATTEMPTS):
+            chosen = self.sample_ids(ids, excluded, count - len(questions), rng)
+            if not chosen:
+                break
+
+            by_id = {row.id: QuestionRecord(*row)
+                     for row in question_query().filter(Question.id.in_(chosen))}
+            questions.extend(by_id[question_id] for question_id in chosen if question_id in by_id)
+
+            # Ids can be stale if questions were deleted meanwhile, draw again
+            excluded.update(chosen)
+            if len(questions) == count:
+                break
+
+        return questions
@@ -0,0 +1,147 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+
+MAX_BUCKETS = 100000
+
+# Monitoring must keep working while a client is throttled
+EXEMPT_RULES = ('/health', '/metrics')
+
+# Token bucket in Redis: refill for the time since the last request,
+# then take a token if there is one. Floats are returned as strings,
+# Redis would truncate Lua numbers to integers.
+REDIS_TAKE_SCRIPT = '''
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(bucket[1]) or burst
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call('HMSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return {allowed, tostring(tokens)}
+'''
+
+
+def retry_after(tokens, rate):
+    ''' Helper function: Returns the seconds until a bucket holding tokens
+    has a whole token again. '''
+
+    return max(0.0, (1 - tokens) / rate)
+
+
+class MemoryRateLimitBackend:
+    ''' Token buckets kept in this process, so each worker limits on its own.
+    The least recently used buckets are dropped past max_buckets; a dropped
+    bucket comes back full, which is what it would have refilled to anyway
+    for all but the most recent ones. '''
+
+    def __init__(self, max_buckets=MAX_BUCKETS):
+        self.max_buckets = max_buckets
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst):
+        ''' Takes a token from the bucket of key, refilled at rate tokens per
+        second up to burst. Returns (allowed, tokens left). '''
+
+        now = time.monotonic()
+
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+
+            while len(self._buckets) > self.max_buckets:
+                self._buckets.popitem(last=False)
+
+        return allowed, tokens
+
+
+class RedisRateLimitBackend:
+    ''' Token buckets kept in Redis, so the limit holds across all workers.
+    Each bucket is a hash updated atomically by a Lua script, expiring once
+    it would be full again. '''
+
+    def __init__(self, client, prefix='trivia:ratelimit:'):
+        self.client = client
+        self.prefix = prefix
+        self._take = client.register_script(REDIS_TAKE_SCRIPT)
+
+    def take(self, key, rate, burst):
+        ''' Takes a token from the bucket of key, refilled at rate tokens per
+        second up to burst. Returns (allowed, tokens left). '''
+
+        allowed, tokens = self._take(keys=[self.prefix + key], args=[rate, burst, time.time()])
+
+        return bool(int(allowed)), float(tokens)
+
+
+class RateLimiter:
+    ''' Limits each client to rate requests per second per route, with bursts
+    of up to burst requests, using a token bucket per (client, route). '''
+
+    def __init__(self, backend, rate, burst=None):
+        self.backend = backend
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1, math.ceil(rate))
+        self.limited = 0
+
+    def check(self, client, route):
+        ''' Returns None if the request may go on, or else the seconds
+        the client should wait before trying again. '''
+
+        if route in EXEMPT_RULES:
+            return None
+
+        allowed, tokens = self.backend.take('{}|{}'.format(client, route), self.rate, self.burst)
+
+        if allowed:
+            return None
+
+        self.limited += 1
+
+        return retry_after(tokens, self.rate)
+
+
+def create_rate_limiter(config):
+    ''' Helper function: Returns the rate limiter for the app config,
+    or None when RATE_LIMIT_PER_SECOND is not set. RATE_LIMIT_BACKEND can
+    hold a ready made backend (e.g. for tests), otherwise RATE_LIMIT_REDIS_URL
+    selects Redis (needs the optional redis package) and the in-process
+    backend is the default. RATE_LIMIT_BURST defaults to one second's worth. '''
+
+    rate = config.get('RATE_LIMIT_PER_SECOND')
+    if not rate:
+        return None
+
+    burst = config.get('RATE_LIMIT_BURST')
+    burst = int(burst) if burst else None
+
+    if config.get('RATE_LIMIT_BACKEND') is not None:
+        return RateLimiter(config['RATE_LIMIT_BACKEND'], float(rate), burst)
+
+    redis_url = config.get('RATE_LIMIT_REDIS_URL')
+
+    if not redis_url:
+        return RateLimiter(MemoryRateLimitBackend(), float(rate), burst)
+
+    try:
+        import redis
+    except ImportError:
+        raise RuntimeError('The redis package is required for RATE_LIMIT_REDIS_URL')
+
+    return RateLimiter(RedisRateLimitBackend(redis.Redis.from_url(redis_url)), float(rate), burst)
@@ -0,0 +1,352 @@
+import bisect
+import functools
+import heapq
+import re
+import threading
+import time
+from array import array
+from sqlalchemy import func, or_, select, text
+
+from models import db, Question, table_generations, change_listeners
+from flaskr.serialization import QuestionRecord, question_query
+
+SEARCH_CONFIG = 'english'
+REBUILD_BATCH = 1000
+INDEX_MAX_AGE = 60
+
+# Weights of a match in the question and in the answer
+QUESTION_WEIGHT = 2.0
+ANSWER_WEIGHT = 1.0
+
+# A word that only starts with the last search token counts for less
+PREFIX_WEIGHT = 0.5
+
+TOKEN_PATTERN = re.compile(r'\w+')
+
+
+def tokenize(text):
+    ''' Helper function: Splits text into lower case word tokens. '''
+
+    return TOKEN_PATTERN.findall(text.lower()) if text else []
+
+
+def create_search_indexes(connection):
+    ''' Helper function: Creates the GIN indexes of the full text search on
+    PostgreSQL (no-op if they exist). Run by the migrations. '''
+
+    connection.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_questions_question_fts ON questions "
+        "USING GIN (to_tsvector('{0}', coalesce(question, '')))".format(SEARCH_CONFIG)))
+    connection.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_questions_question_answer_fts ON questions "
+        "USING GIN (to_tsvector('{0}', coalesce(question, '') || ' ' || "
+        "coalesce(answer, '')))".format(SEARCH_CONFIG)))
+
+
+@functools.lru_cache(maxsize=1024)
+def is_empty_tsquery(query):
+    ''' Helper function: Whether a tsquery has no word left once the stopwords
+    are dropped ("the", "what"), so it would match nothing. '''
+
+    return not db.session.execute(
+        select([func.numnode(func.to_tsquery(SEARCH_CONFIG, query))])).scalar()
+
+
+def load_questions(ids):
+    ''' Helper function: Loads the questions with the given ids, in that order. '''
+
+    if not ids:
+        return []
+
+    by_id = {question.id: question
+             for question in Question.query.filter(Question.id.in_(ids))}
+
+    return [by_id[question_id] for question_id in ids if question_id in by_id]
+
+
+class LikeSearchEngine:
+    ''' Substring search with ILIKE '%term%'. Every search scans the table;
+    kept as the simplest fallback and as the baseline for benchmarks. '''
+
+    def search(self, term, offset, limit, include_answers=False):
+        ''' Returns (questions, total) for one page of the matches, by id.
+        The questions are QuestionRecords. '''
+
+        pattern = '%{}%'.format(term)
+        condition = Question.question.ilike(pattern)
+        if include_answers:
+            condition = or_(condition, Question.answer.ilike(pattern))
+
+        query = question_query().filter(condition)
+        rows = query.order_by(Question.id).offset(offset).limit(limit)
+
+        return [QuestionRecord(*row) for row in rows], query.count()
+
+
+class PostgresSearchEngine:
+    ''' PostgreSQL full text search, ranked with ts_rank.
+    The last word of the term matches as a prefix (search as you type).
+    Uses the GIN indexes made by the migrations (flask db-upgrade).
+    A term made only of stopwords, which the full text search drops,
+    is searched with ILIKE instead. '''
+
+    def __init__(self):
+        self.fallback = LikeSearchEngine()
+
+    def _document(self, include_answers):
+        # Must stay identical to the indexed expressions in create_indexes()
+        if include_answers:
+            return func.to_tsvector(text("'{}'".format(SEARCH_CONFIG)),
+                                    func.coalesce(Question.question, text("''"))
+                                    .op('||')(text("' '"))
+                                    .op('||')(func.coalesce(Question.answer, text("''"))))
+
+        return func.to_tsvector(text("'{}'".format(SEARCH_CONFIG)),
+                                func.coalesce(Question.question, text("''")))
+
+    def create_indexes(self):
+        ''' Creates the GIN indexes used by search (no-op if they exist). '''
+
+        with db.engine.begin() as connection:
+            create_search_indexes(connection)
+
+    def search(self, term, offset, limit, include_answers=False):
+        ''' Returns (questions, total) for one page of the matches, best first.
+        The questions are QuestionRecords. '''
+
+        tokens = tokenize(term)
+        if not tokens:
+            return [], 0
+
+        # Tokens are plain words, so they are safe to join into a tsquery
+        query_text = ' & '.join(tokens[:-1] + [tokens[-1] + ':*'])
+
+        if is_empty_tsquery(query_text):
+            return self.fallback.search(term, offset, limit, include_answers)
+
+        tsquery = func.to_tsquery(SEARCH_CONFIG, query_text)
+        document = self._document(include_answers)
+
+        query = question_query().filter(document.op('@@')(tsquery))
+        rows = query.order_by(func.ts_rank(document, tsquery).desc(), Question.id) \
+            .offset(offset).limit(limit)
+
+        return [QuestionRecord(*row) for row in rows], query.count()
+
+
+class InvertedIndexSearchEngine:
+    ''' Search from an in-process inverted index (word -> question ids),
+    which answers without touching the db. Every word of the term must match,
+    the last one as a prefix. Matches in the question rank above matches in
+    the answer.
+
+    Posting lists are sorted array('I') of question ids to keep memory low.
+    The index is kept up to date with the questions committed through the ORM
+    (see models.change_listeners) and rebuilt, streaming rows in batches,
+    when the table changed some other way. Writes from other processes are
+    not seen here, so the index is also rebuilt once it is max_age seconds old. '''
+
+    def __init__(self, max_age=INDEX_MAX_AGE):
+        self.max_age = max_age
+        self._lock = threading.RLock()
+        self._generation = None
+        self._loaded_at = None
+        self._question_postings = {}
+        self._answer_postings = {}
+        self._vocabulary = []
+        self._records = {}
+        change_listeners.add(self)
+
+    def rebuild(self):
+        ''' Rebuilds the index from the db, streaming the rows in batches. '''
+
+        with self._lock:
+            generation = table_generations['questions']
+            self._question_postings = {}
+            self._answer_postings = {}
+            self._vocabulary = []
+            self._records = {}
+
+            rows = question_query().order_by(Question.id).yield_per(REBUILD_BATCH)
+
+            for row in rows:
+                self._add(QuestionRecord(*row), sort_vocabulary=False)
+
+            self._vocabulary = sorted(set(self._question_postings)
+                                      | set(self._answer_postings))
+            self._generation = generation
+            self._loaded_at = time.monotonic()
+
+    def _stale(self):
+        return (self._generation != table_generations['questions']
+                or time.monotonic() - self._loaded_at > self.max_age)
+
+    def _ensure_fresh(self):
+        if self._stale():
+            with self._lock:
+                if self._stale():
+                    self.rebuild()
+
+    def _add_posting(self, postings, word, question_id, sort_vocabulary):
+        ids = postings.get(word)
+
+        if ids is None:
+            postings[word] = array('I', [question_id])
+
+            if sort_vocabulary:
+                position = bisect.bisect_left(self._vocabulary, word)
+                if position == len(self._vocabulary) or self._vocabulary[position] != word:
+                    self._vocabulary.insert(position, word)
+
+        elif not ids or ids[-1] < question_id:
+            # New questions have the highest ids, so this is the common case
+            ids.append(question_id)
+
+        else:
+            position = bisect.bisect_left(ids, question_id)
+            if position == len(ids) or ids[position] != question_id:
+                ids.insert(position, question_id)
+
+    def _remove_posting(self, postings, word, question_id):
+        ids = postings.get(word)
+        if ids is None:
+            return
+
+        position = bisect.bisect_left(ids, question_id)
+        if position < len(ids) and ids[position] == question_id:
+            del ids[position]
+
+        # Words stay in the vocabulary; prefix lookups skip empty postings
+        if not ids:
+            del postings[word]
+
+    def _add(self, record, sort_vocabulary=True):
+        self._remove(record.id)
+        self._records[record.id] = record
+
+        for word in set(tokenize(record.question)):
+            self._add_posting(self._question_postings, word, record.id, sort_vocabulary)
+        for word in set(tokenize(record.answer)):
+            self._add_posting(self._answer_postings, word, record.id, sort_vocabulary)
+
+    def _remove(self, question_id):
+        record = self._records.pop(question_id, None)
+        if record is None:
+            return
+
+        for word in set(tokenize(record.question)):
+            self._remove_posting(self._question_postings, word, question_id)
+        for word in set(tokenize(record.answer)):
+            self._remove_posting(self._answer_postings, word, question_id)
+
+    def apply_changes(self, changes, generations):
+        ''' Updates the index with questions committed through the ORM. '''
+
+        with self._lock:
+            # Not built yet, the first search will load everything anyway
+            if self._generation is None:
+                return
+
+            for tablename, operation, row in changes:
+                if tablename != Question.__tablename__:
+                    continue
+
+                if operation == 'deleted':
+                    self._remove(row['id'])
+                else:
+                    self._add(QuestionRecord(**row))
+
+            self._generation = table_generations['questions']
+
+    def _words(self, token, prefix):
+        if not prefix:
+            return [token]
+
+        words = []
+        position = bisect.bisect_left(self._vocabulary, token)
+
+        while position < len(self._vocabulary):
+            word = self._vocabulary[position]
+            if not word.startswith(token):
+                break
+            words.append(word)
+            position += 1
+
+        return words
+
+    def _token_scores(self, token, prefix, include_answers):
+        scores = {}
+
+        for word in self._words(token, prefix):
+            weight = 1.0 if word == token else PREFIX_WEIGHT
+
+            fields = [(self._question_postings, QUESTION_WEIGHT)]
+            if include_answers:
+                fields.append((self._answer_postings, ANSWER_WEIGHT))
+
+            for postings, field_weight in fields:
+                score = weight * field_weight
+                for question_id in postings.get(word, ()):
+                    if scores.get(question_id, 0) < score:
+                        scores[question_id] = score
+
+        return scores
+
+    def search(self, term, offset, limit, include_answers=False):
+        ''' Returns (questions, total) for one page of the matches, best first.
+        The questions are QuestionRecords, read from the index. '''
+
+        self._ensure_fresh()
+
+        tokens = tokenize(term)
+        if not tokens:
+            return [], 0
+
+        scores = None
+        for position, token in enumerate(tokens):
+            token_scores = self._token_scores(
+                token, position == len(tokens) - 1, include_answers)
+
+            if scores is None:
+                scores = token_scores
+            else:
+                scores = {question_id: score + token_scores[question_id]
+                          for question_id, score in scores.items()
+                          if question_id in token_scores}
+
+            if not scores:
+                return [], 0
+
+        # Only the requested page needs to be in order
+        def key(question_id):
+            return -scores[question_id], question_id
+
+        if offset + limit < len(scores):
+            ranked = heapq.nsmallest(offset + limit, scores, key=key)
+        else:
+            ranked = sorted(scores, key=key)
+
+        records = [self._records.get(question_id) for question_id in ranked[offset:offset+limit]]
+
+        return [record for record in records if record is not None], len(scores)
+
+
+def create_search_engine(config):
+    ''' Helper function: Returns the search engine for the app config.
+    SEARCH_BACKEND is 'postgres', 'memory', 'like' or 'auto' (the default:
+    full text search on PostgreSQL, the inverted index otherwise). '''
+
+    backend = config.get('SEARCH_BACKEND') or 'auto'
+
+    if backend == 'auto':
+        uri = config.get('SQLALCHEMY_DATABASE_URI') or ''
+        backend = 'postgres' if uri.startswith('postgres') else 'memory'
+
+    if backend == 'postgres':
+        return PostgresSearchEngine()
+    if backend == 'memory':
+        return InvertedIndexSearchEngine()
+    if backend == 'like':
+        return LikeSearchEngine()
+
+    raise ValueError('Unknown SEARCH_BACKEND: {}'.format(backend))
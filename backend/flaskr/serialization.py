@@ -0,0 +1,88 @@
+import json
+from collections import namedtuple
+from flask import current_app
+
+from models import db, Question
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+QUESTION_FIELDS = ('id', 'question', 'answer', 'category', 'difficulty')
+
+
+class QuestionRecord(namedtuple('QuestionRecord', QUESTION_FIELDS)):
+    ''' A question read as plain columns, formatted like Question. '''
+
+    __slots__ = ()
+
+    def format(self):
+        return dict(zip(QUESTION_FIELDS, self))
+
+
+def question_query():
+    ''' Helper function: Returns a query for the columns of QUESTION_FIELDS.
+    Its rows are tuples, so no Question objects are built for them. '''
+
+    return db.session.query(*[getattr(Question, field) for field in QUESTION_FIELDS])
+
+
+def format_rows(rows):
+    ''' Helper function: Formats question rows (tuples of QUESTION_FIELDS)
+    like Question.format(). '''
+
+    return [dict(zip(QUESTION_FIELDS, row)) for row in rows]
+
+
+def stdlib_dumps(obj):
+    ''' Helper function: Encodes obj as compact JSON bytes with the json module. '''
+
+    return json.dumps(obj, sort_keys=True, separators=(',', ':')).encode('utf-8')
+
+
+def orjson_dumps(obj):
+    ''' Helper function: Encodes obj as JSON bytes with orjson.
+    Keys are sorted and int keys allowed, like with jsonify. '''
+
+    return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS)
+
+
+SERIALIZERS = {'json': stdlib_dumps}
+if orjson is not None:
+    SERIALIZERS['orjson'] = orjson_dumps
+
+# The fastest one installed
+dumps = orjson_dumps if orjson is not None else stdlib_dumps
+
+
+class JSONSerializer:
+    ''' Builds JSON responses with the selected encoder, skipping jsonify. '''
+
+    def __init__(self, dumps=dumps):
+        self.dumps = dumps
+
+    def response(self, obj, status=200):
+        ''' Returns a JSON response for obj. '''
+
+        return current_app.response_class(self.dumps(obj), status=status,
+                                          mimetype='application/json')
+
+
+def create_serializer(config):
+    ''' Helper function: Returns the JSON serializer for the app config.
+    JSON_SERIALIZER is 'orjson', 'json' or 'auto' (the default: orjson
+    when the optional package is installed, the json module otherwise). '''
+
+    name = config.get('JSON_SERIALIZER') or 'auto'
+
+    if name == 'auto':
+        return JSONSerializer()
+
+    if name == 'orjson' and orjson is None:
+        raise RuntimeError('The orjson package is required for JSON_SERIALIZER=orjson')
+
+    if name not in SERIALIZERS:
+        raise ValueError('Unknown JSON_SERIALIZER: {}'.format(name))
+
+    return JSONSerializer(SERIALIZERS[name])
@@ -0,0 +1,142 @@
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+SESSION_TTL = 60*60
+MAX_SESSIONS = 10000
+REDIS_PUSH_BATCH = 10000
+
+# Returned by pop() when the session does not exist or has expired
+MISSING = object()
+
+
+def new_session_id():
+    ''' Helper function: Returns a random, url safe session id. '''
+
+    return secrets.token_urlsafe(16)
+
+
+class MemorySessionStore:
+    ''' Quiz sessions kept in this process.
+    Least recently used sessions are evicted past max_sessions,
+    and sessions unused for ttl seconds expire. '''
+
+    def __init__(self, ttl=SESSION_TTL, max_sessions=MAX_SESSIONS):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def create(self, session_id, question_ids):
+        ''' Stores the (already shuffled) question ids of a new session. '''
+
+        # Stored reversed so the next question is popped off the end in O(1)
+        remaining = question_ids[::-1]
+
+        with self._lock:
+            self._sessions[session_id] = (time.monotonic() + self.ttl, remaining)
+            self._sessions.move_to_end(session_id)
+
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+    def pop(self, session_id):
+        ''' Returns the next question id of a session, None when all were played,
+        or MISSING if there is no such session. '''
+
+        with self._lock:
+            session = self._sessions.get(session_id)
+
+            if session is None:
+                return MISSING
+
+            expires, remaining = session
+
+            if expires < time.monotonic():
+                del self._sessions[session_id]
+                return MISSING
+
+            # Using a session keeps it alive
+            self._sessions[session_id] = (time.monotonic() + self.ttl, remaining)
+            self._sessions.move_to_end(session_id)
+
+            return remaining.pop() if remaining else None
+
+    def delete(self, session_id):
+        ''' Ends a session. Returns False if there was no such session. '''
+
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
+
+class RedisSessionStore:
+    ''' Quiz sessions kept in Redis (or anything speaking the same commands),
+    so they are shared between workers. Each session is a list of question ids
+    plus a marker key, both expiring after ttl seconds without use. '''
+
+    def __init__(self, client, ttl=SESSION_TTL, prefix='trivia:quiz:'):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def _keys(self, session_id):
+        return self.prefix + session_id, self.prefix + session_id + ':ids'
+
+    def create(self, session_id, question_ids):
+        ''' Stores the (already shuffled) question ids of a new session. '''
+
+        marker_key, ids_key = self._keys(session_id)
+
+        self.client.set(marker_key, 1, ex=self.ttl)
+
+        # Pushed in batches to keep each command a reasonable size
+        for start in range(0, len(question_ids), REDIS_PUSH_BATCH):
+            self.client.rpush(ids_key, *question_ids[start:start+REDIS_PUSH_BATCH])
+
+        self.client.expire(ids_key, self.ttl)
+
+    def pop(self, session_id):
+        ''' Returns the next question id of a session, None when all were played,
+        or MISSING if there is no such session. '''
+
+        marker_key, ids_key = self._keys(session_id)
+
+        if not self.client.exists(marker_key):
+            return MISSING
+
+        # Using a session keeps it alive
+        self.client.expire(marker_key, self.ttl)
+        self.client.expire(ids_key, self.ttl)
+
+        question_id = self.client.lpop(ids_key)
+
+        return int(question_id) if question_id is not None else None
+
+    def delete(self, session_id):
+        ''' Ends a session. Returns False if there was no such session. '''
+
+        return self.client.delete(*self._keys(session_id)) > 0
+
+
+def create_session_store(config):
+    ''' Helper function: Returns the session store for the app config.
+    QUIZ_SESSION_STORE can hold a ready made store (e.g. for tests),
+    otherwise QUIZ_SESSION_REDIS_URL selects Redis (needs the optional
+    redis package) and the in-process store is the default. '''
+
+    if config.get('QUIZ_SESSION_STORE') is not None:
+        return config['QUIZ_SESSION_STORE']
+
+    ttl = config.get('QUIZ_SESSION_TTL', SESSION_TTL)
+    redis_url = config.get('QUIZ_SESSION_REDIS_URL')
+
+    if not redis_url:
+        return MemorySessionStore(ttl=ttl)
+
+    try:
+        import redis
+    except ImportError:
+        raise RuntimeError('The redis package is required for QUIZ_SESSION_REDIS_URL')
+
+    return RedisSessionStore(redis.Redis.from_url(redis_url), ttl=ttl)
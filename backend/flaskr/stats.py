@@ -0,0 +1,156 @@
+import threading
+import time
+from collections import Counter
+from sqlalchemy import func, true
+
+from models import db, Question, table_generations, change_listeners
+
+STATS_MAX_AGE = 60
+
+
+class QuestionStats:
+    ''' Question counts per (category, difficulty), kept in this process.
+
+    Loaded with one GROUP BY query, then kept up to date with the questions
+    inserted and deleted through the ORM (see models.change_listeners), so
+    reads are O(1) and never count rows. Updated questions, whose old values
+    are unknown, and writes that bypass the ORM (bulk imports) bump the table
+    generation without an incremental update, and the counts are loaded again.
+    Writes from other processes are not seen here, so the counts are also
+    loaded again once they are max_age seconds old. '''
+
+    def __init__(self, max_age=STATS_MAX_AGE):
+        self.max_age = max_age
+        self._lock = threading.RLock()
+        self._generation = None
+        self._loaded_at = None
+        self._counts = Counter()
+        self._category_totals = Counter()
+        self._total = 0
+        change_listeners.add(self)
+
+    def rebuild(self):
+        ''' Loads the counts from the db. '''
+
+        with self._lock:
+            generation = table_generations['questions']
+            self._counts = Counter()
+            self._category_totals = Counter()
+            self._total = 0
+
+            rows = db.session.query(Question.category, Question.difficulty, func.count()) \
+                .group_by(Question.category, Question.difficulty)
+
+            for category_id, difficulty, count in rows:
+                self._add(category_id, difficulty, count)
+
+            self._generation = generation
+            self._loaded_at = time.monotonic()
+
+    def _stale(self):
+        return (self._generation != table_generations['questions']
+                or time.monotonic() - self._loaded_at > self.max_age)
+
+    def _ensure_fresh(self):
+        if self._stale():
+            with self._lock:
+                if self._stale():
+                    self.rebuild()
+
+    def _add(self, category_id, difficulty, count):
+        self._counts[(category_id, difficulty)] += count
+        self._category_totals[category_id] += count
+        self._total += count
+
+    def apply_changes(self, changes, generations):
+        ''' Updates the counts with questions committed through the ORM.
+        Counts are not idempotent, so changes the last load already saw
+        (a read may load them between the generation bump and this call)
+        are skipped, and a gap in the generations means a reload. '''
+
+        generation = generations.get(Question.__tablename__)
+
+        with self._lock:
+            # Not loaded yet, the first read will load everything anyway
+            if self._generation is None or generation is None:
+                return
+
+            if self._generation >= generation:
+                return
+
+            if self._generation != generation - 1:
+                # Another write is not counted yet, load again
+                self._generation = None
+                return
+
+            for tablename, operation, row in changes:
+                if tablename != Question.__tablename__:
+                    continue
+
+                if operation == 'inserted':
+                    self._add(row['category'], row['difficulty'], 1)
+                elif operation == 'deleted':
+                    self._add(row['category'], row['difficulty'], -1)
+                else:
+                    # Its old category and difficulty are gone, load again
+                    self._generation = None
+                    return
+
+            self._generation = generation
+
+    def _checked(self, total, at_least, condition):
+        # Other processes may have written since the counts were loaded
+        if total > 0 and total >= at_least:
+            return total
+
+        counted = db.session.query(func.count(Question.id)).filter(condition).scalar()
+
+        if counted != total:
+            # Load the counts again on the next read
+            self._generation = None
+
+        return counted
+
+    def total(self, at_least=0):
+        ''' Returns the number of questions. When the counts say there are
+        none, or fewer than at_least (e.g. the rows of the page read), the
+        questions are counted in the db instead. '''
+
+        self._ensure_fresh()
+        return self._checked(self._total, at_least, true())
+
+    def category_total(self, category_id, at_least=0):
+        ''' Returns the number of questions in a category, counted in the db
+        like total() when the counts look stale. '''
+
+        self._ensure_fresh()
+        return self._checked(self._category_totals.get(category_id, 0), at_least,
+                             Question.category == category_id)
+
+    def summary(self):
+        ''' Returns the overall, per category and per difficulty counts.
+        Categories map to their total and their counts per difficulty. '''
+
+        self._ensure_fresh()
+
+        with self._lock:
+            categories = {}
+            difficulties = Counter()
+
+            for (category_id, difficulty), count in self._counts.items():
+                # Questions without a category or difficulty only count in the total
+                if count <= 0:
+                    continue
+
+                if category_id is not None:
+                    category = categories.setdefault(
+                        category_id, {'total_questions': 0, 'difficulties': {}})
+                    category['total_questions'] += count
+                    if difficulty is not None:
+                        category['difficulties'][difficulty] = count
+
+                if difficulty is not None:
+                    difficulties[difficulty] += count
+
+            return {'total_questions': self._total, 'categories': categories,
+                    'difficulties': dict(difficulties)}
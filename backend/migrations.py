@@ -0,0 +1,108 @@
+from sqlalchemy import text
+
+from models import db
+
+'''
+Schema migrations
+    applied in order by upgrade() (flask db-upgrade), after creating the tables
+    missing from the database. The version reached is kept in the
+    schema_migrations table. Each migration gets a connection inside a
+    transaction and must be safe to run on a database that already has the change
+    (e.g. one restored from trivia.psql or created by db.create_all()).
+'''
+
+
+def _0001_category_integer_fk_and_indexes(connection):
+    ''' questions.category: text -> integer FK to categories,
+    plus indexes on (category, id) and difficulty. '''
+
+    if connection.dialect.name == 'postgresql':
+        data_type = connection.execute(text(
+            "SELECT data_type FROM information_schema.columns "
+            "WHERE table_name = 'questions' AND column_name = 'category'")).scalar()
+
+        if data_type != 'integer':
+            connection.execute(text(
+                "UPDATE questions SET category = NULL WHERE category !~ '^[0-9]+$'"))
+            connection.execute(text(
+                "ALTER TABLE questions ALTER COLUMN category TYPE integer "
+                "USING category::integer"))
+
+        # Questions of categories that no longer exist lose their category
+        connection.execute(text(
+            "UPDATE questions SET category = NULL WHERE category IS NOT NULL "
+            "AND category NOT IN (SELECT id FROM categories)"))
+
+        has_foreign_key = connection.execute(text(
+            "SELECT 1 FROM pg_constraint "
+            "WHERE conrelid = 'questions'::regclass AND contype = 'f'")).scalar()
+
+        if not has_foreign_key:
+            connection.execute(text(
+                "ALTER TABLE questions ADD CONSTRAINT questions_category_fkey "
+                "FOREIGN KEY (category) REFERENCES categories (id) "
+                "ON UPDATE CASCADE ON DELETE SET NULL"))
+
+    else:
+        # SQLite cannot change a column type, but stores what it is given:
+        # turn the text categories into integers
+        connection.execute(text(
+            "UPDATE questions SET category = CAST(category AS INTEGER) "
+            "WHERE typeof(category) = 'text'"))
+
+    connection.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_questions_category_id ON questions (category, id)"))
+    connection.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_questions_difficulty ON questions (difficulty)"))
+
+
+def _0002_full_text_search_indexes(connection):
+    ''' GIN indexes of the full text search on questions (PostgreSQL only). '''
+
+    if connection.dialect.name != 'postgresql':
+        return
+
+    # The indexed expressions must match the queries of the search engine
+    from flaskr.search import create_search_indexes
+
+    create_search_indexes(connection)
+
+
+MIGRATIONS = [
+    (1, _0001_category_integer_fk_and_indexes),
+    (2, _0002_full_text_search_indexes),
+]
+
+
+def current_version(connection):
+    ''' Returns the last migration applied to the database (0 for none). '''
+
+    connection.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_migrations (version INTEGER PRIMARY KEY)"))
+
+    return connection.execute(text(
+        "SELECT MAX(version) FROM schema_migrations")).scalar() or 0
+
+
+def upgrade(engine=None):
+    ''' Creates the missing tables, then applies the pending migrations,
+    each in its own transaction. Returns the versions applied. '''
+
+    engine = engine or db.engine
+    applied = []
+
+    db.metadata.create_all(engine)
+
+    for version, migration in MIGRATIONS:
+        with engine.begin() as connection:
+            if version <= current_version(connection):
+                continue
+
+            migration(connection)
+            connection.execute(text(
+                "INSERT INTO schema_migrations (version) VALUES (:version)"),
+                version=version)
+
+        applied.append((version, ' '.join(migration.__doc__.split())))
+
+    return applied
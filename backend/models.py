@@ -1,26 +1,317 @@
 import os
-from sqlalchemy import Column, String, Integer, create_engine
-from flask_sqlalchemy import SQLAlchemy
+import itertools
+import threading
+import time
+import weakref
+from collections import defaultdict
+from sqlalchemy import Column, String, Integer, ForeignKey, Index, create_engine, event, text
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.sql.expression import Select, CompoundSelect
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
 import json
 
 database_name = "trivia"
-database_path = "postgres://{}@{}/{}".format(
+local_database_path = "postgres://{}@{}/{}".format(
     'postgres', 'localhost:5432', database_name)
+database_path = os.environ.get("DATABASE_URL", local_database_path)
+
+
+class RoutingSession(SignallingSession):
+    ''' A session sending the SELECTs of read only requests to a replica
+    (see ReplicaRouter), and everything else to the primary. Once the
+    session wrote, or flushes, it stays on the primary so the request
+    reads its own writes. '''
+
+    def get_bind(self, mapper=None, clause=None):
+        replicas = self.app.extensions.get('db_replicas')
+
+        if replicas is None or not self.info.get('read_only'):
+            return super().get_bind(mapper, clause)
+
+        # Anything but a SELECT (a flush, DML, raw SQL, a bare connection) may write
+        if self._flushing or not isinstance(clause, (Select, CompoundSelect)):
+            self.info['wrote'] = True
+
+        if self.info.get('wrote'):
+            return super().get_bind(mapper, clause)
+
+        # One replica for the whole request, for consistent reads
+        if 'replica' not in self.info:
+            self.info['replica'] = replicas.replica()
+
+        return self.info['replica'] or super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        return sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+db = RoutingSQLAlchemy()
+
+'''
+Connection pool settings
+    read from the app config, or else from environment variables of the same name.
+    They only apply to server databases; SQLite keeps SQLAlchemy's defaults.
+
+    DB_POOL_SIZE           connections kept open per worker
+    DB_MAX_OVERFLOW        extra connections allowed under load
+    DB_POOL_TIMEOUT        seconds to wait for a free connection
+    DB_POOL_RECYCLE        seconds after which a connection is replaced
+    DB_POOL_PRE_PING       test connections before use (on by default)
+    DB_STATEMENT_TIMEOUT   milliseconds before PostgreSQL cancels a statement
+'''
+
+POOL_SETTINGS = (
+    ('DB_POOL_SIZE', 'pool_size', int),
+    ('DB_MAX_OVERFLOW', 'max_overflow', int),
+    ('DB_POOL_TIMEOUT', 'pool_timeout', int),
+    ('DB_POOL_RECYCLE', 'pool_recycle', int),
+)
+
+
+def _setting(config, key):
+    value = config.get(key)
+    return value if value is not None else os.environ.get(key)
+
+
+def engine_options(config, database_path):
+    ''' Returns the SQLAlchemy create_engine options for the pool settings. '''
+
+    if database_path.startswith('sqlite'):
+        return {}
+
+    options = {}
+
+    for key, option, convert in POOL_SETTINGS:
+        value = _setting(config, key)
+        if value is not None:
+            options[option] = convert(value)
+
+    pre_ping = _setting(config, 'DB_POOL_PRE_PING')
+    options['pool_pre_ping'] = str(pre_ping).lower() not in ('0', 'false', 'no') \
+        if pre_ping is not None else True
+
+    statement_timeout = _setting(config, 'DB_STATEMENT_TIMEOUT')
+    if statement_timeout is not None and database_path.startswith('postgres'):
+        options['connect_args'] = {
+            'options': '-c statement_timeout={}'.format(int(statement_timeout))}
+
+    return options
 
-db = SQLAlchemy()
 
 '''
 setup_db(app)
-    binds a flask application and a SQLAlchemy service
+    binds a flask application and a SQLAlchemy service.
+    Without database_path, SQLALCHEMY_DATABASE_URI from the app config is used,
+    then the DATABASE_URL environment variable, then the local trivia database.
+    It does not connect: the tables are created by flask db-upgrade (see
+    migrations.py), or with create_tables for throwaway databases.
 '''
 
 
-def setup_db(app, database_path=database_path):
+def setup_db(app, database_path=None, create_tables=False):
+    if database_path is None:
+        database_path = app.config.get("SQLALCHEMY_DATABASE_URI") or \
+            os.environ.get("DATABASE_URL", local_database_path)
+
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(app.config, database_path)
     db.app = app
     db.init_app(app)
-    db.create_all()
+
+    if create_tables:
+        db.create_all()
+
+    replica_paths = _setting(app.config, 'DATABASE_REPLICA_URLS')
+    if isinstance(replica_paths, str):
+        replica_paths = [path.strip() for path in replica_paths.split(',') if path.strip()]
+
+    if replica_paths:
+        check_interval = _setting(app.config, 'DB_REPLICA_CHECK_INTERVAL')
+        sticky_seconds = _setting(app.config, 'DB_REPLICA_STICKY_SECONDS')
+
+        app.extensions['db_replicas'] = ReplicaRouter(
+            [create_engine(path, **engine_options(app.config, path)) for path in replica_paths],
+            check_interval=float(check_interval if check_interval is not None
+                                 else REPLICA_CHECK_INTERVAL),
+            sticky_seconds=float(sticky_seconds if sticky_seconds is not None
+                                 else REPLICA_STICKY_SECONDS))
+    else:
+        app.extensions.pop('db_replicas', None)
+
+
+'''
+Read replicas
+    set DATABASE_REPLICA_URLS (app config or environment, a list or comma
+    separated) to send the reads of read only requests to replicas.
+    Requests opt in with use_replicas(); the app does it for GET requests
+    and the read only POSTs (search, quiz).
+
+    DB_REPLICA_CHECK_INTERVAL   seconds between health checks of a replica
+    DB_REPLICA_STICKY_SECONDS   after a write in this process, reads stay on
+                                the primary this long, while replicas catch up
+'''
+
+REPLICA_CHECK_INTERVAL = 10
+REPLICA_STICKY_SECONDS = 2
+
+
+class ReplicaRouter:
+    ''' Hands out replica engines in turn, skipping the unhealthy ones.
+
+    A replica is healthy if a SELECT 1 worked within check_interval seconds
+    (it is checked again when a request needs it after that) and no
+    connection to it has failed since. When none is healthy, or this process
+    wrote less than sticky_seconds ago, replica() returns None and the
+    primary serves the reads. '''
+
+    def __init__(self, engines, check_interval=REPLICA_CHECK_INTERVAL,
+                 sticky_seconds=REPLICA_STICKY_SECONDS):
+        self.engines = engines
+        self.check_interval = check_interval
+        self.sticky_seconds = sticky_seconds
+        self.last_write = None
+        self._turns = itertools.count()
+        self._health = {}
+        self._lock = threading.Lock()
+
+        for engine in engines:
+            event.listen(engine, 'handle_error', self._connection_failed)
+
+        generation_listeners.add(self)
+
+    def generation_bumped(self, tablename):
+        self.last_write = time.monotonic()
+
+    def _connection_failed(self, context):
+        if context.is_disconnect or context.connection is None:
+            self._health[context.engine] = (time.monotonic(), False)
+
+    def check(self, engine):
+        ''' Runs SELECT 1 on the replica, records and returns whether it worked. '''
+
+        try:
+            with engine.connect() as connection:
+                connection.execute(text('SELECT 1'))
+            healthy = True
+        except Exception:
+            healthy = False
+
+        self._health[engine] = (time.monotonic(), healthy)
+
+        return healthy
+
+    def healthy(self, engine):
+        ''' Whether the replica is healthy, checking it if it is due. '''
+
+        checked_at, healthy = self._health.get(engine, (None, False))
+
+        if checked_at is None or time.monotonic() - checked_at >= self.check_interval:
+            return self.check(engine)
+
+        return healthy
+
+    def replica(self):
+        ''' Returns the next healthy replica engine, or None for the primary. '''
+
+        if (self.last_write is not None
+                and time.monotonic() - self.last_write < self.sticky_seconds):
+            return None
+
+        for _ in range(len(self.engines)):
+            with self._lock:
+                engine = self.engines[next(self._turns) % len(self.engines)]
+
+            if self.healthy(engine):
+                return engine
+
+        return None
+
+    def status(self):
+        ''' Returns the health of every replica, by URL without the password. '''
+
+        return [{'url': repr(engine.url), 'healthy': self._health.get(engine, (None, None))[1]}
+                for engine in self.engines]
+
+
+def use_replicas():
+    ''' Lets the current session read from the replicas, if there are any.
+    Call it at the start of a request that only reads. '''
+
+    db.session.info['read_only'] = True
+
+
+'''
+Table generations
+    a counter per table, bumped after every commit that wrote to it
+    through the ORM. Caches remember the generation they were filled at
+    to tell when they are stale. table_modified holds the time (time.time())
+    of the last bump, or of the process start for tables not written since.
+
+Change listeners
+    objects with an apply_changes(changes, generations) method, called after
+    such a commit with the list of (tablename, 'inserted'|'updated'|'deleted',
+    row) changes, in order, and the generations the commit bumped the tables
+    to. row is the format() of the object when it was flushed.
+    Listeners are held weakly so they go away with their app.
+
+Generation listeners
+    objects with a generation_bumped(tablename) method, called every time
+    a table generation is bumped, e.g. to share it with other workers.
+'''
+
+table_generations = defaultdict(int)
+_process_started = time.time()
+table_modified = defaultdict(lambda: _process_started)
+_generations_lock = threading.Lock()
+
+change_listeners = weakref.WeakSet()
+generation_listeners = weakref.WeakSet()
+
+
+def bump_generation(tablename):
+    ''' Marks a table as changed. Call it after writes that bypass the ORM.
+    Returns the new generation. '''
+
+    with _generations_lock:
+        table_generations[tablename] += 1
+        table_modified[tablename] = time.time()
+        generation = table_generations[tablename]
+
+    for listener in list(generation_listeners):
+        listener.generation_bumped(tablename)
+
+    return generation
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_changes(session, flush_context):
+    changes = session.info.setdefault('changes', [])
+
+    for operation, instances in (('inserted', session.new),
+                                 ('updated', session.dirty),
+                                 ('deleted', session.deleted)):
+        for instance in instances:
+            changes.append((instance.__tablename__, operation, instance.format()))
+
+
+@event.listens_for(Session, 'after_commit')
+def _publish_changes(session):
+    changes = session.info.pop('changes', [])
+
+    generations = {tablename: bump_generation(tablename)
+                   for tablename in set(change[0] for change in changes)}
+
+    if changes:
+        for listener in list(change_listeners):
+            listener.apply_changes(changes, generations)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_changes(session):
+    session.info.pop('changes', None)
 
 
 '''
@@ -31,11 +322,17 @@ Question
 
 class Question(db.Model):
     __tablename__ = 'questions'
+    __table_args__ = (
+        # Category pages and quiz draws filter on category and order by id
+        Index('ix_questions_category_id', 'category', 'id'),
+        Index('ix_questions_difficulty', 'difficulty'),
+    )
 
     id = Column(Integer, primary_key=True)
     question = Column(String)
     answer = Column(String)
-    category = Column(String)
+    category = Column(Integer, ForeignKey('categories.id', onupdate='CASCADE',
+                                          ondelete='SET NULL'))
     difficulty = Column(Integer)
 
     def __init__(self, question, answer, category, difficulty):
@@ -1,35 +1,161 @@
 import os
+import gzip
+import shutil
+import tempfile
+import time
 import unittest
+from unittest import mock
 import json
-from flask_sqlalchemy import SQLAlchemy
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from importlib.util import find_spec
+from flask import jsonify
+from werkzeug.http import http_date
+from sqlalchemy import event, create_engine
 
 from flaskr import create_app
-from models import setup_db, Question, Category
+from flaskr.pagination import MAX_QUESTIONS_PER_PAGE
+from flaskr.sessions import RedisSessionStore
+from flaskr.cache import CategoryCache, MemoryResponseStore, RedisResponseStore
+from flaskr.serialization import SERIALIZERS
+from flaskr.asgi import create_asgi_app
+from flaskr.search import InvertedIndexSearchEngine
+from flaskr.stats import QuestionStats
+from flaskr.ratelimit import MemoryRateLimitBackend
+from flaskr.adaptive import DifficultyIndex, next_difficulty
+from flaskr.packs import PackScheduler, today
+from models import setup_db, db, engine_options, use_replicas, Question, Category
+from migrations import upgrade
+
+
+class FakeRedis:
+    """In-memory stand-in for the few Redis commands the app uses"""
+
+    def __init__(self):
+        self.data = {}
+        self.expires = {}
+
+    def _alive(self, key):
+        if key in self.expires and self.expires[key] < time.monotonic():
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+        return key in self.data
+
+    def set(self, key, value, ex=None):
+        self.data[key] = value if isinstance(value, bytes) else str(value).encode()
+        if ex is not None:
+            self.expires[key] = time.monotonic() + ex
+
+    def get(self, key):
+        return self.data[key] if self._alive(key) else None
+
+    def incr(self, key):
+        value = int(self.get(key) or 0) + 1
+        self.data[key] = str(value).encode()
+        return value
+
+    def exists(self, key):
+        return int(self._alive(key))
+
+    def expire(self, key, seconds):
+        if not self._alive(key):
+            return False
+        self.expires[key] = time.monotonic() + seconds
+        return True
+
+    def rpush(self, key, *values):
+        self._alive(key)
+        self.data.setdefault(key, []).extend(str(value).encode() for value in values)
+        return len(self.data[key])
+
+    def lpop(self, key):
+        if not self._alive(key):
+            return None
+        value = self.data[key].pop(0)
+        # Like Redis, an empty list is removed
+        if not self.data[key]:
+            self.delete(key)
+        return value
+
+    def delete(self, *keys):
+        deleted = 0
+        for key in keys:
+            deleted += int(self._alive(key))
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+        return deleted
+
+
+async def asgi_request(app, method, path, body=None):
+    """Sends one request to an ASGI app, returns (status, data)"""
+    body = json.dumps(body).encode() if body is not None else b''
+    messages = [{'type': 'http.request', 'body': body}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0) if messages else {'type': 'http.disconnect'}
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+             'method': method, 'scheme': 'http', 'path': path, 'raw_path': path.encode(),
+             'query_string': b'', 'root_path': '',
+             'headers': [(b'content-type', b'application/json'),
+                         (b'content-length', str(len(body)).encode())],
+             'client': ('127.0.0.1', 1), 'server': ('localhost', 80)}
+    await app(scope, receive, send)
+
+    body = b''.join(message.get('body', b'') for message in sent
+                    if message['type'] == 'http.response.body')
+    return sent[0]['status'], json.loads(body)
 
 
 class TriviaTestCase(unittest.TestCase):
     """This class represents the trivia test case"""
 
+    # The app of the tests that do not configure their own, created once
+    # (TRIVIA_TEST_FRESH_APP=1 creates one per test instead)
+    cached_app = None
+
     def setUp(self):
         """Define test variables and initialize app."""
-        self.app = create_app()
-        self.client = self.app.test_client
         self.database_name = "trivia_test"
         self.database_path = "postgres://{}@{}/{}".format(
             'postgres', 'localhost:5432', self.database_name)
-        setup_db(self.app, self.database_path)
 
-        # binds the app to the current context
-        with self.app.app_context():
-            self.db = SQLAlchemy()
-            self.db.init_app(self.app)
+        if TriviaTestCase.cached_app is None or os.environ.get('TRIVIA_TEST_FRESH_APP'):
+            app = create_app()
             # create all tables
-            self.db.create_all()
+            setup_db(app, self.database_path, create_tables=True)
+            TriviaTestCase.cached_app = app
+
+        self.app = TriviaTestCase.cached_app
+        self.client = self.app.test_client
 
     def tearDown(self):
         """Executed after reach test"""
         pass
 
+    def count_queries(self, function, app=None):
+        """Returns the number of SQL statements run by function()"""
+        app = app or self.app
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        with app.app_context():
+            engine = db.get_engine(app)
+            event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+            try:
+                function()
+            finally:
+                event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+        return len(statements)
+
     # -----------------------------------------------------------------------------------------------------------
 
     def test_get_request_all_categories(self):
@@ -56,6 +182,441 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], False)
         self.assertTrue(len(data))
 
+    def test_get_request_all_categories_304(self):
+        res = self.client().get('/categories')
+        etag = res.headers['ETag']
+
+        res = self.client().get('/categories', headers={'If-None-Match': etag})
+
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.headers['ETag'], etag)
+        self.assertEqual(res.data, b'')
+
+    def test_get_request_all_categories_warm_cache(self):
+        # Called directly, GET /categories is answered by the response cache first
+        category_cache = CategoryCache()
+
+        with self.app.app_context():
+            categories = category_cache.get()
+
+        queries = self.count_queries(lambda: self.assertEqual(category_cache.get(), categories))
+
+        self.assertEqual(queries, 0)
+        self.assertEqual(category_cache.stats(), {'hits': 1, 'misses': 1})
+
+    def test_health(self):
+        res = self.client().get('/health')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertTrue(data['db_ping_ms'] >= 0)
+        self.assertIn('checkedout', data['pool'])
+
+    def test_db_timing_headers(self):
+        res = self.client().get('/questions')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(int(res.headers['X-DB-Query-Count']) > 0)
+        self.assertTrue(res.headers['Server-Timing'].startswith('db;dur='))
+        self.assertIn('app;dur=', res.headers['Server-Timing'])
+
+    def test_metrics(self):
+        # Counters start at 0 in a new app
+        client = create_app({'SQLALCHEMY_DATABASE_URI': self.database_path}).test_client
+        client().get('/questions')
+
+        res = client().get('/metrics')
+        text = res.data.decode()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('trivia_http_request_duration_seconds_count{method="GET",route="/questions"} 1',
+                      text)
+        self.assertIn('trivia_http_requests_total{method="GET",route="/questions",status="200"} 1',
+                      text)
+        self.assertIn('trivia_db_queries_total{method="GET",route="/questions"}', text)
+
+    def test_slow_query_log(self):
+        app = create_app({'SQLALCHEMY_DATABASE_URI': self.database_path, 'SLOW_QUERY_MS': 0})
+
+        with self.assertLogs('flaskr.sql', 'WARNING') as logs:
+            res = app.test_client().get('/categories/1/questions')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('Slow query', logs.output[0])
+        self.assertIn('Parameters', logs.output[0])
+        self.assertIn('Plan:', logs.output[0])
+
+    def test_profile(self):
+        app = create_app({'SQLALCHEMY_DATABASE_URI': self.database_path,
+                          'PROFILING_ENABLED': True})
+
+        res = app.test_client().get('/questions?profile=1')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, 'text/plain')
+        self.assertIn('function calls', res.data.decode())
+
+        # Ignored unless enabled
+        res = self.client().get('/questions?profile=1')
+        self.assertEqual(json.loads(res.data)['success'], True)
+
+    def test_json_serializers(self):
+        result = {'categories': {1: 'Science', 2: 'Art'}, 'success': True,
+                  'questions': [{'id': 1, 'question': 'Café?', 'category': 1}]}
+
+        with self.app.app_context():
+            expected = json.loads(jsonify(result).data)
+
+        for dumps in SERIALIZERS.values():
+            self.assertEqual(json.loads(dumps(result)), expected)
+
+    def make_replica(self, question):
+        """Returns the URI of a new SQLite replica holding a single question"""
+        handle, filename = tempfile.mkstemp(suffix='.db', prefix='trivia_replica_')
+        os.close(handle)
+        self.addCleanup(os.remove, filename)
+
+        engine = create_engine('sqlite:///' + filename)
+        db.metadata.create_all(engine)
+        engine.execute(Category.__table__.insert(), [{'id': 1, 'type': 'Science'}])
+        engine.execute(Question.__table__.insert(), [
+            {'question': question, 'answer': 'replica', 'category': 1, 'difficulty': 1}])
+        engine.dispose()
+
+        return 'sqlite:///' + filename
+
+    def create_replicated_app(self, replicas):
+        app = create_app({'DATABASE_REPLICA_URLS': replicas, 'DB_REPLICA_STICKY_SECONDS': 0})
+        setup_db(app, self.database_path)
+        return app
+
+    def exported_questions(self, client):
+        return [json.loads(line)['question']
+                for line in client.get('/questions/export').data.splitlines()]
+
+    def test_read_replicas(self):
+        app = self.create_replicated_app([self.make_replica('From A'), self.make_replica('From B')])
+        client = app.test_client()
+
+        # Round robin between the replicas, one per request
+        self.assertEqual(sorted(self.exported_questions(client) + self.exported_questions(client)),
+                         ['From A', 'From B'])
+
+        with app.app_context():
+            primary_total = Question.query.count()
+
+            use_replicas()
+            self.assertEqual(Question.query.count(), 1)
+
+            # Reads its own writes from then on
+            question = Question(question='Primary?', answer='Yes', category=1, difficulty=1)
+            question.insert()
+            self.assertEqual(Question.query.count(), primary_total + 1)
+            question.delete()
+
+        # Writes keep the reads on the primary for a while
+        app.extensions['db_replicas'].sticky_seconds = 60
+        with app.app_context():
+            question = Question(question='Sticky?', answer='Yes', category=1, difficulty=1)
+            question.insert()
+            question.delete()
+        self.assertEqual(len(self.exported_questions(client)), primary_total)
+
+    def test_read_replica_failover(self):
+        broken = 'sqlite:////nonexistent/trivia_replica.db'
+        app = self.create_replicated_app([broken, self.make_replica('From A')])
+        client = app.test_client()
+
+        self.assertEqual(self.exported_questions(client), ['From A'])
+        self.assertEqual(self.exported_questions(client), ['From A'])
+
+        replicas = json.loads(client.get('/health').data)['replicas']
+        self.assertEqual([replica['healthy'] for replica in replicas], [False, True])
+
+        # No healthy replica left, the primary takes the reads
+        app = self.create_replicated_app([broken])
+        self.assertTrue(len(self.exported_questions(app.test_client())) > 1)
+
+    def test_engine_options(self):
+        options = engine_options({'DB_POOL_SIZE': '3', 'DB_POOL_PRE_PING': 'false',
+                                  'DB_STATEMENT_TIMEOUT': 5000}, self.database_path)
+
+        self.assertEqual(options['pool_size'], 3)
+        self.assertEqual(options['pool_pre_ping'], False)
+        self.assertEqual(options['connect_args'],
+                         {'options': '-c statement_timeout=5000'})
+        self.assertEqual(engine_options({'DB_POOL_SIZE': 3}, 'sqlite://'), {})
+
+    def test_get_cache_stats(self):
+        # Counters start at 0 in a new app
+        client = create_app({'SQLALCHEMY_DATABASE_URI': self.database_path}).test_client
+
+        client().get('/categories')
+        client().get('/questions')
+        client().get('/categories')
+
+        res = client().get('/cache/stats')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['categories']['misses'], 1)
+        self.assertEqual(data['categories']['hits'], 1)
+        self.assertEqual(data['responses']['misses'], 2)
+        self.assertEqual(data['responses']['hits'], 1)
+        self.assertEqual(data['responses']['entries'], 2)
+
+    def test_response_cache(self):
+        client = self.client()
+        res = client.get('/questions?page=1&per_page=5')
+
+        # Same args in another order, served without the db
+        queries = self.count_queries(
+            lambda: self.assertEqual(client.get('/questions?per_page=5&page=1').data, res.data))
+        self.assertEqual(queries, 0)
+
+        res = client.get('/questions?page=1&per_page=5',
+                         headers={'If-None-Match': res.headers['ETag']})
+
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.data, b'')
+
+    def test_response_cache_follows_inserts_and_deletes(self):
+        client = self.client()
+        total = json.loads(client.get('/questions').data)['total_questions']
+
+        with self.app.app_context():
+            question = Question(question='Cached?', answer='No', category=1, difficulty=1)
+            question.insert()
+
+            data = json.loads(client.get('/questions').data)
+            self.assertEqual(data['total_questions'], total + 1)
+
+            question.delete()
+
+            data = json.loads(client.get('/questions').data)
+            self.assertEqual(data['total_questions'], total)
+
+    def test_response_cache_evicts_least_recently_used(self):
+        store = MemoryResponseStore(max_bytes=1000)
+
+        for key in ('a', 'b', 'c'):
+            store.set(key, 'etag-' + key, b'x' * 250)
+
+        self.assertEqual(store.stats()['evictions'], 1)
+        self.assertEqual(store.get('a'), None)
+        self.assertEqual(store.get('c'), ('etag-c', b'x' * 250))
+        self.assertTrue(store.stats()['bytes'] <= 1000)
+
+    def test_response_cache_redis_store(self):
+        redis = FakeRedis()
+        clients = []
+        for _ in range(2):
+            app = create_app({'RESPONSE_CACHE_STORE': RedisResponseStore(redis)})
+            setup_db(app, self.database_path)
+            clients.append(app.test_client())
+
+        res = clients[0].get('/questions')
+
+        # The other worker gets it from the shared store
+        queries = self.count_queries(
+            lambda: self.assertEqual(clients[1].get('/questions').data, res.data), app)
+        self.assertEqual(queries, 0)
+
+    def test_response_cache_304_without_db(self):
+        store = MemoryResponseStore()
+        app = create_app({'RESPONSE_CACHE_STORE': store})
+        setup_db(app, self.database_path)
+        client = app.test_client()
+
+        res = client.get('/questions?per_page=5')
+        etag = res.headers['ETag']
+
+        # Answered from the cached entry alone
+        for headers in ({'If-None-Match': etag},
+                        {'If-Modified-Since': http_date(time.time() + 60)}):
+            queries = self.count_queries(lambda: self.assertEqual(
+                client.get('/questions?per_page=5', headers=headers).status_code, 304), app)
+            self.assertEqual(queries, 0)
+
+        res = client.get('/questions?per_page=5',
+                         headers={'If-Modified-Since': http_date(time.time() - 60)})
+        self.assertEqual(res.status_code, 200)
+
+        # A write this process did not see, like one of another worker
+        question = json.loads(res.data)['questions'][0]
+
+        def set_answer(answer):
+            with app.app_context():
+                db.engine.execute(Question.__table__.update().where(
+                    Question.id == question['id']).values(answer=answer))
+
+        set_answer(question['answer'] + '!')
+        self.addCleanup(set_answer, question['answer'])
+
+        # Still 304 while cached, the store ttl bounds it
+        res = client.get('/questions?per_page=5', headers={'If-None-Match': etag})
+        self.assertEqual(res.status_code, 304)
+
+        # Built again once expired, the body and so the ETag changed
+        store.clear()
+        res = client.get('/questions?per_page=5', headers={'If-None-Match': etag})
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res.headers['ETag'], etag)
+
+    def test_response_cache_304_shared_generations(self):
+        redis = FakeRedis()
+        app = create_app({'RESPONSE_CACHE_STORE': RedisResponseStore(redis)})
+        setup_db(app, self.database_path)
+        client = app.test_client()
+
+        etag = client.get('/questions?per_page=5').headers['ETag']
+        # Evicted, only the generations are left
+        redis.data = {key: value for key, value in redis.data.items() if 'generation:' in key}
+
+        # Answered from the shared generations alone, even once evicted
+        queries = self.count_queries(lambda: self.assertEqual(
+            client.get('/questions?per_page=5', headers={'If-None-Match': etag}).status_code,
+            304), app)
+        self.assertEqual(queries, 0)
+
+        with app.app_context():
+            question = Question(question='Modified?', answer='Yes', category=1, difficulty=1)
+            question.insert()
+            question.delete()
+
+        # Stale once any worker wrote to the table
+        res = client.get('/questions?per_page=5', headers={'If-None-Match': etag})
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res.headers['ETag'], etag)
+
+    def test_response_cache_coalesces_concurrent_requests(self):
+        store = MemoryResponseStore()
+        app = create_app({'RESPONSE_CACHE_STORE': store})
+        setup_db(app, self.database_path)
+        app.test_client().get('/questions?page=1')
+        store.clear()
+
+        requests = 8
+        barrier = threading.Barrier(requests)
+
+        def slow_query(*args):
+            # Keeps the first request in flight while the others arrive
+            time.sleep(0.3)
+
+        def get(_):
+            client = app.test_client()
+            barrier.wait()
+            return client.get('/questions?page=1')
+
+        def parallel_gets():
+            with ThreadPoolExecutor(requests) as executor:
+                return list(executor.map(get, range(requests)))
+
+        with app.app_context():
+            engine = db.get_engine(app)
+        event.listen(engine, 'before_cursor_execute', slow_query)
+        try:
+            responses = []
+            queries = self.count_queries(lambda: responses.extend(parallel_gets()), app)
+        finally:
+            event.remove(engine, 'before_cursor_execute', slow_query)
+
+        self.assertEqual(queries, 1)
+        self.assertEqual(set(res.status_code for res in responses), {200})
+        self.assertEqual(len(set(res.data for res in responses)), 1)
+
+        stats = json.loads(app.test_client().get('/cache/stats').data)['responses']
+        self.assertEqual(stats['coalesced'], requests - 1)
+
+    def test_rate_limit(self):
+        app = create_app({'RATE_LIMIT_PER_SECOND': 1, 'RATE_LIMIT_BURST': 2})
+        setup_db(app, self.database_path)
+        client = app.test_client()
+
+        self.assertEqual([client.get('/categories').status_code for _ in range(3)],
+                         [200, 200, 429])
+
+        res = client.get('/categories')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 429)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(res.headers['Retry-After'], '1')
+
+        # Per route, and never for the health check
+        self.assertEqual(client.get('/questions').status_code, 200)
+        self.assertEqual(client.get('/health').status_code, 200)
+
+    def test_memory_rate_limit_backend(self):
+        backend = MemoryRateLimitBackend(max_buckets=2)
+
+        with mock.patch('flaskr.ratelimit.time.monotonic', return_value=100.0) as clock:
+            self.assertEqual(backend.take('a', 2, 2), (True, 1))
+            self.assertEqual(backend.take('a', 2, 2), (True, 0))
+            self.assertEqual(backend.take('a', 2, 2), (False, 0))
+
+            # Refilled at 2 tokens a second, up to the burst
+            clock.return_value = 100.25
+            self.assertEqual(backend.take('a', 2, 2), (False, 0.5))
+            clock.return_value = 110.0
+            self.assertEqual(backend.take('a', 2, 2), (True, 1))
+
+            backend.take('b', 2, 2)
+            backend.take('c', 2, 2)
+            self.assertEqual(backend.take('a', 2, 2), (True, 1))
+
+    def test_response_compression(self):
+        client = self.client()
+        plain = client.get('/questions?per_page=20')
+
+        res = client.get('/questions?per_page=20', headers={'Accept-Encoding': 'gzip'})
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', res.headers['Vary'])
+        self.assertEqual(gzip.decompress(res.data), plain.data)
+        self.assertTrue(len(res.data) < len(plain.data))
+
+        # Strong ETags, one per representation
+        self.assertFalse(res.headers['ETag'].startswith('W/'))
+        self.assertEqual(res.headers['ETag'], plain.headers['ETag'][:-1] + '-gzip"')
+
+        for headers, etag in (({'Accept-Encoding': 'gzip'}, res.headers['ETag']),
+                              ({}, plain.headers['ETag'])):
+            revalidated = client.get('/questions?per_page=20',
+                                     headers=dict(headers, **{'If-None-Match': etag}))
+            self.assertEqual(revalidated.status_code, 304)
+            self.assertEqual(revalidated.headers['ETag'], etag)
+
+        # The plain ETag does not stand for the gzipped body
+        res = client.get('/questions?per_page=20', headers={'Accept-Encoding': 'identity',
+                                                            'If-None-Match': res.headers['ETag']})
+        self.assertEqual(res.status_code, 200)
+
+        # Too small to be worth it
+        res = client.get('/categories', headers={'Accept-Encoding': 'gzip'})
+        self.assertNotIn('Content-Encoding', res.headers)
+
+    @unittest.skipUnless(find_spec('brotli'), 'needs brotli')
+    def test_response_compression_brotli(self):
+        import brotli
+
+        res = self.client().get('/questions?per_page=20',
+                                headers={'Accept-Encoding': 'gzip, deflate, br'})
+
+        self.assertEqual(res.headers['Content-Encoding'], 'br')
+        self.assertEqual(json.loads(brotli.decompress(res.data))['success'], True)
+
+    def test_streamed_response_compression(self):
+        plain = self.client().get('/questions/export')
+        res = self.client().get('/questions/export', headers={'Accept-Encoding': 'gzip'})
+
+        self.assertEqual(res.headers['Content-Encoding'], 'gzip')
+        self.assertNotIn('Content-Length', res.headers)
+        self.assertEqual(gzip.decompress(res.data), plain.data)
+
     # -----------------------------------------------------------------------------------------------------------
 
     def test_get_request_pagination_questions(self):
@@ -75,13 +636,129 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(len(data))
 
     def test_post_request_pagination_questions_405(self):
-        res = self.client().patch('/questions')
+        res = self.client().put('/questions')
         data = json.loads(res.data)
 
         self.assertEqual(res.status_code, 405)
         self.assertEqual(data['success'], False)
         self.assertTrue(len(data))
 
+    def test_get_request_pagination_questions_per_page(self):
+        res = self.client().get('/questions?page=2&per_page=5')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(len(data['questions']), 5)
+        self.assertTrue(data['total_questions'] > 5)
+
+    def test_get_request_pagination_questions_max_per_page(self):
+        res = self.client().get(
+            '/questions?per_page={}'.format(MAX_QUESTIONS_PER_PAGE + 1))
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertTrue(len(data['questions']) <= MAX_QUESTIONS_PER_PAGE)
+
+    def test_get_request_pagination_questions_400(self):
+        res = self.client().get('/questions?page=0')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+        self.assertTrue(len(data))
+
+    def test_get_request_cursor_pagination_questions(self):
+        res = self.client().get('/questions?per_page=5&after=')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(data['questions']), 5)
+        self.assertTrue(data['next_cursor'])
+
+        res = self.client().get(
+            '/questions?per_page=5&after={}'.format(data['next_cursor']))
+        next_data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(next_data['success'], True)
+        self.assertTrue(next_data['questions'][0]['id'] > data['questions'][-1]['id'])
+
+    def test_get_request_cursor_pagination_questions_400(self):
+        res = self.client().get('/questions?after=not-a-cursor')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+        self.assertTrue(len(data))
+
+    def add_bulk_questions(self, term, count):
+        """Inserts count questions containing term in category 1, returns their ids"""
+        with self.app.app_context():
+            questions = [Question(question='{} {}?'.format(term, i), answer='answer',
+                                  category=1, difficulty=1) for i in range(count)]
+            db.session.add_all(questions)
+            db.session.commit()
+            return [question.id for question in questions]
+
+    def test_bulk_delete_questions(self):
+        ids = self.add_bulk_questions('bulkdelete', 3)
+        client = self.client()
+
+        res = client.delete('/questions', json={'searchTerm': 'bulkdelete', 'dry_run': True})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['matched'], 3)
+
+        total = json.loads(client.get('/stats').data)['total_questions']
+
+        # A single DELETE, however many questions match
+        queries = self.count_queries(lambda: self.assertEqual(json.loads(client.delete(
+            '/questions', json={'ids': ids[:2] + [100000], 'category': 1}).data)['deleted'], 2))
+        self.assertEqual(queries, 1)
+
+        # The caches saw it
+        self.assertEqual(json.loads(client.get('/stats').data)['total_questions'], total - 2)
+        with self.app.app_context():
+            self.assertEqual([question.id for question in Question.query.filter(
+                Question.question.like('bulkdelete%'))], ids[2:])
+
+    def test_bulk_update_questions(self):
+        ids = self.add_bulk_questions('bulkupdate', 3)
+        client = self.client()
+
+        res = client.patch('/questions?dry_run=1', json={
+            'ids': ids, 'changes': {'difficulty': 5}})
+        self.assertEqual(json.loads(res.data)['matched'], 3)
+
+        # The category check, then a single UPDATE
+        queries = self.count_queries(lambda: self.assertEqual(json.loads(client.patch(
+            '/questions', json={'searchTerm': 'bulkupdate', 'difficulty': 1,
+                                'changes': {'difficulty': 5, 'category': 2}}).data)['updated'], 3))
+        self.assertEqual(queries, 2)
+
+        with self.app.app_context():
+            self.assertEqual(set((question.category, question.difficulty) for question in
+                                 Question.query.filter(Question.id.in_(ids))), {(2, 5)})
+
+        client.delete('/questions', json={'ids': ids})
+
+    def test_bulk_change_questions_400(self):
+        for method, body in (('delete', {}), ('delete', {'dry_run': True}),
+                             ('delete', {'ids': 'all'}), ('delete', [1, 2]), ('patch', [13]),
+                             ('patch', {'ids': [13]}),
+                             ('patch', {'ids': [13], 'changes': {'id': 1}}),
+                             ('patch', {'ids': [13], 'changes': {'difficulty': 9}}),
+                             ('patch', {'ids': [13], 'changes': {'category': 100}})):
+            res = getattr(self.client(), method)('/questions', json=body)
+            data = json.loads(res.data)
+
+            self.assertEqual(res.status_code, 400)
+            self.assertEqual(data['success'], False)
+
     # -----------------------------------------------------------------------------------------------------------
 
     # This can only be done once!  Then the db needs to be reloaded
@@ -125,7 +802,7 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(len(data))
 
     def test_add_question_to_db_405(self):
-        res = self.client().delete('/questions')
+        res = self.client().put('/questions')
         data = json.loads(res.data)
 
         self.assertEqual(res.status_code, 405)
@@ -140,6 +817,112 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], False)
         self.assertTrue(len(data))
 
+    def test_add_question_to_db_bad_category(self):
+        res = self.client().post('/questions',
+                                 json={'question': 'question1', 'answer': 'answer1', 'category': 'Science',
+                                       'difficulty': 1})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+
+    # -----------------------------------------------------------------------------------------------------------
+
+    def test_bulk_import_questions_ndjson(self):
+        body = '\n'.join([
+            json.dumps({'question': 'bulk1', 'answer': 'answer1', 'category': 2, 'difficulty': 1}),
+            json.dumps({'question': 'bulk2', 'answer': 'answer2', 'category': 100, 'difficulty': 1}),
+            '{not json',
+            json.dumps({'question': 'bulk3', 'answer': 'answer3', 'category': 5, 'difficulty': 2})])
+
+        res = self.client().post('/questions/bulk', data=body,
+                                 content_type='application/x-ndjson')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['total_rows'], 4)
+        self.assertEqual(data['inserted'], 2)
+        self.assertEqual([error['line'] for error in data['errors']], [2, 3])
+
+    def test_bulk_import_questions_csv(self):
+        body = 'question,answer,category,difficulty\n"bulk4, with a comma",answer4,2,3\n'
+
+        res = self.client().post('/questions/bulk', data=body, content_type='text/csv')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['inserted'], 1)
+        self.assertEqual(data['error_count'], 0)
+
+    def test_bulk_import_questions_bad_encoding(self):
+        body = b'\n'.join([
+            json.dumps({'question': 'bulk5', 'answer': 'answer5', 'category': 2, 'difficulty': 1}).encode(),
+            b'{"question": "bulk6 \xff", "answer": "answer6", "category": 2, "difficulty": 1}',
+            b'question,answer'])
+
+        # The first row is committed in its own batch before the bad line is read
+        res = self.client().post('/questions/bulk?batch_size=1', data=body,
+                                 content_type='application/x-ndjson')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['inserted'], 1)
+        self.assertEqual(data['errors'], [{'line': 2, 'error': 'question is not valid UTF-8'},
+                                          {'line': 3, 'error': 'not a JSON object'}])
+
+        body = b'question,answer,category,difficulty\nbulk7,answer7,2,1\nbulk8 \xff,answer8,2,1\n'
+        res = self.client().post('/questions/bulk?batch_size=1', data=body, content_type='text/csv')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['inserted'], 1)
+        self.assertEqual(data['errors'], [{'line': 3, 'error': 'question is not valid UTF-8'}])
+
+    def test_bulk_import_questions_400(self):
+        res = self.client().post('/questions/bulk?format=xml', data='<questions/>')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+        self.assertTrue(len(data))
+
+    def test_bulk_import_questions_405(self):
+        res = self.client().get('/questions/bulk')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 405)
+        self.assertEqual(data['success'], False)
+        self.assertTrue(len(data))
+
+    # -----------------------------------------------------------------------------------------------------------
+
+    def test_export_questions(self):
+        res = self.client().get('/questions/export')
+        questions = [json.loads(line) for line in res.data.decode('utf-8').splitlines()]
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, 'application/x-ndjson')
+
+        data = json.loads(self.client().get('/questions').data)
+        self.assertEqual(len(questions), data['total_questions'])
+
+    def test_export_questions_csv_category(self):
+        res = self.client().get('/questions/export?format=csv&category=3')
+        lines = res.data.decode('utf-8').splitlines()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(lines[0], 'id,question,answer,category,difficulty')
+        self.assertEqual([line.split(',')[0] for line in lines[1:]], ['13', '14', '15'])
+
+    def test_export_questions_400(self):
+        res = self.client().get('/questions/export?format=xml')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+        self.assertTrue(len(data))
     # -----------------------------------------------------------------------------------------------------------
 
     def test_search_questions(self):
@@ -151,6 +934,101 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], True)
         self.assertTrue(len(data))
 
+    def test_search_questions_prefix(self):
+        res = self.client().post('/search', json={'searchTerm': 'world cu'})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['total_questions'], 2)
+        self.assertEqual(data['success'], True)
+
+    def test_search_questions_answers(self):
+        res = self.client().post('/search', json={'searchTerm': 'Scarab'})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['total_questions'], 0)
+
+        res = self.client().post('/search', json={'searchTerm': 'Scarab', 'searchAnswers': True})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['total_questions'], 1)
+        self.assertEqual(data['questions'][0]['id'], 23)
+
+    def test_search_questions_stopwords(self):
+        # Dropped by the full text search, found with ILIKE instead
+        for term in ('the', 'What', 'who'):
+            res = self.client().post('/search', json={'searchTerm': term})
+            data = json.loads(res.data)
+
+            self.assertEqual(res.status_code, 200)
+            self.assertTrue(data['total_questions'] > 0)
+
+    def test_search_indexes_migration(self):
+        with self.app.app_context():
+            upgrade()
+            indexes = [row[0] for row in db.session.execute(
+                "SELECT indexname FROM pg_indexes WHERE tablename = 'questions'")]
+
+        self.assertIn('ix_questions_question_fts', indexes)
+        self.assertIn('ix_questions_question_answer_fts', indexes)
+
+    def test_inverted_index_search(self):
+        with self.app.app_context():
+            questions, total = InvertedIndexSearchEngine().search('World Cup', 0, 10)
+
+        self.assertEqual(total, 2)
+        self.assertEqual(sorted(question.id for question in questions), [10, 11])
+
+    def test_search_questions_memory_index(self):
+        app = create_app({'SEARCH_BACKEND': 'memory'})
+        setup_db(app, self.database_path)
+        client = app.test_client()
+
+        client.post('/search', json={'searchTerm': 'Title'})
+        queries = self.count_queries(
+            lambda: client.post('/search', json={'searchTerm': 'Title'}), app)
+
+        self.assertEqual(queries, 0)
+
+    def test_search_index_follows_inserts_and_deletes(self):
+        with self.app.app_context():
+            engine = InvertedIndexSearchEngine()
+            engine.rebuild()
+
+            # Updates must be incremental from here on
+            engine.rebuild = mock.Mock(side_effect=AssertionError('rebuilt'))
+
+            question = Question(question='Which animal is a zebroid?',
+                                answer='A zebra hybrid', category=1, difficulty=1)
+            question.insert()
+            question_id = question.id
+
+            questions, total = engine.search('zebroid', 0, 10)
+            self.assertEqual([question.id for question in questions], [question_id])
+
+            question.delete()
+            questions, total = engine.search('zebroid', 0, 10)
+            self.assertEqual(total, 0)
+
+    def test_search_index_sees_other_processes(self):
+        with self.app.app_context():
+            engine = InvertedIndexSearchEngine(max_age=60)
+            engine.rebuild()
+
+            # Written behind the app's back, like another worker would
+            db.engine.execute(Question.__table__.insert(), [
+                {'question': 'Which bird is a quokkabird?', 'answer': 'None', 'category': 1,
+                 'difficulty': 1}])
+            self.addCleanup(db.engine.execute, Question.__table__.delete().where(
+                Question.question == 'Which bird is a quokkabird?'))
+
+            self.assertEqual(engine.search('quokkabird', 0, 10)[1], 0)
+
+            with mock.patch('flaskr.search.time.monotonic', return_value=time.monotonic() + 61):
+                self.assertEqual(engine.search('quokkabird', 0, 10)[1], 1)
+
     def test_search_questions_400(self):
         res = self.client().post('/search', json={'searchTerm': ''})
         data = json.loads(res.data)
@@ -178,6 +1056,107 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], True)
         self.assertTrue(len(data))
 
+    def test_get_questions_category_total(self):
+        res = self.client().get('/categories/3/questions?per_page=1')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(data['questions']), 1)
+        self.assertEqual(data['total_questions'], 3)
+
+    def test_get_stats(self):
+        res = self.client().get('/stats')
+        data = json.loads(res.data)
+        total = json.loads(self.client().get('/questions').data)['total_questions']
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['total_questions'], total)
+        self.assertEqual(data['categories']['3']['total_questions'], 3)
+        self.assertEqual(data['categories']['3']['type'], 'Geography')
+        self.assertEqual(sum(data['difficulties'].values()), total)
+        self.assertEqual(sum(category['total_questions']
+                             for category in data['categories'].values()), total)
+
+    def test_stats_follow_inserts_and_deletes(self):
+        with self.app.app_context():
+            stats = QuestionStats()
+            stats.rebuild()
+            total = stats.category_total(3)
+
+            # Updates must be incremental from here on
+            stats.rebuild = mock.Mock(side_effect=AssertionError('rebuilt'))
+
+            question = Question(question='Counted?', answer='Yes', category=3, difficulty=5)
+            question.insert()
+            self.assertEqual(stats.category_total(3), total + 1)
+            self.assertTrue(stats.summary()['categories'][3]['difficulties'][5] >= 1)
+
+            question.delete()
+            self.assertEqual(stats.category_total(3), total)
+
+    def test_stats_count_each_commit_once(self):
+        with self.app.app_context():
+            stats = QuestionStats()
+            stats.rebuild()
+            total = stats.total()
+
+            question = Question(question='Counted once?', answer='Yes', category=3, difficulty=5)
+            question.insert()
+            self.addCleanup(question.delete)
+            generation = stats._generation
+
+            # A read loading the counts between the bump and the listeners
+            # already sees the question
+            stats.rebuild()
+            stats.apply_changes([('questions', 'inserted', question.format())],
+                                {'questions': generation})
+            self.assertEqual(stats.total(), total + 1)
+
+            # A commit whose changes never reached the stats forces a reload
+            stats.apply_changes([('questions', 'deleted', question.format())],
+                                {'questions': generation + 2})
+            self.assertIsNone(stats._generation)
+
+    def test_stats_see_other_processes(self):
+        app = create_app({'SQLALCHEMY_DATABASE_URI': self.database_path})
+        client = app.test_client()
+        self.assertEqual(client.get('/categories/70/questions').status_code, 400)
+
+        # Written behind the app's back, like another worker would
+        with app.app_context():
+            db.engine.execute(Category.__table__.insert(), [{'id': 70, 'type': 'Elsewhere'}])
+            db.engine.execute(Question.__table__.insert(), [
+                {'question': 'Elsewhere {}?'.format(number), 'answer': 'Yes',
+                 'category': 70, 'difficulty': 1} for number in range(2)])
+
+        def cleanup():
+            with app.app_context():
+                db.engine.execute(Question.__table__.delete().where(Question.category == 70))
+                db.engine.execute(Category.__table__.delete().where(Category.id == 70))
+        self.addCleanup(cleanup)
+
+        res = client.get('/categories/70/questions')
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(json.loads(res.data)['total_questions'], 2)
+
+        # The counts were found stale and are loaded again
+        self.assertEqual(json.loads(client.get('/stats').data)['categories']['70']
+                         ['total_questions'], 2)
+
+    def test_stats_expire(self):
+        with self.app.app_context():
+            stats = QuestionStats(max_age=60)
+            stats.rebuild()
+            stats.rebuild = mock.Mock()
+
+            stats.summary()
+            stats.rebuild.assert_not_called()
+
+            with mock.patch('flaskr.stats.time.monotonic', return_value=time.monotonic() + 61):
+                stats.summary()
+            stats.rebuild.assert_called_once_with()
+
     def test_get_questions_category_405(self):
         res = self.client().post('/categories/1/questions')
         data = json.loads(res.data)
@@ -194,6 +1173,56 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], False)
         self.assertTrue(len(data))
 
+    def test_get_questions_category_invalid_id_400(self):
+        res = self.client().get('/categories/science/questions')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+        self.assertTrue(len(data))
+
+    def explain(self, query):
+        """Returns the PostgreSQL plan of a query, with sequential scans discouraged
+        so the plan shows whether an index can serve it even on a tiny table"""
+        statement = query.statement.compile(
+            dialect=db.engine.dialect, compile_kwargs={'literal_binds': True})
+
+        db.session.execute('SET LOCAL enable_seqscan = off')
+        plan = '\n'.join(row[0] for row in db.session.execute('EXPLAIN {}'.format(statement)))
+        db.session.rollback()
+
+        return plan
+
+    def test_category_queries_use_index(self):
+        with self.app.app_context():
+            upgrade()
+
+            category_page = Question.query.filter(
+                Question.category == 1).order_by(Question.id).limit(10)
+            quiz_ids = db.session.query(Question.id).filter(Question.category == 1)
+
+            self.assertIn('ix_questions_category_id', self.explain(category_page))
+            self.assertIn('ix_questions_category_id', self.explain(quiz_ids))
+
+    def test_create_app_does_not_connect(self):
+        # Nothing listens there, creating the app must not need the db
+        app = create_app({'SQLALCHEMY_DATABASE_URI': 'postgres://postgres@127.0.0.1:1/trivia'})
+        self.assertIn('/health', [rule.rule for rule in app.url_map.iter_rules()])
+
+    def test_db_upgrade_creates_tables(self):
+        handle, filename = tempfile.mkstemp(suffix='.db', prefix='trivia_schema_')
+        os.close(handle)
+        self.addCleanup(os.remove, filename)
+
+        app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + filename})
+        result = app.test_cli_runner().invoke(args=['db-upgrade'])
+        self.assertIn('Applied migration 1', result.output)
+
+        engine = create_engine('sqlite:///' + filename)
+        self.assertTrue({'questions', 'categories', 'schema_migrations'}
+                        <= set(engine.table_names()))
+        engine.dispose()
+
     # -----------------------------------------------------------------------------------------------------------
 
     def test_play_trivia_game(self):
@@ -205,6 +1234,24 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], True)
         self.assertTrue(len(data))
 
+    def test_play_trivia_game_skips_previous_questions(self):
+        res = self.client().post(
+            '/quizzes', json={'previous_questions': [13, 14], 'quiz_category': {'id': 3}})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['question']['id'], 15)
+
+    def test_play_trivia_game_all_played(self):
+        res = self.client().post(
+            '/quizzes', json={'previous_questions': [13, 14, 15], 'quiz_category': {'id': 3}})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['question'], None)
+
     def test_play_trivia_game_405(self):
         res = self.client().get(
             '/quizzes', json={'previous_questions': [], 'quiz_category': {'id': 1}})
@@ -222,6 +1269,336 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], False)
         self.assertTrue(len(data))
 
+    def test_play_trivia_game_invalid_category_400(self):
+        res = self.client().post(
+            '/quizzes', json={'previous_questions': [], 'quiz_category': {'id': 'science'}})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+        self.assertTrue(len(data))
+
+    def test_play_trivia_game_batch(self):
+        res = self.client().post('/quizzes', json={
+            'previous_questions': [13], 'quiz_category': {'id': 3}, 'count': 5})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(sorted(question['id'] for question in data['questions']), [14, 15])
+        self.assertEqual(data['question'], data['questions'][0])
+
+    def test_play_trivia_game_batch_seed(self):
+        client = self.client()
+        body = {'previous_questions': [], 'quiz_category': {'id': 0}, 'count': 5, 'seed': 42}
+
+        first = json.loads(client.post('/quizzes', json=body).data)['questions']
+
+        # Drawn from the cached ids, then loaded with a single query
+        queries = self.count_queries(lambda: self.assertEqual(
+            json.loads(client.post('/quizzes', json=body).data)['questions'], first))
+
+        self.assertEqual(queries, 1)
+        self.assertEqual(len(set(question['id'] for question in first)), 5)
+
+    def test_play_trivia_game_batch_400(self):
+        res = self.client().post('/quizzes', json={
+            'previous_questions': [], 'quiz_category': {'id': 3}, 'count': 0})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+        self.assertTrue(len(data))
+
+    def test_play_trivia_game_adaptive(self):
+        client = self.client()
+        body = {'previous_questions': [], 'quiz_category': {'id': 3},
+                'adaptive': {'difficulty': 2, 'answers': [True, True, False]}}
+
+        # Mostly right: one step up, to the only difficulty 3 question
+        res = client.post('/quizzes', json=body)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['difficulty'], 3)
+        self.assertEqual(data['question']['id'], 14)
+
+        # Once played, the band widens to the difficulty 2 questions
+        body['previous_questions'] = [14]
+        data = json.loads(client.post('/quizzes', json=body).data)
+        self.assertEqual(data['difficulty'], 3)
+        self.assertIn(data['question']['id'], [13, 15])
+
+        body['previous_questions'] = [13, 14, 15]
+        data = json.loads(client.post('/quizzes', json=body).data)
+        self.assertEqual(data['question'], None)
+
+    def test_next_difficulty(self):
+        self.assertEqual(next_difficulty(None, []), 3)
+        self.assertEqual(next_difficulty(3, [True, True, False]), 4)
+        self.assertEqual(next_difficulty(3, [True, False, False]), 2)
+        self.assertEqual(next_difficulty(3, [True, False]), 3)
+        # Only the last answers count
+        self.assertEqual(next_difficulty(3, [True, True, True, False, False, False]), 2)
+        self.assertEqual(next_difficulty(5, [True]), 5)
+        self.assertEqual(next_difficulty(1, [False]), 1)
+
+    def test_difficulty_index_follows_changes(self):
+        with self.app.app_context():
+            index = DifficultyIndex()
+            self.assertEqual(list(index.ids(3, 2)), [13, 15])
+
+            # Updates must be incremental from here on
+            index.rebuild = mock.Mock(side_effect=AssertionError('rebuilt'))
+
+            question = Question(question='Indexed?', answer='Yes', category=3, difficulty=5)
+            question.insert()
+            self.assertIn(question.id, index.ids(3, 5))
+            self.assertIn(question.id, index.ids(0, 5))
+
+            question.difficulty = 1
+            question.update()
+            self.assertNotIn(question.id, index.ids(3, 5))
+            self.assertIn(question.id, index.ids(3, 1))
+
+            question.delete()
+            self.assertNotIn(question.id, index.ids(3, 1))
+            self.assertNotIn(question.id, index.ids(0, 1))
+
+    def test_play_trivia_game_adaptive_400(self):
+        quiz = {'previous_questions': [], 'quiz_category': {'id': 3}}
+
+        for extra in ({'adaptive': {'answers': 'yes'}}, {'adaptive': {'difficulty': 'hard'}},
+                      {'adaptive': [True]},
+                      # No batches in adaptive mode
+                      {'adaptive': {'answers': [True]}, 'count': 2}):
+            res = self.client().post('/quizzes', json=dict(quiz, **extra))
+            data = json.loads(res.data)
+
+            self.assertEqual(res.status_code, 400)
+            self.assertEqual(data['success'], False)
+
+    # -----------------------------------------------------------------------------------------------------------
+
+    def play_quiz_session(self, client):
+        res = client.post('/quizzes/sessions', json={'quiz_category': {'id': 3}})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['total_questions'], 3)
+
+        played = []
+        for _ in range(3):
+            res = client.post('/quizzes/sessions/{}/next'.format(data['session_id']))
+            played.append(json.loads(res.data)['question']['id'])
+
+        self.assertEqual(sorted(played), [13, 14, 15])
+
+        res = client.post('/quizzes/sessions/{}/next'.format(data['session_id']))
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(json.loads(res.data)['question'], None)
+
+    def test_quiz_session(self):
+        self.play_quiz_session(self.client())
+
+    def test_quiz_session_redis_store(self):
+        app = create_app({'QUIZ_SESSION_STORE': RedisSessionStore(FakeRedis())})
+        setup_db(app, self.database_path)
+
+        self.play_quiz_session(app.test_client())
+
+    def test_end_quiz_session(self):
+        res = self.client().post('/quizzes/sessions', json={'quiz_category': {'id': 3}})
+        session_id = json.loads(res.data)['session_id']
+
+        res = self.client().delete('/quizzes/sessions/{}'.format(session_id))
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+
+        res = self.client().post('/quizzes/sessions/{}/next'.format(session_id))
+        self.assertEqual(res.status_code, 404)
+
+    def test_quiz_session_404(self):
+        res = self.client().post('/quizzes/sessions/unknown/next')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(data['success'], False)
+        self.assertTrue(len(data))
+
+    def test_quiz_session_400(self):
+        res = self.client().post('/quizzes/sessions', json={})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+        self.assertTrue(len(data))
+
+    def create_packs_app(self, **config):
+        directory = tempfile.mkdtemp(prefix='trivia_packs_')
+        self.addCleanup(shutil.rmtree, directory)
+
+        app = create_app(dict(config, QUIZ_PACK_DIR=directory))
+        setup_db(app, self.database_path)
+        return app
+
+    def test_quiz_packs(self):
+        app = self.create_packs_app()
+        result = app.test_cli_runner().invoke(args=['generate-quiz-packs', '--day', '2026-01-01'])
+        self.assertIn('2026-01-01:', result.output)
+
+        res = app.test_client().get('/quizzes/packs?day=2026-01-01')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('2026-01-01-3-2', data['packs'])
+        self.assertIn('2026-01-01-0-2', data['packs'])
+
+        # Served from the files by another app, gzipped as stored
+        other_app = create_app({'QUIZ_PACK_DIR': app.config['QUIZ_PACK_DIR']})
+        setup_db(other_app, self.database_path)
+
+        res = other_app.test_client().get('/quizzes/packs/2026-01-01-3-2',
+                                          headers={'Accept-Encoding': 'gzip'})
+        data = json.loads(gzip.decompress(res.data))
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(sorted(question['id'] for question in data['questions']), [13, 15])
+
+        res = other_app.test_client().get('/quizzes/packs/2026-01-01-3-2',
+                                          headers={'If-None-Match': res.headers['ETag']})
+        self.assertEqual(res.status_code, 304)
+
+        for pack_id in ('2026-01-01-3-9', '2026-01-01-3', '2026-13-01-3-2'):
+            res = app.test_client().get('/quizzes/packs/' + pack_id)
+            self.assertEqual(res.status_code, 404)
+
+        res = app.test_client().get('/quizzes/packs?day=tomorrow')
+        self.assertEqual(res.status_code, 400)
+
+    def test_quiz_pack_after_delete(self):
+        app = self.create_packs_app(QUIZ_PACK_SIZE=1)
+        client = app.test_client()
+
+        with app.app_context():
+            questions = [Question(question='Pack {}?'.format(number), answer='Yes',
+                                  category=3, difficulty=5) for number in range(2)]
+            for question in questions:
+                question.insert()
+            question_ids = [question.id for question in questions]
+
+        # Generated in the background, along with the next day
+        PackScheduler(app, app.extensions['trivia']['quiz_packs'], 60).run_once()
+        pack_url = '/quizzes/packs/{}-3-5'.format(today().isoformat())
+
+        first = json.loads(client.get(pack_url).data)['questions'][0]['id']
+        self.assertIn(first, question_ids)
+
+        # Only the deleted question is replaced
+        client.delete('/questions/{}'.format(first))
+        second = json.loads(client.get(pack_url).data)['questions'][0]['id']
+        self.assertEqual(second, (set(question_ids) - {first}).pop())
+
+        client.delete('/questions/{}'.format(second))
+        self.assertEqual(client.get(pack_url).status_code, 404)
+
+    def test_quiz_packs_on_demand(self):
+        # No QUIZ_PACK_DIR, no scheduler: today's packs are built when asked for
+        app = create_app({'SQLALCHEMY_DATABASE_URI': self.database_path, 'QUIZ_PACK_SIZE': 1})
+        client = app.test_client()
+
+        with app.app_context():
+            questions = [Question(question='Pack elsewhere {}?'.format(number), answer='Yes',
+                                  category=3, difficulty=5) for number in range(2)]
+            for question in questions:
+                question.insert()
+            question_ids = [question.id for question in questions]
+
+        def cleanup():
+            with app.app_context():
+                db.engine.execute(Question.__table__.delete().where(Question.id.in_(question_ids)))
+        self.addCleanup(cleanup)
+
+        pack_url = '/quizzes/packs/{}-3-5'.format(today().isoformat())
+        self.assertIn(pack_url.rsplit('/', 1)[1],
+                      json.loads(client.get('/quizzes/packs').data)['packs'])
+
+        first = json.loads(client.get(pack_url).data)['questions'][0]['id']
+        self.assertIn(first, question_ids)
+
+        # Deleted behind the app's back, like another worker would
+        with app.app_context():
+            db.engine.execute(Question.__table__.delete().where(Question.id == first))
+
+        self.assertEqual(json.loads(client.get(pack_url).data)['questions'][0]['id'], first)
+
+        with mock.patch('flaskr.packs.time.monotonic', return_value=time.monotonic() + 61):
+            second = json.loads(client.get(pack_url).data)['questions'][0]['id']
+        self.assertEqual(second, (set(question_ids) - {first}).pop())
+
+    # -----------------------------------------------------------------------------------------------------------
+
+    @unittest.skipUnless(find_spec('asgiref') and find_spec('asyncpg'), 'needs asgiref and asyncpg')
+    def test_asgi_app(self):
+        app = create_asgi_app({'SQLALCHEMY_DATABASE_URI': self.database_path})
+
+        async def requests():
+            try:
+                # Served on the event loop
+                status, data = await asgi_request(app, 'POST', '/quizzes', {
+                    'previous_questions': [13, 14], 'quiz_category': {'id': 3}})
+                self.assertEqual(status, 200)
+                self.assertEqual(data['question']['id'], 15)
+
+                status, data = await asgi_request(app, 'POST', '/quizzes', {
+                    'previous_questions': [13], 'quiz_category': {'id': 3}, 'count': 5})
+                self.assertEqual(sorted(question['id'] for question in data['questions']),
+                                 [14, 15])
+
+                body = {'previous_questions': [], 'quiz_category': {'id': 0},
+                        'count': 5, 'seed': 42}
+                status, data = await asgi_request(app, 'POST', '/quizzes', body)
+                self.assertEqual(data['questions'], json.loads(
+                    app.flask_app.test_client().post('/quizzes', json=body).data)['questions'])
+
+                status, data = await asgi_request(app, 'POST', '/quizzes', {
+                    'previous_questions': [], 'quiz_category': {'id': 3},
+                    'adaptive': {'difficulty': 2, 'answers': [True, True]}})
+                self.assertEqual(status, 200)
+                self.assertEqual(data['question']['id'], 14)
+
+                status, data = await asgi_request(app, 'POST', '/quizzes', {})
+                self.assertEqual(status, 400)
+                self.assertEqual(data['success'], False)
+
+                status, data = await asgi_request(app, 'POST', '/quizzes/sessions/nope/next')
+                self.assertEqual(status, 404)
+
+                # Served by the Flask app
+                status, data = await asgi_request(app, 'POST', '/quizzes/sessions',
+                                                  {'quiz_category': {'id': 3}})
+                self.assertEqual(status, 200)
+
+                path = '/quizzes/sessions/{}/next'.format(data['session_id'])
+                played = []
+                for _ in range(3):
+                    status, data = await asgi_request(app, 'POST', path)
+                    played.append(data['question']['id'])
+                self.assertEqual(sorted(played), [13, 14, 15])
+
+                status, data = await asgi_request(app, 'GET', '/categories')
+                self.assertEqual(status, 200)
+                self.assertEqual(len(data['categories']), 6)
+            finally:
+                await app.close()
+
+        asyncio.run(requests())
+
     # -----------------------------------------------------------------------------------------------------------
 
 